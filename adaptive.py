@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+
+''' Adaptive (AIMD) concurrency control for download workers '''
+
+import time
+import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+
+class AdaptiveLimiter:
+    ''' Grows the number of active downloads while throughput improves, halves it on errors/429 '''
+
+    def __init__(self, initial: int=4, min_level: int=1, max_level: int=64, per_host: int=None,
+                 interval: float=2.0, error_threshold: float=0.1, clock=time.monotonic):
+        self.level = max(min_level, min(initial, max_level))
+        self.min_level = min_level
+        self.max_level = max_level
+        self.per_host = per_host
+        self.interval = interval
+        self.error_threshold = error_threshold
+        self.clock = clock
+
+        self._active = 0
+        self._host_active = defaultdict(int)
+        self._cond = asyncio.Condition()
+
+        # measurements of current window
+        self._window_start = clock()
+        self._bytes = 0
+        self._ok = 0
+        self._errors = 0
+        self._throttled = 0
+        self._latency = 0.0
+
+        # state of previous window
+        self._last_throughput = None
+        self._base_latency = None
+        self._increased = False
+
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+
+    def _can_start(self, host) -> bool:
+        if self._active >= self.level:
+            return False
+        return self.per_host is None or self._host_active[host] < self.per_host
+
+
+    @asynccontextmanager
+    async def slot(self, host: str=None):
+        '''wait until current level and per-host cap allow another download'''
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._can_start(host))
+            self._active += 1
+            self._host_active[host] += 1
+        try:
+            yield self
+        finally:
+            async with self._cond:
+                self._active -= 1
+                self._host_active[host] -= 1
+                self._cond.notify_all()
+
+
+    async def record(self, nbytes: int, latency: float, ok: bool, status: int=None) -> None:
+        '''record outcome of one download, adjusting level once per interval'''
+        self._bytes += nbytes
+        self._latency += latency
+        if ok:
+            self._ok += 1
+        else:
+            self._errors += 1
+            if status == 429:
+                self._throttled += 1
+
+        if self.clock() - self._window_start >= self.interval:
+            previous = self.level
+            self._adjust()
+            if self.level > previous:
+                async with self._cond:
+                    self._cond.notify_all()
+
+
+    def _adjust(self) -> None:
+        now = self.clock()
+        elapsed = max(now - self._window_start, 1e-9)
+        requests = self._ok + self._errors
+        throughput = self._bytes / elapsed
+        error_rate = self._errors / requests if requests else 0.0
+        latency = self._latency / requests if requests else None
+
+        if latency is not None and (self._base_latency is None or latency < self._base_latency):
+            self._base_latency = latency
+
+        increased = False
+        if self._throttled or error_rate > self.error_threshold:
+            # multiplicative decrease on throttling or errors
+            self.level = max(self.min_level, self.level // 2)
+        elif self._last_throughput is None or throughput > self._last_throughput * 1.05:
+            # additive increase while more workers still buy throughput
+            self.level = min(self.max_level, self.level + 1)
+            increased = True
+        elif self._increased and throughput < self._last_throughput * 0.95:
+            # last increase made things worse, step back
+            self.level = max(self.min_level, self.level - 1)
+        elif latency is not None and latency > 3 * self._base_latency:
+            # same throughput at much higher latency means we are queueing
+            self.level = max(self.min_level, self.level - 1)
+
+        self._increased = increased
+        self._last_throughput = throughput
+        self._window_start = now
+        self._bytes = self._ok = self._errors = self._throttled = 0
+        self._latency = 0.0
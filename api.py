@@ -1,53 +1,173 @@
 #!/usr/bin/python3
-import os
 import sys
 import json
+import time
 import random
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from robots import getAllowedAgents
-from proxies import fetch_proxies, get_my_ip
+from proxies import ProxyPool, get_my_ip
+from cache import ResponseCache
+from filters import Predicate
+from governor import RateGovernor
+from sessions import SessionStore
+from utils import chromedriver_path, download_chromedriver
+from metrics import SIGN_SECONDS, API_SECONDS, PAGES, ITEMS_PER_PAGE
+from urllib.parse import urlparse, parse_qs, quote
+
+
+# page that defines window.byted_acrawler
+SIGNER_URL = 'https://www.tiktok.com/trending'
+
+# seconds to wait for signer page to become ready
+SIGNER_TIMEOUT = 30
+
+# item_list type and sourceType of each feed
+USER_FEED = (1, 8)
+HASHTAG_FEED = (3, 8)
+MUSIC_FEED = (4, 11)
+TRENDING_FEED = (5, 12)
+
+# concurrent paginators of multi-target scrapes
+MAX_TARGET_WORKERS = 8
+
+# pages a filtering paginator scans before giving up, feeds like trending never run out
+MAX_FILTER_PAGES = 100
+
+# requests a lean driver never makes: media, images, styles, fonts and analytics
+LEAN_BLOCKED_URLS = [
+    '*.mp4', '*.webm', '*.m3u8', '*.mp3',
+    '*.jpg', '*.jpeg', '*.png', '*.gif', '*.webp', '*.svg', '*.ico', '*.image',
+    '*.css', '*.woff', '*.woff2', '*.ttf', '*.otf',
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+    '*mon.tiktokv.com*', '*mcs.tiktokv.com*', '*log.tiktokv.com*', '*/monitor_browser/*', '*/slardar/*',
+]
+
+
+# query parameters naming the user, hashtag or feed a request is about
+TARGET_PARAMS = ('type', 'id', 'uniqueId', 'challengeName')
+
+
+def request_target(url: str) -> str:
+    '''circuit breaker key, endpoint plus its target, so one dead target does not pause the others'''
+    parsed = urlparse(url)
+    query = parse_qs(parsed.query)
+    params = '&'.join(f'{name}={query[name][0]}' for name in TARGET_PARAMS if name in query)
+    return f'{parsed.path}?{params}' if params else parsed.path
+
+
+def rejected(error: Exception) -> bool:
+    '''HTTP 4xx other than rate limiting, the request itself was refused'''
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    return status is not None and 400 <= status < 500 and status != 429
+
+
+def valid_reply(reply) -> bool:
+    '''API replies with non-zero statusCode are retried'''
+    return isinstance(reply, dict) and reply.get('statusCode', 0) == 0
+
+
+def valid_items(reply) -> bool:
+    '''item_list replies must also carry items unless the feed is exhausted'''
+    return valid_reply(reply) and (bool(reply.get('items')) or not reply.get('hasMore'))
+
+
+def valid_details(reply) -> bool:
+    return valid_reply(reply) and 'userInfo' in reply
+
+
+def valid_challenge(reply) -> bool:
+    return valid_reply(reply) and 'challengeInfo' in reply
 
 
 class TikTok:
     ''' TikTok object with Selenium '''
 
-    # Get Allow: / from robots.txt
-    USER_AGENTS = getAllowedAgents()
+    def __init__(self, path: str=None, proxify: bool=False, http_fetch: bool=False, show_ip: bool=False, proxy_pool: ProxyPool=None, rotate_proxies: bool=False, cache: ResponseCache=None, governor: RateGovernor=None, signer=None,
+                 lean: bool=False, debugger_address: str=None, session_store: SessionStore=None, driver=None, user_agent: str=None):
+        # User-Agent, verifyFp and cookies of a previous run, kept until the API rejects them
+        self.session_store = session_store
+        saved = session_store.load() if session_store is not None else None
+        self._restored = saved is not None
+        self._restoredCookies = saved['cookies'] if saved else []
+        self._sessionSaved = self._restored
 
-    def __init__(self, path: str=None, proxify: bool=False):
-        # select random UserAgent from robots.txt
-        self.UserAgent = random.choice(TikTok.USER_AGENTS)
+        # select random UserAgent from robots.txt (Allow: /), cached on disk
+        self.UserAgent = user_agent or (saved['user_agent'] if saved else random.choice(getAllowedAgents()))
 
         # self.UserAgent = 'Twitterbot'
         print(f'User-Agent: {self.UserAgent}')
 
         # show current ip
-        my_ip = get_my_ip()
-        print(f'IP Address: {my_ip}')
-
-        # configure proxy
-        if proxify:
-            new_proxy = fetch_proxies()[0]
-            proxy_host = new_proxy['ip']
-            proxy_port = int(new_proxy['port'])
-            proxy = f'{proxy_host}:{proxy_port}'
-            print(f'Using proxy: {proxy}')
-
-            webdriver.DesiredCapabilities.CHROME['proxy'] = {
-                'httpProxy': proxy,
-                'ftpProxy': proxy,
-                'sslProxy': proxy,
-                'proxyType': 'MANUAL',
-            }
-
-        # define chromedriver executable
-        executable = 'chromedriver'
-        if os.name == 'nt':
-        	executable += '.exe'
-
-        # set default webdriver path	
-        self.driver_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), executable) if path is None else path 
+        if show_ip:
+            my_ip = get_my_ip()
+            print(f'IP Address: {my_ip}')
+
+        # configure proxy, one validated proxy per driver
+        self.proxy = None
+        self.proxy_pool = proxy_pool
+        self.rotate_proxies = rotate_proxies
+        if proxify or proxy_pool is not None:
+            if self.proxy_pool is None:
+                self.proxy_pool = ProxyPool()
+            self.proxy = self.proxy_pool.rotate()
+            print(f'Using proxy: {self.proxy}')
+
+        # sign in an embedded JS runtime instead of Chrome, which leaves only HTTP fetching
+        self.signer = signer
+        self.driver = None
+        self.signer_handle = self.fetch_handle = None
+        self.attached = False
+        if signer is not None:
+            if saved:
+                signer.verifyFp = saved['verifyFp']
+            signer.start(self.UserAgent)
+            http_fetch = True
+        else:
+            if driver is not None:
+                # already started driver, or a stand-in for tests and benchmarks, used as is
+                self.driver = driver
+                self.signer_handle = driver.current_window_handle
+            else:
+                self._startChrome(path, lean, debugger_address)
+            if saved:
+                self._restoreBrowserCookies()
+
+        # fetch signed API urls over plain HTTP instead of the browser
+        self.http_fetch = http_fetch
+        self.session = None
+
+        # optional response cache for user/detail and item_list
+        self.cache = cache
+
+        # one driver serves the paginators of all targets, fetches over HTTP run in parallel
+        self._driverLock = threading.RLock()
+
+        # rate limit and retry policy, shared by all TikTok objects by default
+        self.governor = governor if governor is not None else RateGovernor.shared()
+
+        # set tiktok default variables
+        self.language = 'en'
+        self.region = 'PH'
+        self.type = 1
+        self.secUid = 0
+        self.verifyFp = saved['verifyFp'] if saved else None
+        self.maxCount = 99
+        self.minCursor = 0
+        self.maxCursor = 0
+        self.nextCursor = None
+        self.sourceType = 8 # 12 for trending
+
+
+    def _startChrome(self, path: str=None, lean: bool=False, debugger_address: str=None) -> None:
+        '''start headless Chrome, or attach to a running one, whose trending tab provides byted_acrawler.sign'''
+        # set default webdriver path, the provisioned driver for the installed Chrome
+        self.driver_path = (chromedriver_path() or download_chromedriver()) if path is None else path
 
         # set chrome options
         self.chrome_options = Options()
@@ -60,10 +180,46 @@ class TikTok:
         self.chrome_options.add_argument('--incognito')
         self.chrome_options.add_argument('--log-level=3')
         self.chrome_options.add_argument(f'user-agent={self.UserAgent}')
+        if self.proxy:
+            self.chrome_options.add_argument(f'--proxy-server={self.proxy}')
+
+        # the signer page needs its scripts only, never images or video previews
+        if lean:
+            self.chrome_options.add_argument('--blink-settings=imagesEnabled=false')
+            self.chrome_options.add_argument('--mute-audio')
+            self.chrome_options.add_argument('--disable-extensions')
+            self.chrome_options.add_argument('--disable-background-networking')
+            self.chrome_options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+
+        # long-lived browser started with --remote-debugging-port, launch options above don't apply to it
+        if debugger_address:
+            self.chrome_options = Options()
+            self.chrome_options.page_load_strategy = 'none'
+            self.chrome_options.add_experimental_option('debuggerAddress', debugger_address)
+            self.attached = True
+            if self.proxy:
+                print(f'Proxy {self.proxy} ignored, attached browser keeps its own network settings')
 
         # start webdriver
         self.driver = webdriver.Chrome(self.driver_path, options=self.chrome_options)
 
+        # first tab is reserved for the signer page, API replies are loaded in a second tab;
+        # an attached browser is shared, so this object works in tabs of its own
+        if self.attached:
+            self.driver.execute_script('window.open("about:blank", "_blank");')
+            self.signer_handle = self.driver.window_handles[-1]
+            self.driver.switch_to.window(self.signer_handle)
+            # signatures must match the User-Agent of HTTP fetches
+            self.driver.execute_cdp_cmd('Network.setUserAgentOverride', {'userAgent': self.UserAgent})
+        else:
+            self.signer_handle = self.driver.current_window_handle
+        self.fetch_handle = None
+
+        # block remaining heavy requests of the signer page through CDP
+        if lean:
+            self.driver.execute_cdp_cmd('Network.enable', {})
+            self.driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': LEAN_BLOCKED_URLS})
+
         # modify HTTP request headers
         self.driver.header_overrides = {
             'method': 'GET',
@@ -72,91 +228,405 @@ class TikTok:
             'upgrade-insecure-requests': '1',
         }
 
-        # set tiktok default variables
-        self.language = 'en'
-        self.region = 'PH'
-        self.type = 1
-        self.secUid = 0
-        self.verifyFp = None
-        self.maxCount = 99
-        self.minCursor = 0
-        self.maxCursor = 0
-        self.sourceType = 8 # 12 for trending
-
 
     def __del__(self):
-        self.driver.quit()
+        if getattr(self, 'session', None) is not None:
+            self.session.close()
+        if getattr(self, 'signer', None) is not None:
+            self.signer.close()
+        if getattr(self, 'driver', None) is not None:
+            if getattr(self, 'attached', False):
+                self._closeTabs()
+            self.driver.quit()
+
+
+    def _closeTabs(self) -> None:
+        '''close the tabs this object opened in an attached browser, leaving the browser running'''
+        for handle in (self.fetch_handle, self.signer_handle):
+            try:
+                if handle in self.driver.window_handles:
+                    self.driver.switch_to.window(handle)
+                    self.driver.close()
+            except Exception:
+                pass
+
+
+    def _restoreBrowserCookies(self) -> None:
+        '''set saved cookies through CDP, no navigation needed'''
+        cookies = [{key: value for key, value in (('name', cookie['name']), ('value', cookie['value']),
+                                                  ('domain', cookie.get('domain') or '.tiktok.com'), ('path', cookie.get('path', '/')),
+                                                  ('secure', cookie.get('secure')), ('httpOnly', cookie.get('httpOnly')),
+                                                  ('expires', cookie.get('expiry'))) if value is not None}
+                   for cookie in self._restoredCookies]
+        try:
+            self.driver.execute_cdp_cmd('Network.setCookies', {'cookies': cookies})
+        except Exception as e:
+            print(f'Saved cookies not restored ({e})')
+
+
+    def _sessionCookies(self) -> list:
+        '''cookies of this session in get_cookies() format, including those set on HTTP replies'''
+        cookies = {cookie['name']: cookie for cookie in (self.signer.cookies() if self.signer is not None else self.driver.get_cookies())}
+        if self.session is not None:
+            for cookie in self.session.cookies:
+                cookies.setdefault(cookie.name, {'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain,
+                                                 'path': cookie.path, 'expiry': cookie.expires})
+        return list(cookies.values())
+
+
+    def _saveSession(self) -> None:
+        '''persist session once it has produced a valid reply'''
+        if self.session_store is None or self._sessionSaved:
+            return
+        try:
+            with self._driverLock:
+                cookies = self._sessionCookies()
+            self.session_store.save(self.UserAgent, self.verifyFp, cookies)
+            self._sessionSaved = True
+        except Exception as e:
+            print(f'Session not saved ({e})')
+
+
+    def _refreshSession(self) -> None:
+        '''drop a restored session the API rejected, the next attempt starts a fresh one'''
+        print('Saved session rejected, starting a fresh one')
+        self._restored = False
+        self._restoredCookies = []
+        self._sessionSaved = False
+        self.session_store.clear()
+
+        with self._driverLock:
+            self.verifyFp = None
+            if self.signer is not None:
+                self.signer.close()
+                self.signer.verifyFp = None
+                self.signer.start(self.UserAgent)
+            else:
+                # a reload of the signer page issues a new s_v_web_id
+                self.driver.delete_all_cookies()
+                self.driver.switch_to.window(self.signer_handle)
+                self.driver.get('about:blank')
+            if self.session is not None:
+                self.session.cookies.clear()
+
+
+    def _signerReady(self) -> bool:
+        '''check if signing function is available in current tab'''
+        script = 'return typeof window.byted_acrawler !== "undefined" && typeof window.byted_acrawler.sign === "function";'
+        return bool(self.driver.execute_script(script))
+
+
+    def _warmSigner(self) -> None:
+        '''switch to signer tab, loading signer page only if byted_acrawler is missing'''
+        if self.signer is not None:
+            self.signer.warm()
+            self.verifyFp = self.verifyFp or self.signer.verifyFp
+            return
+
+        self.driver.switch_to.window(self.signer_handle)
+
+        # page is still warm, nothing to do
+        if self._signerReady():
+            return
+
+        # (re)load signer page and wait for byted_acrawler to be defined
+        self.driver.get(SIGNER_URL)
+        deadline = time.time() + SIGNER_TIMEOUT
+        while not self._signerReady():
+            if time.time() > deadline:
+                raise Exception(f'Signer not available after {SIGNER_TIMEOUT}s, possibly bad User-Agent. Please try again.')
+            time.sleep(0.1)
+
+        # save cookie information if not present
+        if not self.verifyFp:
+            cookie = self.driver.get_cookie('s_v_web_id')
+            if cookie:
+                self.verifyFp = cookie['value']
+
+        # signer page may have issued new cookies
+        if self.session is not None:
+            self._syncCookies()
 
 
     def _signURL(self, url):
         '''Sign URL using duD4 function defined in webpackJsonp'''
-        sign_js_url = 'https://www.tiktok.com/trending'
-        self.driver.get(sign_js_url)
+        return self.sign_many([url])[0]
+
+
+    def sign_many(self, urls: list) -> list:
+        '''Sign a batch of URLs in a single execute_script round trip'''
+        if not urls:
+            return []
+
+        with self._driverLock:
+            self._warmSigner()
+            return self._signWarm(urls)
+
+
+    def _signWarm(self, urls: list) -> list:
+        '''sign urls on the already warm signer tab'''
+        # execute JS in browser to sign all urls
+        script = 'return arguments[0].map(function (url) { return window.byted_acrawler.sign({ url: url }); });'
+        with SIGN_SECONDS.time():
+            if self.signer is not None:
+                return self.signer.sign_many(urls)
+            return self.driver.execute_script(script, list(urls))
+
+
+    def _httpSession(self) -> requests.Session:
+        '''keep-alive HTTP session sharing cookies and User-Agent with the driver'''
+        if self.session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({
+                'User-Agent': self.UserAgent,
+                'Accept-Encoding': 'gzip, deflate',
+                'Referer': SIGNER_URL,
+            })
+            if self.proxy:
+                session.proxies = {'http': f'http://{self.proxy}', 'https': f'http://{self.proxy}'}
+            self.session = session
+            self._syncCookies()
+        return self.session
+
+
+    def _syncCookies(self) -> None:
+        '''copy driver cookies (s_v_web_id and others) into HTTP session'''
+        cookies = self.signer.cookies() if self.signer is not None else self.driver.get_cookies()
+        for cookie in self._restoredCookies + cookies:
+            self.session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain'), path=cookie.get('path', '/'))
+
+
+    def _fetchRotated(self, url) -> dict:
+        '''fetch url through next proxy of the pool, reporting outcome back to it'''
+        proxy = self.proxy_pool.rotate()
+        proxies = {'http': f'http://{proxy}', 'https': f'http://{proxy}'}
+        start = time.monotonic()
+        try:
+            reply = self._httpSession().get(url, proxies=proxies)
+            reply.raise_for_status()
+            data = json.loads(reply.content)
+        except Exception:
+            self.proxy_pool.report(proxy, False)
+            raise
+        self.proxy_pool.report(proxy, True, time.monotonic() - start)
+        return data
+
+
+    def _fetchJSON(self, url) -> dict:
+        '''fetch signed url and parse JSON reply'''
+        if self.http_fetch:
+            # per-request proxy rotation, only possible outside the browser
+            if self.rotate_proxies and self.proxy_pool is not None:
+                return self._fetchRotated(url)
+            reply = self._httpSession().get(url)
+            reply.raise_for_status()
+            return json.loads(reply.content)
+
+        # open fetch tab once so the signer tab stays warm
+        if self.fetch_handle not in self.driver.window_handles:
+            self.driver.execute_script('window.open("about:blank", "_blank");')
+            self.fetch_handle = [h for h in self.driver.window_handles if h != self.signer_handle][-1]
+
+        self.driver.switch_to.window(self.fetch_handle)
+        self.driver.get(url)
+        return json.loads(self.driver.find_element_by_tag_name('pre').text)
 
-        # save cookie information if not present
-        if not self.verifyFp:
-            self.verifyFp = self.driver.get_cookie('s_v_web_id')['value']
 
-        # execute JS in browser sign url
-        script = 'return window.byted_acrawler.sign({ url: "' + url + '" });'
-        signature = self.driver.execute_script(script)
+    def _signAndFetch(self, url) -> dict:
+        '''sign url with a fresh signature and fetch it'''
+        with self._driverLock:
+            # warm signer first so verifyFp is available for the request url
+            self._warmSigner()
+            url = f'{url}&verifyFp={self.verifyFp if self.verifyFp else ""}'
 
-        return signature
+            # get signature for request url
+            signature = self._signWarm([url])[0]
 
+            # browser fetches share the driver, HTTP fetches happen outside the lock
+            if not self.http_fetch:
+                return self._fetchJSON(f'{url}&_signature={signature}')
 
-    def getUserDetails(self, username):
-        url = f'https://m.tiktok.com/api/user/detail/?uniqueId={username}&language={self.language}&verifyFp={self.verifyFp if self.verifyFp else ""}'
+        # affix signature to request url and send request
+        return self._fetchJSON(f'{url}&_signature={signature}')
 
-        signature = self._signURL(url)
-        url = f'{url}&_signature={signature}'
 
-        self.driver.get(url)
+    def _checkedFetch(self, url, valid) -> dict:
+        '''sign and fetch url, refreshing a restored session once the API rejects it'''
+        # timeouts, resets, proxy and server errors are retried by the governor with the session kept
+        try:
+            reply = self._signAndFetch(url)
+        except Exception as e:
+            if self._restored and rejected(e):
+                self._refreshSession()
+            raise
+        if self._restored and not valid(reply):
+            self._refreshSession()
+        return reply
+
 
-        text = self.driver.page_source
-        details = json.loads(self.driver.find_element_by_tag_name('pre').text)
+    def _getSigned(self, url, valid=valid_reply) -> dict:
+        '''sign and fetch API url under the rate governor, served from response cache when possible'''
+        # cache keys ignore verifyFp/_signature, so a hit needs neither signer nor fetch
+        if self.cache is not None:
+            reply = self.cache.get(url)
+            if reply is not None:
+                return reply
+
+        # retries re-sign the same url, so pagination keeps its current cursor
+        endpoint = urlparse(url).path
+        with API_SECONDS.time(endpoint=endpoint):
+            reply = self.governor.call(request_target(url), lambda: self._checkedFetch(url, valid), valid, label=endpoint)
+        self._saveSession()
+
+        # only valid replies reach this point and get cached
+        if self.cache is not None:
+            self.cache.set(url, reply)
+
+        return reply
+
+
+    def getUserDetails(self, username):
+        url = f'https://m.tiktok.com/api/user/detail/?uniqueId={username}&language={self.language}'
+
+        details = self._getSigned(url, valid_details)
         secUid =  details['userInfo']['user']['secUid']
         self.secUid = secUid
         return details
 
-    def getTrending(self, count: int=50):
+
+    def getHashtagDetails(self, name):
+        '''challenge info of a hashtag, its id is needed to list its videos'''
+        url = f'https://m.tiktok.com/api/challenge/detail/?challengeName={quote(name)}&language={self.language}'
+        return self._getSigned(url, valid_challenge)
+
+
+    def getTrending(self, count: int=50, predicate: Predicate=None):
         '''get list of trending tiktok videos'''
-        self.sourceType = 12
-        self.type = 5
-        return self.__getTikToks(_id=1, item_count=count)
+        return self.__getTikToks(self.iterTrending(count, predicate))
 
 
-    def getUserTikToks(self, userid, count: int=0):
+    def getUserTikToks(self, userid, count: int=0, predicate: Predicate=None):
         '''get list of user tiktok videos'''
-        self.sourceType = 8
-        self.type = 1
-        return self.__getTikToks(_id=userid, item_count=count)
+        return self.__getTikToks(self.iterUserTikToks(userid, count, predicate=predicate))
+
+
+    def getHashtagTikToks(self, hashtags, count: int=0, predicate: Predicate=None):
+        '''get list of videos of one or more hashtags, without duplicates'''
+        return self.__getTikToks(self.iterHashtagTikToks(hashtags, count, predicate))
+
+
+    def getMusicTikToks(self, music_ids, count: int=0, predicate: Predicate=None):
+        '''get list of videos using one or more sounds, without duplicates'''
+        return self.__getTikToks(self.iterMusicTikToks(music_ids, count, predicate))
+
+
+    def iterTrending(self, count: int=50, predicate: Predicate=None, cursor: int=0, on_page=None, max_pages: int=None):
+        '''yield pages of trending tiktok videos'''
+        return self.iter_tiktoks(_id=1, item_count=count, predicate=predicate, cursor=cursor, feed=TRENDING_FEED, on_page=on_page,
+                                 max_pages=max_pages)
+
 
+    def iterUserTikToks(self, userid, count: int=0, since: int=None, predicate: Predicate=None, cursor: int=0, on_page=None,
+                        max_pages: int=None):
+        '''yield pages of user tiktok videos, only those newer than createTime since if given'''
+        # user feeds are newest first, so pagination can stop once past the date window
+        return self.iter_tiktoks(_id=userid, item_count=count, since=since, predicate=predicate, ordered=True, cursor=cursor, feed=USER_FEED,
+                                 on_page=on_page, max_pages=max_pages)
 
-    def __getTikToks(self, _id, item_count: int=0):
-        '''general get tiktok method'''
+
+    def iterHashtagTikToks(self, hashtags, count: int=0, predicate: Predicate=None, cursor: int=0, on_page=None, max_pages: int=None):
+        '''yield pages of videos of one hashtag, or of several fetched concurrently'''
+        def pages(name, cursor=0):
+            # challenge id is resolved once the first page is asked for
+            challenge = self.getHashtagDetails(name)['challengeInfo']['challenge']
+            yield from self.iter_tiktoks(_id=challenge['id'], item_count=count, predicate=predicate, cursor=cursor, feed=HASHTAG_FEED,
+                                         on_page=on_page, max_pages=max_pages)
+
+        if isinstance(hashtags, str):
+            return pages(hashtags, cursor)
+        return self.iterConcurrent([lambda name=name: pages(name) for name in hashtags])
+
+
+    def iterMusicTikToks(self, music_ids, count: int=0, predicate: Predicate=None, cursor: int=0, on_page=None, max_pages: int=None):
+        '''yield pages of videos using one sound, or several fetched concurrently'''
+        def pages(music_id, cursor=0):
+            return self.iter_tiktoks(_id=music_id, item_count=count, predicate=predicate, cursor=cursor, feed=MUSIC_FEED,
+                                     on_page=on_page, max_pages=max_pages)
+
+        if isinstance(music_ids, (str, int)):
+            return pages(music_ids, cursor)
+        return self.iterConcurrent([lambda music_id=music_id: pages(music_id) for music_id in music_ids])
+
+
+    def iterConcurrent(self, openers: list, workers: int=MAX_TARGET_WORKERS):
+        '''yield pages of several paginators as they arrive, each video only once'''
+        # every opener returns a paginator, targets are paged in parallel threads
+        # and nextCursor is meaningless here since pages of many targets interleave
+        seen = set()
+        done = object()
+
+        def advance(pages):
+            return pages, next(pages, done)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {executor.submit(lambda opener=opener: advance(opener())) for opener in openers}
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    try:
+                        pages, page = future.result()
+                    except Exception as e:
+                        # one bad target must not stop the others
+                        print(f'Exception: {e}')
+                        continue
+                    if page is done:
+                        continue
+
+                    # same video listed under several targets is downloaded once
+                    page = [item for item in page if item['id'] not in seen]
+                    seen.update(item['id'] for item in page)
+                    yield page
+
+                    pending.add(executor.submit(advance, pages))
+
+
+    def __getTikToks(self, pages):
+        '''general get tiktok method, collects all pages into one list'''
+        return [item for page in pages for item in page]
+
+
+    def iter_tiktoks(self, _id, item_count: int=0, since: int=None, predicate: Predicate=None, ordered: bool=False, cursor: int=0,
+                     feed: tuple=None, on_page=None, max_pages: int=None):
+        '''general paginator, yields list of items per API page as soon as it is parsed'''
+        # on_page(items) sees every new item of a page before the predicate drops any
+        # max_pages bounds the pages requested, MAX_FILTER_PAGES while filtering unless given, 0 for no limit
+        # feed is (type, sourceType), cursors are kept locally so several paginators can run at once
+        _type, source_type = feed if feed is not None else (self.type, self.sourceType)
+        sec_uid = self.secUid if _type == USER_FEED[0] else 0
+
+        # start at cursor to resume an interrupted pagination
         self.minCursor = 0
-        self.maxCursor = 0
+        self.maxCursor = cursor
+        self.nextCursor = cursor
+
+        # item_count counts matching items only
+        fetched = 0
+        filtering = predicate is not None and predicate.active
+        if max_pages is None:
+            max_pages = MAX_FILTER_PAGES if filtering else 0
+        scanned = 0
 
-        tiktoks = []
+        # limit maximum number of items per request, full pages when filtering
+        count = self.maxCount if filtering or item_count >= self.maxCount else item_count
 
-        # limit maximum number of items per request
-        count = item_count if item_count < self.maxCount else self.maxCount
-        
         # query api in batches
-        while len(tiktoks) < item_count:
-            
+        while fetched < item_count:
 
             # prepare request url
-            url = f'https://m.tiktok.com/api/item_list/?count={count}&id={_id}&type={self.type}&secUid={self.secUid}&maxCursor={self.maxCursor}&minCursor={self.minCursor}&sourceType={self.sourceType}&appId=1233&region={self.region}&language={self.language}&verifyFp={self.verifyFp if self.verifyFp else ""}'
-            
-            # get signature for request url
-            signature = self._signURL(url)
-            
-            # affix signature to request url
-            url = f'{url}&_signature={signature}'
-
-            # send request
-            self.driver.get(url)
+            url = f'https://m.tiktok.com/api/item_list/?count={count}&id={_id}&type={_type}&secUid={sec_uid}&maxCursor={cursor}&minCursor=0&sourceType={source_type}&appId=1233&region={self.region}&language={self.language}'
 
             # JSON reply sample
             # {
@@ -165,26 +635,61 @@ class TikTok:
             #     "hasMore": true,
             #     "maxCursor": 1235,
             #     "minCursor": 1234
-            # } 
+            # }
 
             # parse response
             try:
-                reply = json.loads(self.driver.find_element_by_tag_name('pre').text)
-                items = reply['items']
-                tiktoks.extend(items)
-
-                # this is last batch, no more tiktoks to expect
-                if not reply['hasMore']:
-                    break
-
-                # adjust count to reflect items returned in this batch
-                count = item_count - len(tiktoks)
-                self.maxCursor = reply['maxCursor']
-
-            except:
-                raise Exception('No items returned, possibly bad User-Agent. Please try again.')
-
-        return tiktoks
+                reply = self._getSigned(url, valid_items)
+                items = reply.get('items') or []
+                has_more = reply['hasMore']
+                max_cursor = reply['maxCursor'] if has_more else cursor
+
+            except Exception as e:
+                raise Exception(f'No items returned after {self.governor.retries} retries, possibly bad User-Agent ({e}). Please try again.')
+
+            # feed is newest first, drop items up to createTime since and stop at the first page
+            # reaching them; pinned videos only appear at the top of a page
+            reached_known = False
+            if since is not None and items:
+                reached_known = items[-1].get('createTime', 0) <= since
+                items = [item for item in items if item.get('createTime', 0) > since]
+
+            if on_page is not None and items:
+                on_page(items)
+
+            # newest first feed already went past the requested date window
+            past_window = ordered and filtering and bool(items) and predicate.past_window(items[-1])
+
+            # evaluate predicate here so rejected items are never accumulated
+            if filtering:
+                items = [item for item in items if predicate(item)]
+            items = items[:item_count - fetched]
+            PAGES.inc()
+            ITEMS_PER_PAGE.observe(len(items))
+
+            # this is last batch, no more tiktoks to expect
+            last = not has_more or reached_known or past_window
+
+            # give up on a selective filter instead of paging an endless feed
+            scanned += 1
+            if not last and max_pages and scanned >= max_pages and fetched + len(items) < item_count:
+                print(f'Stopping after {scanned} pages, {fetched + len(items)} of {item_count} items found')
+                last = True
+
+            # cursor to resume from once this page is consumed, None when done
+            self.nextCursor = None if last else max_cursor
+
+            fetched += len(items)
+            yield items
+
+            if last:
+                break
+
+            # adjust count to reflect items returned in this batch
+            if not filtering:
+                count = min(item_count - fetched, self.maxCount)
+            cursor = max_cursor
+            self.maxCursor = max_cursor
 
 
 def main():
@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+
+''' Non-interactive batch scraper driven by a durable job queue '''
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import aiohttp
+from api import MAX_FILTER_PAGES
+from filters import Predicate
+from jobs import JobQueue, USER, HASHTAG, MUSIC, TRENDING
+from ledger import Ledger
+from metadata import MetadataStore
+from content import ContentStore
+from metrics import export
+from run import (Scrape, DOWNLOADS_BASE_DIR, LEDGER_PATH, METADATA_PATH, CONTENT_PATH, open_pages, enqueue_pages,
+                 download_headers, start_workers, stop_workers, new_tiktok, advance_marks)
+
+
+JOBS_PATH = f'{DOWNLOADS_BASE_DIR}/jobs.sqlite'
+
+MODES = {
+    USER: Scrape.USER,
+    HASHTAG: Scrape.HASHTAG,
+    MUSIC: Scrape.MUSIC,
+    TRENDING: Scrape.TRENDING,
+}
+
+
+async def run_job(tt, job: dict, jobs: JobQueue, queue, ledger: Ledger, store: MetadataStore,
+                  predicate: Predicate=None, incremental: bool=False, content: ContentStore=None, marks: list=None,
+                  scheduled: set=None, max_pages: int=None) -> None:
+    ''' paginate one job from its stored cursor, recording progress after every page '''
+    # high-water marks of completed paginations are collected in marks, stored after the downloads
+    # count of -1 means everything, otherwise only what is left from a previous attempt
+    count = job['count']
+    if count >= 0:
+        count -= job['items']
+        if count <= 0:
+            jobs.finish(job['id'])
+            return
+
+    print(f"\n[ job-{job['id']} ] {job['kind']} {job['target']} from cursor {job['cursor']}\n")
+    try:
+        username, pages, mark = await open_pages(tt, MODES[job['kind']], job['target'], count, predicate, ledger,
+                                                 incremental=incremental, cursor=job['cursor'], store=store, max_pages=max_pages)
+
+        def on_page(page):
+            jobs.progress(job['id'], tt.nextCursor or 0, len(page))
+
+        await enqueue_pages(pages, queue, username, ledger=ledger, mode=MODES[job['kind']].name, on_page=on_page, content=content,
+                            scheduled=scheduled)
+
+        if mark and marks is not None:
+            marks.append((username, mark, tt.maxCursor))
+        jobs.finish(job['id'])
+
+    except Exception as e:
+        print(f"[ job-{job['id']} ] FAILED: {e}")
+        jobs.fail(job['id'], str(e))
+
+
+async def run_batch(jobs: JobQueue, predicate: Predicate=None, incremental: bool=False, max_pages: int=None) -> None:
+    ''' drain job queue with one TikTok object; pagination of the next job overlaps downloads of the previous ones '''
+    recovered = jobs.recover()
+    if recovered:
+        print(f'Resuming {recovered} interrupted jobs')
+
+    tt = new_tiktok()
+    ledger = Ledger(LEDGER_PATH)
+    store = MetadataStore(METADATA_PATH)
+    content = ContentStore(CONTENT_PATH)
+    queue = asyncio.Queue(maxsize=1000)
+    job = None
+    started = time.time()
+    marks = []
+
+    # videos handed to the download workers, jobs sharing a folder must not queue them twice
+    scheduled = set()
+
+    try:
+        async with aiohttp.ClientSession(headers=download_headers()) as session:
+            tasks = start_workers(queue, session, ledger, content)
+
+            # downloads that were queued but not finished before a crash
+            for username, video_id, video_url in ledger.pending():
+                os.makedirs(f'{DOWNLOADS_BASE_DIR}/{username}', exist_ok=True)
+                scheduled.add((username, str(video_id)))
+                await queue.put((username, video_id, video_url))
+
+            while True:
+                job = jobs.claim()
+                if job is None:
+                    break
+                await run_job(tt, job, jobs, queue, ledger, store, predicate, incremental, content, marks, scheduled, max_pages)
+                job = None
+
+            # wait until the queue is consumed
+            print(f'\nWaiting for tasks in queue[{queue.qsize()}] to be processed...\n')
+            await queue.join()
+            advance_marks(ledger, marks, started)
+
+        await stop_workers(tasks)
+
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        # progress is already stored per page, just hand the job back
+        if job is not None:
+            jobs.release(job['id'])
+        raise
+
+    finally:
+        ledger.close()
+        store.flush()
+        content.close()
+        print(f'Jobs: {jobs.counts()}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('targets', nargs='?', help='file with one target per line: @user, #hashtag, music:id, trending')
+    parser.add_argument('--db', default=JOBS_PATH, help='job queue database')
+    parser.add_argument('--count', type=int, default=-1, help='videos per target, -1 for all possible')
+    parser.add_argument('--incremental', action='store_true', help='only fetch videos newer than the last sync')
+    parser.add_argument('--retry-failed', action='store_true', help='queue failed jobs again')
+    parser.add_argument('--likes', type=int, default=0)
+    parser.add_argument('--views', type=int, default=0)
+    parser.add_argument('--shares', type=int, default=0)
+    parser.add_argument('--comments', type=int, default=0)
+    parser.add_argument('--max-pages', type=int, help=f'API pages per target, default {MAX_FILTER_PAGES} with a filter and unlimited without')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus /metrics and /metrics.json on this port')
+    parser.add_argument('--metrics-file', help='write a JSON metrics snapshot to this file every 10s')
+    args = parser.parse_args(argv)
+
+    predicate = Predicate(likes=args.likes, views=args.views, shares=args.shares, comments=args.comments)
+
+    with JobQueue(args.db) as jobs:
+        if args.targets:
+            print(f'Loaded {jobs.load_file(args.targets, args.count)} targets from {args.targets}')
+        if args.retry_failed:
+            jobs.retry_failed()
+
+        stop_metrics = export(args.metrics_port, args.metrics_file)
+        try:
+            asyncio.run(run_batch(jobs, predicate, args.incremental, args.max_pages))
+        except KeyboardInterrupt:
+            print('\nInterrupted, run again to resume.')
+        finally:
+            stop_metrics()
+
+
+if __name__ == '__main__':
+    assert sys.version_info >= (3, 7), 'Python 3.7+ required.'
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+
+''' Offline scrape benchmark: api.TikTok pagination and run.scrape downloads against a local mock server '''
+
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import io
+import json
+import math
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+import contextlib
+import run
+from mock_tiktok import MockConfig, MockServer, mock_tiktok
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss_mb() -> float:
+    ''' peak resident set size of this process so far, server thread included '''
+    if resource is None:
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1 << 20 if sys.platform == 'darwin' else 1 << 10)
+
+
+def sign_stats(tt) -> dict:
+    times = sorted(tt.driver.sign_times) or [0.0]
+    return {
+        'sign_ms_mean': statistics.mean(times) * 1e3,
+        'sign_ms_p95': times[math.ceil(0.95 * len(times)) - 1] * 1e3,
+    }
+
+
+def bench_api(server: MockServer, count: int, sign_latency: float) -> dict:
+    ''' pages/s of TikTok.iterUserTikToks, signing and fetching every page '''
+    tt = mock_tiktok(server, sign_latency)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        pages = list(tt.iterUserTikToks('1', count))
+    elapsed = time.perf_counter() - start
+
+    items = sum(len(page) for page in pages)
+    assert items == count, f'Expected {count} items, got {items}'
+    return {'pages': len(pages), 'pages_per_s': len(pages) / elapsed, 'items_per_s': items / elapsed,
+            **sign_stats(tt), 'peak_rss_mb': peak_rss_mb()}
+
+
+@contextlib.contextmanager
+def patched(module, **attributes):
+    ''' temporarily replace module attributes '''
+    saved = {name: getattr(module, name) for name in attributes}
+    for name, value in attributes.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+
+def bench_scrape(server: MockServer, count: int, sign_latency: float, directory: str) -> dict:
+    ''' end to end run.scrape of a user: pagination, ledger, content store and downloads '''
+    signers = []
+
+    def tiktok(**kwargs):
+        signers.append(mock_tiktok(server, sign_latency))
+        return signers[-1]
+
+    # keep every file of the run inside directory and off the network
+    with patched(run, DOWNLOADS_BASE_DIR=directory, LEDGER_PATH=f'{directory}/ledger.sqlite', METADATA_PATH=f'{directory}/metadata',
+                 CONTENT_PATH=f'{directory}/.content', ResponseCache=lambda: None, download_headers=lambda: {}, TikTok=tiktok):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(run.scrape(run.Scrape.USER, 'mock', count))
+        elapsed = time.perf_counter() - start
+
+    folder = f'{directory}/mock'
+    videos = [name for name in os.listdir(folder) if name.endswith('.mp4')]
+    downloaded = sum(os.path.getsize(os.path.join(folder, name)) for name in videos)
+    return {'videos': len(videos), 'seconds': elapsed, 'download_mb_per_s': downloaded / elapsed / 1e6,
+            **sign_stats(signers[0]), 'peak_rss_mb': peak_rss_mb()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--videos', type=int, default=300, help='videos in the mock feed')
+    parser.add_argument('--size', type=int, default=256, help='KiB per video')
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds added to every mock response')
+    parser.add_argument('--bandwidth', type=float, default=0, help='MB/s per video stream, 0 for unlimited')
+    parser.add_argument('--errors', type=float, default=0.0, help='share of mock requests failing')
+    parser.add_argument('--sign-latency', type=float, default=0.002, help='seconds per fake signature')
+    parser.add_argument('--json', action='store_true', help='print results as JSON for comparison between runs')
+    args = parser.parse_args(argv)
+
+    config = MockConfig(videos=args.videos, video_size=args.size << 10, latency=args.latency,
+                        bandwidth=args.bandwidth * 1e6 or None, error_rate=args.errors)
+
+    results = {}
+    with MockServer(config) as server, tempfile.TemporaryDirectory() as directory:
+        results['api'] = bench_api(server, args.videos, args.sign_latency)
+        results['scrape'] = bench_scrape(server, args.videos, args.sign_latency, directory)
+        results['scrape']['mock_requests'] = server.requests
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return results
+
+    for name, metrics in results.items():
+        print(f'{name}:')
+        for metric, value in metrics.items():
+            print(f'  {metric:>18}: {value:10.2f}' if isinstance(value, float) else f'  {metric:>18}: {value:10}')
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+
+''' Download write path benchmark: aiofiles 1 KiB writes vs coalesced FileWriter '''
+
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+import asyncio
+import tempfile
+import argparse
+import aiofiles
+from writer import FileWriter, READ_CHUNK_SIZE
+
+
+async def chunks(data: bytes, size: int):
+    ''' stand-in for response.content.iter_chunked(size) '''
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+async def old_path(file_name, data):
+    async with aiofiles.open(file_name, 'wb') as file:
+        async for data_chunk in chunks(data, 1024):
+            if data_chunk:
+                await file.write(data_chunk)
+
+
+async def new_path(file_name, data):
+    async with FileWriter(file_name) as file:
+        file.preallocate(len(data))
+        async for data_chunk in chunks(data, READ_CHUNK_SIZE):
+            if data_chunk:
+                await file.write(data_chunk)
+
+
+async def measure(path, directory, data, files) -> float:
+    ''' MB/s writing files concurrently like the download workers do '''
+    names = [os.path.join(directory, f'{path.__name__}-{index}.mp4') for index in range(files)]
+    start = time.perf_counter()
+    await asyncio.gather(*[path(name, data) for name in names])
+    elapsed = time.perf_counter() - start
+    for name in names:
+        assert os.path.getsize(name) == len(data)
+        os.remove(name)
+    return len(data) * files / elapsed / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=10, help='MB per video')
+    parser.add_argument('--files', type=int, default=4, help='concurrent videos')
+    args = parser.parse_args()
+
+    data = os.urandom(args.size * 1000 * 1000)
+    with tempfile.TemporaryDirectory() as directory:
+        for path in (old_path, new_path):
+            rate = asyncio.run(measure(path, directory, data, args.files))
+            print(f'{path.__name__:>8}: {rate:8.1f} MB/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/python3
+
+''' Local stand-in for the TikTok API and video CDN, plus a fake signer, for offline benchmarks '''
+
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+import random
+import asyncio
+import threading
+from aiohttp import web
+from requests.adapters import HTTPAdapter
+from api import TikTok
+from governor import RateGovernor
+
+
+API_HOST = 'https://m.tiktok.com'
+STREAM_CHUNK = 64 << 10
+
+
+class MockConfig:
+    ''' Shape and misbehaviour of the mock server '''
+
+    def __init__(self, videos: int=300, video_size: int=256 << 10, latency: float=0.0, bandwidth: float=None,
+                 error_rate: float=0.0, seed: int=0):
+        self.videos = videos              # items in every feed
+        self.video_size = video_size      # bytes per mp4
+        self.latency = latency            # seconds added to every response
+        self.bandwidth = bandwidth        # bytes/s per video stream, None for unlimited
+        self.error_rate = error_rate      # share of requests answered with an error
+        self.seed = seed
+
+
+def make_item(index: int, base_url: str, video_size: int) -> dict:
+    ''' item_list entry with the fields the scraper reads, newest first '''
+    video_id = 7000000000000000000 + index
+    return {
+        'id': str(video_id),
+        'desc': f'mock video {index}',
+        'createTime': 1600000000 - index * 60,
+        'author': {'uniqueId': 'mock', 'id': '1', 'secUid': 'MS4wLjABAAAAmock'},
+        'music': {'id': '6800000000000000000', 'title': 'mock sound'},
+        'video': {'duration': 15, 'size': video_size, 'downloadAddr': f'{base_url}/video/{video_id}.mp4'},
+        'stats': {'diggCount': index * 7 % 1000, 'playCount': index * 97 % 100000, 'shareCount': index % 50, 'commentCount': index % 200},
+    }
+
+
+class MockServer:
+    ''' aiohttp app on 127.0.0.1 serving item_list, user/detail and mp4 bodies from a background thread '''
+
+    def __init__(self, config: MockConfig=None):
+        self.config = config if config is not None else MockConfig()
+        self.random = random.Random(self.config.seed)
+        self.requests = 0
+        self.url = None
+        self._loop = None
+        self._thread = None
+        self._body = os.urandom(self.config.video_size)
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+    async def _delay(self) -> bool:
+        '''apply latency, True if this request should fail'''
+        self.requests += 1
+        if self.config.latency:
+            await asyncio.sleep(self.config.latency)
+        return self.random.random() < self.config.error_rate
+
+
+    async def item_list(self, request):
+        if await self._delay():
+            return web.json_response({'statusCode': 10000})
+
+        count = int(request.query.get('count', 30))
+        cursor = int(request.query.get('maxCursor', 0))
+        end = min(cursor + count, self.config.videos)
+        return web.json_response({
+            'statusCode': 0,
+            'items': [make_item(index, self.url, self.config.video_size) for index in range(cursor, end)],
+            'hasMore': end < self.config.videos,
+            'maxCursor': end,
+            'minCursor': cursor,
+        })
+
+
+    async def user_detail(self, request):
+        if await self._delay():
+            return web.json_response({'statusCode': 10000})
+
+        username = request.query.get('uniqueId', 'mock')
+        return web.json_response({
+            'statusCode': 0,
+            'userInfo': {
+                'user': {'id': '1', 'uniqueId': username, 'secUid': 'MS4wLjABAAAAmock'},
+                'stats': {'videoCount': self.config.videos, 'followerCount': 1000},
+            },
+        })
+
+
+    async def video(self, request):
+        if await self._delay():
+            return web.Response(status=500)
+
+        body = self._body
+        response = web.StreamResponse(headers={'Content-Type': 'video/mp4', 'ETag': '"mock"'})
+        response.content_length = len(body)
+        await response.prepare(request)
+
+        # throttle to the configured bandwidth chunk by chunk
+        for start in range(0, len(body), STREAM_CHUNK):
+            chunk = body[start:start + STREAM_CHUNK]
+            await response.write(chunk)
+            if self.config.bandwidth:
+                await asyncio.sleep(len(chunk) / self.config.bandwidth)
+        await response.write_eof()
+        return response
+
+
+    def start(self):
+        '''serve from a thread with its own event loop, so blocking clients can use it too'''
+        started = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            app = web.Application()
+            app.router.add_get('/api/item_list/', self.item_list)
+            app.router.add_get('/api/user/detail/', self.user_detail)
+            app.router.add_get('/video/{name}', self.video)
+            self._runner = web.AppRunner(app, access_log=None)
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, '127.0.0.1', 0)
+            self._loop.run_until_complete(site.start())
+            self.url = f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}'
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._runner.cleanup())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=serve, name='mock-tiktok', daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+
+    def stop(self) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+
+class FakeSigner:
+    ''' Stands in for the Chrome driver: byted_acrawler is always ready, signing takes latency seconds '''
+
+    def __init__(self, latency: float=0.0):
+        self.latency = latency
+        self.sign_times = []
+        self.current_window_handle = 'signer'
+        self.window_handles = ['signer']
+        self.switch_to = self
+
+
+    def window(self, handle):
+        pass
+
+
+    def get(self, url):
+        pass
+
+
+    def get_cookie(self, name):
+        return {'name': name, 'value': 'verify_mock'}
+
+
+    def get_cookies(self):
+        return [{'name': 's_v_web_id', 'value': 'verify_mock', 'domain': '.tiktok.com'}]
+
+
+    def execute_script(self, script, *args):
+        if 'typeof window.byted_acrawler' in script:
+            return True
+        start = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        signatures = [f'mock_{abs(hash(url)) % 10 ** 12}' for url in args[0]]
+        self.sign_times.append(time.perf_counter() - start)
+        return signatures
+
+
+    def quit(self):
+        pass
+
+
+class RedirectAdapter(HTTPAdapter):
+    ''' Sends requests for the TikTok API host to the mock server '''
+
+    def __init__(self, base_url: str, **kwargs):
+        self.base_url = base_url
+        super().__init__(**kwargs)
+
+
+    def send(self, request, **kwargs):
+        request.url = request.url.replace(API_HOST, self.base_url, 1)
+        return super().send(request, **kwargs)
+
+
+def mock_tiktok(server: MockServer, sign_latency: float=0.0, **kwargs) -> TikTok:
+    ''' TikTok object without Chrome, signing with FakeSigner and fetching from server over HTTP '''
+    # kwargs go to TikTok, e.g. cache=; errors injected by the server are retried almost at once unless governor= is given
+    kwargs.setdefault('governor', RateGovernor(rate=1e6, burst=1000, base_delay=0.001, max_delay=0.01))
+    tt = TikTok(driver=FakeSigner(sign_latency), user_agent='Mozilla/5.0 (mock)', http_fetch=True, **kwargs)
+    session = tt._httpSession()
+    adapter = RedirectAdapter(server.url, pool_connections=4, pool_maxsize=16)
+    session.mount(API_HOST, adapter)
+    return tt
@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+
+''' Disk-backed TTL cache for signed API responses '''
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+from utils import CACHE_DIR
+
+
+CACHE_FILE = os.path.join(CACHE_DIR, 'responses.sqlite')
+
+# query parameters that change between sessions but not the response
+VOLATILE_PARAMS = {'_signature', 'verifyFp'}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+'''
+
+
+def normalize_url(url: str) -> str:
+    '''cache key of url, without signature/verifyFp and with sorted query'''
+    uri = urlparse(url)
+    query = sorted((key, value) for key, value in parse_qsl(uri.query, keep_blank_values=True) if key not in VOLATILE_PARAMS)
+    return urlunparse(uri._replace(query=urlencode(query)))
+
+
+class ResponseCache:
+    ''' JSON responses keyed by normalized url, expiring after ttl and evicted LRU above max_bytes '''
+
+    def __init__(self, path: str=CACHE_FILE, ttl: float=60 * 60, max_bytes: int=256 * 1024 * 1024):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        # used from executor threads, serialize access ourselves
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        self._total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+
+    def get(self, url: str):
+        '''cached response of url or None if missing or expired'''
+        key = normalize_url(url)
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute('SELECT value, size, created_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+
+            value, size, created_at = row
+            with self.conn:
+                if now - created_at > self.ttl:
+                    self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                    self._total -= size
+                    return None
+                self.conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+
+        return json.loads(value)
+
+
+    def set(self, url: str, response) -> None:
+        '''store response of url, evicting least recently used entries above max_bytes'''
+        key = normalize_url(url)
+        value = json.dumps(response, separators=(',', ':')).encode()
+        now = time.time()
+        with self._lock, self.conn:
+            row = self.conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self._total -= row[0]
+            self.conn.execute('INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                              (key, value, len(value), now, now))
+            self._total += len(value)
+
+            # least recently used first
+            if self._total > self.max_bytes:
+                rows = self.conn.execute('SELECT key, size FROM responses ORDER BY accessed_at').fetchall()
+                evicted = []
+                for old_key, size in rows:
+                    if self._total <= self.max_bytes:
+                        break
+                    evicted.append((old_key,))
+                    self._total -= size
+                self.conn.executemany('DELETE FROM responses WHERE key = ?', evicted)
+
+
+    def purge(self) -> int:
+        '''delete expired entries, returns number removed'''
+        with self._lock, self.conn:
+            cursor = self.conn.execute('DELETE FROM responses WHERE created_at < ?', (time.time() - self.ttl,))
+            self._total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            return cursor.rowcount
+
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+
+''' Content-addressed video store, user/mode folders are links into it '''
+
+import os
+import time
+import shutil
+import sqlite3
+import threading
+from ledger import file_digest, MAX_VARIABLES
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS blobs (
+    video_id TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_hash ON blobs (hash);
+'''
+
+
+class ContentStore:
+    ''' Each video is kept once under its sha256, indexed by video_id '''
+
+    def __init__(self, root: str, symlinks: bool=False):
+        # objects must live on the same filesystem as the views for hardlinks
+        self.root = root
+        self.symlinks = symlinks
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+
+        # used from download workers' executor threads
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, 'index.sqlite'), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.root, 'objects', digest[:2], f'{digest}.mp4')
+
+
+    def lookup(self, video_ids) -> dict:
+        '''{video_id: hash} of the given ids already in the store'''
+        video_ids = [str(video_id) for video_id in video_ids]
+        found = {}
+        with self._lock:
+            for start in range(0, len(video_ids), MAX_VARIABLES):
+                chunk = video_ids[start:start + MAX_VARIABLES]
+                placeholders = ','.join('?' * len(chunk))
+                found.update(self.conn.execute(f'SELECT video_id, hash FROM blobs WHERE video_id IN ({placeholders})', chunk))
+        return found
+
+
+    def ingest(self, video_id, file_name: str) -> str:
+        '''move a downloaded file into the store and link it back in place, returns its hash'''
+        digest = file_digest(file_name)
+        path = self.object_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # same bytes may already be stored for another folder, file_name is then replaced by a link below
+        if not os.path.exists(path):
+            os.replace(file_name, path)
+
+        with self._lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO blobs (video_id, hash, size, created_at) VALUES (?, ?, ?, ?)',
+                              (str(video_id), digest, os.path.getsize(path), time.time()))
+        self._link(path, file_name)
+        return digest
+
+
+    def link(self, video_id, file_name: str, digest: str=None) -> bool:
+        '''materialize a stored video at file_name, False if it is not in the store'''
+        if digest is None:
+            digest = self.lookup([video_id]).get(str(video_id))
+            if digest is None:
+                return False
+
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            # object removed by hand, forget it so the video is downloaded again
+            with self._lock, self.conn:
+                self.conn.execute('DELETE FROM blobs WHERE hash = ?', (digest,))
+            return False
+
+        self._link(path, file_name)
+        return True
+
+
+    def _link(self, path: str, file_name: str) -> None:
+        if os.path.exists(file_name) and os.path.samefile(path, file_name):
+            return
+
+        # link next to the target first so readers never see a missing file
+        temp_name = f'{file_name}.link'
+        if os.path.lexists(temp_name):
+            os.remove(temp_name)
+        try:
+            if self.symlinks:
+                os.symlink(os.path.relpath(path, os.path.dirname(file_name) or '.'), temp_name)
+            else:
+                os.link(path, temp_name)
+        except OSError:
+            # no links on this filesystem, fall back to a copy
+            shutil.copyfile(path, temp_name)
+        os.replace(temp_name, file_name)
+
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+
+''' Single-pass item predicates pushed down into pagination '''
+
+from datetime import datetime
+
+
+# threshold name -> key in item['stats']
+STATS = {
+    'likes': 'diggCount',
+    'views': 'playCount',
+    'shares': 'shareCount',
+    'comments': 'commentCount',
+}
+
+
+def _timestamp(value):
+    '''unix timestamp of datetime or number, None stays None'''
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return int(value)
+
+
+class Predicate:
+    ''' Compiled item filter on stat thresholds, createTime window and duration '''
+
+    def __init__(self, likes: int=0, views: int=0, shares: int=0, comments: int=0,
+                 date_from=None, date_to=None, min_duration: int=None, max_duration: int=None):
+        self.date_from = _timestamp(date_from)
+        self.date_to = _timestamp(date_to)
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+
+        # only active thresholds are checked per item
+        thresholds = {'likes': likes, 'views': views, 'shares': shares, 'comments': comments}
+        self.stats = tuple((STATS[name], value) for name, value in thresholds.items() if value)
+
+        self.checks_time = self.date_from is not None or self.date_to is not None
+        self.checks_duration = min_duration is not None or max_duration is not None
+        self.active = bool(self.stats) or self.checks_time or self.checks_duration
+
+
+    def __call__(self, item) -> bool:
+        if self.stats:
+            stats = item['stats']
+            for key, value in self.stats:
+                if stats[key] < value:
+                    return False
+
+        if self.checks_time:
+            create_time = item.get('createTime', 0)
+            if self.date_from is not None and create_time < self.date_from:
+                return False
+            if self.date_to is not None and create_time > self.date_to:
+                return False
+
+        if self.checks_duration:
+            duration = item.get('video', {}).get('duration', 0)
+            if self.min_duration is not None and duration < self.min_duration:
+                return False
+            if self.max_duration is not None and duration > self.max_duration:
+                return False
+
+        return True
+
+
+    def past_window(self, item) -> bool:
+        '''True if item is older than date_from, so a newest-first feed can stop here'''
+        return self.date_from is not None and item.get('createTime', 0) < self.date_from
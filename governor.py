@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+
+''' Rate limiting, retries and circuit breaking for signed API requests '''
+
+import time
+import random
+import threading
+from metrics import API_RETRIES, API_FAILURES
+
+
+class TokenBucket:
+    ''' Thread-safe token bucket, rate tokens per second up to burst '''
+
+    def __init__(self, rate: float=2.0, burst: int=5, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+
+    def acquire(self) -> None:
+        '''block until a token is available and take it'''
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self.sleep(wait)
+
+
+class CircuitBreaker:
+    ''' Opens a target after threshold consecutive failures, pausing it for cooldown seconds '''
+
+    def __init__(self, threshold: int=5, cooldown: float=60, clock=time.monotonic, sleep=time.sleep):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.sleep = sleep
+        self._failures = {}
+        self._opened = {}
+        self._lock = threading.Lock()
+
+
+    def remaining(self, target) -> float:
+        '''seconds until target may be tried again, 0 if closed'''
+        with self._lock:
+            opened = self._opened.get(target)
+            if opened is None:
+                return 0
+            return max(0, opened + self.cooldown - self.clock())
+
+
+    def wait(self, target) -> None:
+        '''pause while target is open, then let a trial request through'''
+        remaining = self.remaining(target)
+        if remaining:
+            print(f'Circuit open for {target}, pausing {remaining:.0f}s')
+            self.sleep(remaining)
+
+
+    def success(self, target) -> None:
+        with self._lock:
+            self._failures[target] = 0
+            self._opened.pop(target, None)
+
+
+    def failure(self, target) -> None:
+        with self._lock:
+            self._failures[target] = self._failures.get(target, 0) + 1
+            if self._failures[target] >= self.threshold:
+                self._opened[target] = self.clock()
+
+
+class RateGovernor:
+    ''' Token bucket plus jittered exponential backoff retries and circuit breaker '''
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, rate: float=2.0, burst: int=5, retries: int=5, base_delay: float=1.0, max_delay: float=60,
+                 threshold: int=5, cooldown: float=60, clock=time.monotonic, sleep=time.sleep):
+        self.bucket = TokenBucket(rate, burst, clock=clock, sleep=sleep)
+        self.breaker = CircuitBreaker(threshold, cooldown, clock=clock, sleep=sleep)
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+
+
+    @classmethod
+    def shared(cls):
+        '''process wide governor used by TikTok objects unless given their own'''
+        # TikTok objects of a SignerPool or worker threads are built at once, all must get the same one
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+
+    def delay(self, attempt: int) -> float:
+        '''full jitter exponential backoff'''
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+    def call(self, target, func, valid=None, label: str=None):
+        '''call func under rate limit, retrying until valid(reply) holds'''
+        # target keys the circuit breaker, label (target by default) the metrics
+        label = label or target
+        error = None
+        for attempt in range(self.retries + 1):
+            self.breaker.wait(target)
+            self.bucket.acquire()
+            try:
+                reply = func()
+                if valid is None or valid(reply):
+                    self.breaker.success(target)
+                    return reply
+                error = Exception(f'Invalid reply from {target}: statusCode {reply.get("statusCode") if isinstance(reply, dict) else None}')
+            except Exception as e:
+                error = e
+
+            self.breaker.failure(target)
+            if attempt < self.retries:
+                API_RETRIES.inc(target=label)
+                self.sleep(self.delay(attempt))
+
+        API_FAILURES.inc(target=label)
+        raise error
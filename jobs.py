@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+
+''' Durable SQLite queue of scrape jobs with per-page progress '''
+
+import os
+import time
+import sqlite3
+
+
+# job kinds
+USER = 'user'
+HASHTAG = 'hashtag'
+MUSIC = 'music'
+TRENDING = 'trending'
+
+# job statuses
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# prefixes accepted in target files
+PREFIXES = {'@': USER, '#': HASHTAG}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    target TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT -1,
+    status TEXT NOT NULL,
+    cursor INTEGER NOT NULL DEFAULT 0,
+    pages INTEGER NOT NULL DEFAULT 0,
+    items INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (kind, target)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+'''
+
+
+def parse_target(line: str):
+    '''(kind, target) of a target file line, None for blanks and comments'''
+    # accepted forms: @username, #hashtag, user:name, hashtag:name, music:id, sound:id, trending
+    # and bare usernames; lines starting with '# ' are comments
+    if line.startswith('# '):
+        return None
+    line = line.strip()
+    if not line:
+        return None
+    if line == TRENDING:
+        return TRENDING, TRENDING
+    if line[0] in PREFIXES:
+        return PREFIXES[line[0]], line[1:]
+    if ':' in line:
+        kind, target = line.split(':', 1)
+        kind = {'sound': MUSIC, 'tag': HASHTAG, 'challenge': HASHTAG}.get(kind.lower(), kind.lower())
+        if kind in (USER, HASHTAG, MUSIC):
+            return kind, target.strip()
+        raise ValueError(f'Unknown target kind: {line}')
+    # bare names are usernames
+    return USER, line
+
+
+class JobQueue:
+    ''' Jobs survive crashes: claimed jobs left running are handed out again with their cursor '''
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def add(self, kind: str, target: str, count: int=-1) -> None:
+        '''add job, ignoring targets already queued'''
+        now = time.time()
+        with self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO jobs (kind, target, count, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                              (kind, target, count, PENDING, now, now))
+
+
+    def load_file(self, file_name: str, count: int=-1) -> int:
+        '''add every target listed in file in one transaction, returns number of lines parsed'''
+        now = time.time()
+        with open(file_name, 'r') as file:
+            targets = [target for target in map(parse_target, file) if target]
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO jobs (kind, target, count, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                                  [(kind, target, count, PENDING, now, now) for kind, target in targets])
+        return len(targets)
+
+
+    def recover(self) -> int:
+        '''hand jobs interrupted by a crash or SIGINT out again, keeping their cursor'''
+        with self.conn:
+            return self.conn.execute('UPDATE jobs SET status = ?, updated_at = ? WHERE status = ?', (PENDING, time.time(), RUNNING)).rowcount
+
+
+    def retry_failed(self) -> int:
+        with self.conn:
+            return self.conn.execute('UPDATE jobs SET status = ?, updated_at = ? WHERE status = ?', (PENDING, time.time(), FAILED)).rowcount
+
+
+    def claim(self) -> dict:
+        '''next pending job marked as running, None if the queue is drained'''
+        with self.conn:
+            cursor = self.conn.execute('SELECT * FROM jobs WHERE status = ? ORDER BY id LIMIT 1', (PENDING,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            job = dict(zip([column[0] for column in cursor.description], row))
+            self.conn.execute('UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?', (RUNNING, time.time(), job['id']))
+        job['status'] = RUNNING
+        job['attempts'] += 1
+        return job
+
+
+    def progress(self, job_id: int, cursor: int, items: int) -> None:
+        '''record a completed page, cursor is where pagination resumes'''
+        with self.conn:
+            self.conn.execute('UPDATE jobs SET cursor = ?, pages = pages + 1, items = items + ?, updated_at = ? WHERE id = ?',
+                              (cursor, items, time.time(), job_id))
+
+
+    def release(self, job_id: int) -> None:
+        '''put an interrupted job back, e.g. on SIGINT'''
+        self._set_status(job_id, PENDING)
+
+
+    def finish(self, job_id: int) -> None:
+        self._set_status(job_id, DONE)
+
+
+    def fail(self, job_id: int, error: str) -> None:
+        self._set_status(job_id, FAILED, error)
+
+
+    def _set_status(self, job_id: int, status: str, error: str=None) -> None:
+        with self.conn:
+            self.conn.execute('UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?', (status, error, time.time(), job_id))
+
+
+    def counts(self) -> dict:
+        '''number of jobs per status'''
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+
+    def close(self) -> None:
+        self.conn.close()
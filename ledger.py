@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+
+''' SQLite ledger of downloaded videos '''
+
+import os
+import time
+import sqlite3
+import hashlib
+
+
+# statuses recorded in the ledger
+QUEUED = 'queued'
+DONE = 'done'
+FAILED = 'failed'
+
+# keep IN (...) lists below SQLITE_MAX_VARIABLE_NUMBER
+MAX_VARIABLES = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS videos (
+    video_id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    mode TEXT,
+    url TEXT,
+    size INTEGER,
+    hash TEXT,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (video_id, username)
+);
+CREATE INDEX IF NOT EXISTS videos_status ON videos (status);
+CREATE INDEX IF NOT EXISTS videos_username ON videos (username, status);
+CREATE TABLE IF NOT EXISTS cursors (
+    username TEXT PRIMARY KEY,
+    newest_id TEXT,
+    newest_create_time INTEGER,
+    max_cursor INTEGER,
+    updated_at REAL NOT NULL
+);
+'''
+
+
+def file_digest(file_name: str, chunk_size: int=1 << 20) -> str:
+    '''sha256 of file contents'''
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Ledger:
+    ''' Indexed manifest of videos keyed by video_id, updated in batched transactions '''
+
+    def __init__(self, path: str, batch_size: int=100):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.batch_size = batch_size
+        self._pending = []
+
+        # shared by the worker processes, wait for their transactions like the job store does
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def completed(self, video_ids, username: str=None) -> set:
+        '''subset of video_ids already downloaded, optionally for one username only'''
+        self.flush()
+        video_ids = list(video_ids)
+        found = set()
+        for start in range(0, len(video_ids), MAX_VARIABLES):
+            chunk = video_ids[start:start + MAX_VARIABLES]
+            placeholders = ','.join('?' * len(chunk))
+            query = f'SELECT video_id FROM videos WHERE status = ? AND video_id IN ({placeholders})'
+            params = [DONE] + chunk
+            if username is not None:
+                query += ' AND username = ?'
+                params.append(username)
+            found.update(row[0] for row in self.conn.execute(query, params))
+        return found
+
+
+    def record(self, video_id, username: str, status: str, mode: str=None, url: str=None, size: int=None, hash: str=None) -> None:
+        '''buffer a status update, flushed every batch_size records'''
+        self._pending.append((str(video_id), username, mode, url, size, hash, status, time.time()))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+
+    def flush(self) -> None:
+        '''write buffered updates in one transaction'''
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        try:
+            with self.conn:
+                self.conn.executemany('''
+                    INSERT INTO videos (video_id, username, mode, url, size, hash, status, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?8, ?8)
+                    ON CONFLICT (video_id, username) DO UPDATE SET
+                        mode = COALESCE(excluded.mode, mode),
+                        url = COALESCE(excluded.url, url),
+                        size = COALESCE(excluded.size, size),
+                        hash = COALESCE(excluded.hash, hash),
+                        status = excluded.status,
+                        updated_at = excluded.updated_at
+                ''', pending)
+        except sqlite3.Error:
+            # keep the batch for the next flush, e.g. after the database stayed locked too long
+            self._pending[:0] = pending
+            raise
+
+
+    def pending(self) -> list:
+        '''(username, video_id, url) of videos queued but never finished, e.g. after a crash'''
+        self.flush()
+        return self.conn.execute('SELECT username, video_id, url FROM videos WHERE status = ? AND url IS NOT NULL', (QUEUED,)).fetchall()
+
+
+    def unfinished(self, username: str, since: float=0) -> int:
+        '''number of videos of username queued or failed, updated at or after since'''
+        self.flush()
+        query = 'SELECT COUNT(*) FROM videos WHERE username = ? AND status IN (?, ?) AND updated_at >= ?'
+        return self.conn.execute(query, (username, QUEUED, FAILED, since)).fetchone()[0]
+
+
+    def get(self, video_id, username: str) -> dict:
+        '''ledger entry of a video or None'''
+        self.flush()
+        cursor = self.conn.execute('SELECT * FROM videos WHERE video_id = ? AND username = ?', (str(video_id), username))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+
+    def get_cursor(self, username: str) -> dict:
+        '''high-water mark of last incremental sync of username or None'''
+        cursor = self.conn.execute('SELECT * FROM cursors WHERE username = ?', (username,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+
+    def set_cursor(self, username: str, newest_id, newest_create_time: int, max_cursor: int=None) -> None:
+        '''store high-water mark of a completed sync'''
+        with self.conn:
+            self.conn.execute('''
+                INSERT OR REPLACE INTO cursors (username, newest_id, newest_create_time, max_cursor, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (username, str(newest_id), newest_create_time, max_cursor, time.time()))
+
+
+    def close(self) -> None:
+        self.flush()
+        self.conn.close()
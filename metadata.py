@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+
+''' Columnar store of scraped item metadata with vectorized queries '''
+
+import os
+import glob
+import time
+import uuid
+import numpy as np
+
+
+def _author(item) -> str:
+    '''uniqueId of item author, which is a dict or a plain string depending on endpoint'''
+    author = item.get('author', '')
+    if isinstance(author, dict):
+        return author.get('uniqueId', '')
+    return str(author)
+
+
+# column name -> (dtype, extractor from API item)
+COLUMNS = {
+    'id': (np.uint64, lambda item: int(item['id'])),
+    'author': (np.str_, _author),
+    'createTime': (np.int64, lambda item: int(item.get('createTime', 0))),
+    'duration': (np.int32, lambda item: int(item.get('video', {}).get('duration', 0))),
+    'diggCount': (np.int64, lambda item: int(item['stats']['diggCount'])),
+    'playCount': (np.int64, lambda item: int(item['stats']['playCount'])),
+    'shareCount': (np.int64, lambda item: int(item['stats']['shareCount'])),
+    'commentCount': (np.int64, lambda item: int(item['stats']['commentCount'])),
+}
+
+
+class Table:
+    ''' Set of equally long column arrays '''
+
+    def __init__(self, columns: dict):
+        self.columns = columns
+
+
+    @classmethod
+    def empty(cls):
+        return cls({name: np.array([], dtype=dtype) for name, (dtype, _) in COLUMNS.items()})
+
+
+    @classmethod
+    def from_items(cls, items: list):
+        '''build table from API item dicts'''
+        return cls({name: np.array([extract(item) for item in items], dtype=dtype) for name, (dtype, extract) in COLUMNS.items()})
+
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+
+    def __getitem__(self, key):
+        # column by name, rows by boolean mask or index array
+        if isinstance(key, str):
+            return self.columns[key]
+        return Table({name: column[key] for name, column in self.columns.items()})
+
+
+    def mask(self, **bounds) -> np.ndarray:
+        '''boolean mask of rows within bounds, column=low or column=(low, high), None for open ends'''
+        mask = np.ones(len(self), dtype=bool)
+        for name, bound in bounds.items():
+            low, high = bound if isinstance(bound, tuple) else (bound, None)
+            column = self.columns[name]
+            if low is not None:
+                mask &= column >= low
+            if high is not None:
+                mask &= column <= high
+        return mask
+
+
+    def where(self, **bounds):
+        '''rows within bounds, see mask()'''
+        return self[self.mask(**bounds)]
+
+
+    def top(self, column: str, k: int):
+        '''k rows with the largest values of column, largest first'''
+        values = self.columns[column]
+        if k >= len(values):
+            order = np.argsort(values)[::-1]
+        else:
+            # O(n) selection, only the k winners get sorted
+            order = np.argpartition(values, -k)[-k:]
+            order = order[np.argsort(values[order])[::-1]]
+        return self[order]
+
+
+    def records(self) -> list:
+        '''rows as list of dicts'''
+        names = list(self.columns)
+        return [dict(zip(names, row)) for row in zip(*(self.columns[name].tolist() for name in names))]
+
+
+    @classmethod
+    def concat(cls, tables: list):
+        if not tables:
+            return cls.empty()
+        return cls({name: np.concatenate([table.columns[name] for table in tables]) for name in COLUMNS})
+
+
+class MetadataStore:
+    ''' Append-only directory of .npz column chunks, deduplicated by id on load '''
+
+    def __init__(self, path: str, chunk_rows: int=10000):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self._buffer = []
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+    def _chunks(self) -> list:
+        return sorted(glob.glob(os.path.join(self.path, 'chunk-*.npz')))
+
+
+    def append(self, items: list) -> None:
+        '''buffer API items, written as one chunk every chunk_rows items'''
+        self._buffer.extend(items)
+        if len(self._buffer) >= self.chunk_rows:
+            self.flush()
+
+
+    def _write(self, table: Table, stamp: int=None) -> None:
+        '''atomically write table as a new chunk, named by write time so chunks sort oldest first'''
+        # pid and a random suffix keep names unique across processes sharing the directory
+        stamp = time.time_ns() if stamp is None else stamp
+        file_name = os.path.join(self.path, f'chunk-{stamp:020d}-{os.getpid()}-{uuid.uuid4().hex[:8]}.npz')
+        tmp_name = f'{file_name}.tmp'
+        with open(tmp_name, 'wb') as file:
+            np.savez(file, **table.columns)
+        os.replace(tmp_name, file_name)
+
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        buffer, self._buffer = self._buffer, []
+        self._write(Table.from_items(buffer))
+
+
+    def load(self) -> Table:
+        '''all rows, keeping the most recently written row per id'''
+        self.flush()
+        return self._read(self._chunks())
+
+
+    def _read(self, chunks: list) -> Table:
+        tables = []
+        for chunk in chunks:
+            with np.load(chunk) as data:
+                tables.append(Table({name: data[name] for name in COLUMNS}))
+        table = Table.concat(tables)
+
+        # latest stats win, unique on reversed ids keeps last occurrence
+        ids = table['id'][::-1]
+        _, first = np.unique(ids, return_index=True)
+        keep = np.sort(len(ids) - 1 - first)
+        return table[keep]
+
+
+    def compact(self) -> None:
+        '''merge all chunks into one deduplicated chunk'''
+        self.flush()
+        # chunks written by other processes from here on are neither merged nor removed
+        chunks = self._chunks()
+        if len(chunks) <= 1:
+            return
+        table = self._read(chunks)
+
+        # merged chunk takes the place of the newest one it replaces, so later chunks still win
+        # and a crash before cleanup only leaves duplicates
+        self._write(table, stamp=int(os.path.basename(chunks[-1])[6:-4].split('-')[0]))
+        for chunk in chunks:
+            os.remove(chunk)
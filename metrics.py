@@ -0,0 +1,266 @@
+#!/usr/bin/python3
+
+''' Counters, gauges and histograms of the scrape pipeline, exported as Prometheus text or JSON '''
+
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# seconds, from a warm signer call up to a slow video download
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 5, 10, 20, 30, 50, 75, 99)
+
+
+def _key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple) -> str:
+    if not key:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in key) + '}'
+
+
+class Metric:
+    ''' Values per label set, updates are a lock and a dict operation '''
+
+    type = None
+
+    def __init__(self, name: str, help: str=''):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+
+    def samples(self) -> list:
+        '''(suffix, label key, value) tuples'''
+        with self._lock:
+            return [('', key, value) for key, value in self._values.items()]
+
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {_format_labels(key) or 'value': value for key, value in self._values.items()}
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float=1, **labels) -> None:
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+    def value(self, **labels) -> float:
+        return self._values.get(_key(labels), 0)
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[_key(labels)] = value
+
+
+    def value(self, **labels) -> float:
+        return self._values.get(_key(labels), 0)
+
+
+class Histogram(Metric):
+    ''' Cumulative buckets plus sum and count, as Prometheus expects '''
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str='', buckets: tuple=TIME_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+
+
+    def observe(self, value: float, **labels) -> None:
+        key = _key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+
+    @contextmanager
+    def time(self, **labels):
+        '''observe seconds spent in the with block'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+    def count(self, **labels) -> int:
+        state = self._values.get(_key(labels))
+        return state[2] if state else 0
+
+
+    def samples(self) -> list:
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += bucket
+                    samples.append(('_bucket', key + (('le', bound),), cumulative))
+                samples.append(('_sum', key, total))
+                samples.append(('_count', key, count))
+        return samples
+
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {_format_labels(key) or 'value': {'count': count, 'sum': total, 'mean': total / count if count else 0.0}
+                    for key, (counts, total, count) in self._values.items()}
+
+
+class Registry:
+    ''' Named metrics of one process '''
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+
+    def _get(self, cls, name: str, help: str, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, **kwargs)
+            return metric
+
+
+    def counter(self, name: str, help: str='') -> Counter:
+        return self._get(Counter, name, help)
+
+
+    def gauge(self, name: str, help: str='') -> Gauge:
+        return self._get(Gauge, name, help)
+
+
+    def histogram(self, name: str, help: str='', buckets: tuple=TIME_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, buckets=buckets)
+
+
+    def prometheus(self) -> str:
+        '''text exposition format'''
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for suffix, key, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{_format_labels(key)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+    def snapshot(self) -> dict:
+        return {'time': time.time(), **{name: metric.snapshot() for name, metric in list(self._metrics.items())}}
+
+
+REGISTRY = Registry()
+
+# hot path metrics, shared by all modules of this process
+SIGN_SECONDS = REGISTRY.histogram('tiktok_sign_seconds', 'Time to sign a batch of URLs')
+API_SECONDS = REGISTRY.histogram('tiktok_api_request_seconds', 'Signed API request latency including retries')
+API_RETRIES = REGISTRY.counter('tiktok_api_retries_total', 'Retried API requests')
+API_FAILURES = REGISTRY.counter('tiktok_api_failures_total', 'API requests failed after all retries')
+PAGES = REGISTRY.counter('tiktok_pages_total', 'item_list pages fetched')
+ITEMS_PER_PAGE = REGISTRY.histogram('tiktok_items_per_page', 'Matching items per item_list page', COUNT_BUCKETS)
+QUEUE_DEPTH = REGISTRY.gauge('tiktok_queue_depth', 'Videos waiting for a download worker')
+CONCURRENCY = REGISTRY.gauge('tiktok_download_concurrency', 'Downloads allowed at once by the adaptive limiter')
+DOWNLOAD_SECONDS = REGISTRY.histogram('tiktok_download_seconds', 'Time to download one video')
+DOWNLOAD_BYTES = REGISTRY.counter('tiktok_download_bytes_total', 'Bytes downloaded per worker')
+DOWNLOADS = REGISTRY.counter('tiktok_downloads_total', 'Finished downloads by status')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.startswith('/metrics.json'):
+            body, content_type = json.dumps(self.registry.snapshot()).encode(), 'application/json'
+        elif self.path.startswith('/metrics'):
+            body, content_type = self.registry.prometheus().encode(), 'text/plain; version=0.0.4'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port: int, host: str='127.0.0.1', registry: Registry=REGISTRY) -> ThreadingHTTPServer:
+    '''serve /metrics (Prometheus) and /metrics.json from a daemon thread'''
+    handler = type('Handler', (_Handler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    print(f'Metrics on http://{host}:{server.server_address[1]}/metrics')
+    return server
+
+
+class SnapshotWriter(threading.Thread):
+    ''' Writes a JSON snapshot to file_name every interval seconds, and once more on stop() '''
+
+    def __init__(self, file_name: str, interval: float=10, registry: Registry=REGISTRY):
+        super().__init__(name='metrics-snapshot', daemon=True)
+        self.file_name = file_name
+        self.interval = interval
+        self.registry = registry
+        self._stop_event = threading.Event()
+
+
+    def write(self) -> None:
+        with open(f'{self.file_name}.tmp', 'w') as file:
+            json.dump(self.registry.snapshot(), file)
+        # readers never see a half written snapshot
+        os.replace(f'{self.file_name}.tmp', self.file_name)
+
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.write()
+
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+        self.write()
+
+
+def export(port: int=None, file_name: str=None, interval: float=10):
+    '''start the requested exporters, returns a function stopping them'''
+    server = serve(port) if port is not None else None
+    writer = SnapshotWriter(file_name, interval) if file_name else None
+    if writer is not None:
+        writer.start()
+
+    def stop():
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        if writer is not None:
+            writer.stop()
+
+    return stop
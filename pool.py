@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+
+''' Pool of TikTok signers leased across threads '''
+
+import queue
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from api import TikTok
+
+
+class SignerPool:
+    ''' Fixed size pool of TikTok objects, each owning its own headless Chrome '''
+
+    def __init__(self, size: int=2, path: str=None, proxify: bool=False, http_fetch: bool=False, proxy_pool=None, signer_factory=None):
+        assert size > 0, 'Pool size must be at least 1'
+        self.size = size
+        self.path = path
+        self.proxify = proxify
+        self.http_fetch = http_fetch
+        # shared ProxyPool, each driver gets the next proxy in rank order
+        self.proxy_pool = proxy_pool
+        # e.g. signer.JSSigner, members then sign without Chrome
+        self.signer_factory = signer_factory
+
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._refill_lock = threading.Lock()
+        self._members = []
+        self._closed = False
+
+        # start all drivers up front so leases never pay startup cost
+        for _ in range(size):
+            self._idle.put(self._spawn())
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def _spawn(self) -> TikTok:
+        '''start a new TikTok object and register it as pool member'''
+        options = {'signer': self.signer_factory()} if self.signer_factory is not None else {}
+        tt = TikTok(path=self.path, proxify=self.proxify, http_fetch=self.http_fetch, proxy_pool=self.proxy_pool, **options)
+        with self._lock:
+            self._members.append(tt)
+        return tt
+
+
+    def _discard(self, tt: TikTok) -> None:
+        '''quit driver of a dead member and forget about it'''
+        with self._lock:
+            if tt in self._members:
+                self._members.remove(tt)
+        try:
+            if getattr(tt, 'signer', None) is not None:
+                tt.signer.close()
+            else:
+                tt.driver.quit()
+        except Exception:
+            pass
+
+
+    def _refill(self) -> None:
+        '''spawn idle members until pool is back to its configured size'''
+        with self._refill_lock:
+            while True:
+                with self._lock:
+                    if len(self._members) >= self.size:
+                        return
+                self._idle.put(self._spawn())
+
+
+    @staticmethod
+    def healthy(tt: TikTok) -> bool:
+        '''check if driver of TikTok object still responds'''
+        try:
+            if getattr(tt, 'signer', None) is not None:
+                return tt.signer.healthy()
+            tt.driver.execute_script('return 1;')
+            return True
+        except Exception:
+            return False
+
+
+    def lease(self, timeout: float=None) -> TikTok:
+        '''take a healthy TikTok object out of the pool, respawning crashed drivers'''
+        if self._closed:
+            raise Exception('SignerPool is closed')
+
+        # replace members lost to failed respawns
+        self._refill()
+
+        try:
+            tt = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f'No signer available after {timeout}s')
+
+        if not self.healthy(tt):
+            print('Signer crashed, respawning driver')
+            self._discard(tt)
+            tt = self._spawn()
+
+        return tt
+
+
+    def release(self, tt: TikTok) -> None:
+        '''return leased TikTok object to the pool'''
+        if self._closed:
+            self._discard(tt)
+            return
+        self._idle.put(tt)
+
+
+    @contextmanager
+    def leased(self, timeout: float=None):
+        '''context manager around lease/release'''
+        tt = self.lease(timeout)
+        try:
+            yield tt
+        finally:
+            self.release(tt)
+
+
+    def map(self, func, items) -> list:
+        '''call func(tt, item) for every item in parallel, one leased signer per call'''
+        def task(item):
+            with self.leased() as tt:
+                return func(tt, item)
+
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            return list(executor.map(task, items))
+
+
+    def close(self) -> None:
+        '''quit all drivers'''
+        self._closed = True
+        with self._lock:
+            members = list(self._members)
+        for tt in members:
+            self._discard(tt)
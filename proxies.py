@@ -1,9 +1,13 @@
 #!/usr/bin/python3'
 import json
-import requests
+import time
 import random
+import asyncio
+import threading
+import aiohttp
+import requests
 from lxml import html
-from selenium import webdriver
+from concurrent.futures import ThreadPoolExecutor
 
 
 def fetch_proxies() -> list:
@@ -30,3 +34,155 @@ def get_my_ip() -> str:
     assert reply.status_code == 200
 
     return reply.text
+
+
+class ProxyPool:
+    ''' Health-checked proxy pool ranked by measured latency and success rate '''
+
+    def __init__(self, source=fetch_proxies, test_url: str='https://www.tiktok.com/robots.txt',
+                 timeout: float=5, concurrency: int=50, max_failures: int=3):
+        self.source = source
+        self.test_url = test_url
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.max_failures = max_failures
+
+        # proxy -> {'latency', 'ok', 'fail', 'consecutive'}
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._cursor = 0
+        self._refresher = None
+        self._stop = threading.Event()
+
+
+    def __len__(self):
+        with self._lock:
+            return len(self.stats)
+
+
+    async def _probe(self, session, semaphore, proxy: str):
+        '''returns latency of test request through proxy or None if it failed'''
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                async with session.get(self.test_url, proxy=f'http://{proxy}') as response:
+                    if response.status != 200:
+                        return None
+                    await response.read()
+            except Exception:
+                return None
+            return time.monotonic() - start
+
+
+    async def _probe_all(self, candidates: list) -> list:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            return await asyncio.gather(*[self._probe(session, semaphore, proxy) for proxy in candidates])
+
+
+    def validate(self, candidates: list) -> dict:
+        '''probe candidates concurrently, returns {proxy: latency} of working ones'''
+        # private event loop in a helper thread, TikTok objects are created inside running loops
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='proxy-probe') as executor:
+            latencies = executor.submit(asyncio.run, self._probe_all(candidates)).result()
+        return {proxy: latency for proxy, latency in zip(candidates, latencies) if latency is not None}
+
+
+    def refresh(self) -> int:
+        '''fetch and validate new candidates, re-check known ones, returns number of live proxies'''
+        candidates = [f"{proxy['ip']}:{int(proxy['port'])}" for proxy in self.source()]
+        with self._lock:
+            candidates = list(dict.fromkeys(candidates + list(self.stats)))
+
+        alive = self.validate(candidates)
+        for proxy in candidates:
+            self.report(proxy, proxy in alive, alive.get(proxy))
+
+        return len(self)
+
+
+    def report(self, proxy: str, ok: bool, latency: float=None) -> None:
+        '''record outcome of a request through proxy, evicting it after max_failures in a row'''
+        with self._lock:
+            stats = self.stats.get(proxy)
+            if stats is None:
+                # never add proxies that failed their first check
+                if not ok:
+                    return
+                stats = self.stats[proxy] = {'latency': latency, 'ok': 0, 'fail': 0, 'consecutive': 0}
+
+            if ok:
+                stats['ok'] += 1
+                stats['consecutive'] = 0
+                if latency is not None:
+                    # exponentially weighted moving average
+                    stats['latency'] = latency if stats['latency'] is None else 0.7 * stats['latency'] + 0.3 * latency
+            else:
+                stats['fail'] += 1
+                stats['consecutive'] += 1
+                if stats['consecutive'] >= self.max_failures:
+                    del self.stats[proxy]
+
+
+    @staticmethod
+    def score(stats: dict) -> float:
+        '''higher is better, success rate over latency'''
+        success_rate = (stats['ok'] + 1) / (stats['ok'] + stats['fail'] + 2)
+        latency = stats['latency'] if stats['latency'] else 1.0
+        return success_rate / latency
+
+
+    def ranked(self) -> list:
+        '''live proxies, best first'''
+        with self._lock:
+            return sorted(self.stats, key=lambda proxy: self.score(self.stats[proxy]), reverse=True)
+
+
+    def best(self) -> str:
+        '''best ranked proxy, refreshing the pool if it is empty'''
+        if not len(self):
+            self.refresh()
+        ranked = self.ranked()
+        if not ranked:
+            raise Exception('No working proxies available')
+        return ranked[0]
+
+
+    def rotate(self) -> str:
+        '''cycle through live proxies in rank order, for per-request rotation'''
+        if not len(self):
+            self.refresh()
+        ranked = self.ranked()
+        if not ranked:
+            raise Exception('No working proxies available')
+        with self._lock:
+            proxy = ranked[self._cursor % len(ranked)]
+            self._cursor += 1
+        return proxy
+
+
+    def start(self, interval: float=600) -> None:
+        '''refresh pool in a background thread every interval seconds'''
+        if self._refresher is not None:
+            return
+
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f'Proxy refresh failed: {e}')
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._refresher = threading.Thread(target=loop, daemon=True)
+        self._refresher.start()
+
+
+    def stop(self) -> None:
+        '''stop background refresh'''
+        self._stop.set()
+        if self._refresher is not None:
+            self._refresher.join()
+            self._refresher = None
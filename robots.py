@@ -2,16 +2,85 @@
 
 ''' Get allowed UA's from robots.txt '''
 
-import requests
+import os
 import re
+import json
+import time
+import requests
+from utils import CACHE_DIR
 
-def getAllowedAgents():
-    regex = re.compile(r'(?:User-agent: (\w+)+\n)|(?:(Allow: /)\n)')
 
-    reply = requests.get('https://www.tiktok.com/robots.txt')
-    assert reply.status_code == 200
+ROBOTS_URL = 'https://www.tiktok.com/robots.txt'
+CACHE_FILE = os.path.join(CACHE_DIR, 'robots.json')
+CACHE_TTL = 24 * 60 * 60 # seconds
+
+# parsed result memoized for the lifetime of the process
+_agents = None
+_fetched_at = 0
+
 
-    results = regex.findall(reply.text)
+def parseAllowedAgents(text: str) -> list:
+    '''parse User-agent entries preceding the first Allow: / rule'''
+    regex = re.compile(r'(?:User-agent: (\w+)+\n)|(?:(Allow: /)\n)')
+
+    results = regex.findall(text)
     limit = results.index(('','Allow: /'))
 
     return [item[0] for index, item in enumerate(results) if index < limit]
+
+
+def _readCache(cache_file: str):
+    '''returns (agents, fetched_at) from disk cache or (None, 0)'''
+    try:
+        with open(cache_file, 'r') as file:
+            cache = json.load(file)
+        return cache['agents'], cache['fetched_at']
+    except (OSError, ValueError, KeyError):
+        return None, 0
+
+
+def _writeCache(cache_file: str, agents: list, fetched_at: float) -> None:
+    '''atomically write agents to disk cache'''
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+    with open(tmp_file, 'w') as file:
+        json.dump({'agents': agents, 'fetched_at': fetched_at}, file)
+    os.replace(tmp_file, cache_file)
+
+
+def getAllowedAgents(ttl: float=CACHE_TTL, cache_file: str=CACHE_FILE, refresh: bool=False) -> list:
+    '''User-Agents allowed by robots.txt, memoized and cached on disk for ttl seconds'''
+    global _agents, _fetched_at
+    now = time.time()
+
+    if not refresh:
+        # memoized result
+        if _agents is not None and now - _fetched_at < ttl:
+            return _agents
+
+        # disk cache
+        agents, fetched_at = _readCache(cache_file)
+        if agents and now - fetched_at < ttl:
+            _agents, _fetched_at = agents, fetched_at
+            return _agents
+
+    try:
+        reply = requests.get(ROBOTS_URL)
+        assert reply.status_code == 200
+        agents = parseAllowedAgents(reply.text)
+
+    except Exception:
+        # fall back to stale cache rather than failing
+        stale, fetched_at = _readCache(cache_file)
+        if not stale:
+            raise
+        _agents, _fetched_at = stale, fetched_at
+        return _agents
+
+    _agents, _fetched_at = agents, now
+    try:
+        _writeCache(cache_file, agents, now)
+    except OSError:
+        pass
+
+    return _agents
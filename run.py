@@ -2,17 +2,35 @@
 import os
 import sys
 import enum
+import time
 import random
+import shutil
 import asyncio
+import threading
 import aiohttp
-import aiofiles
+from urllib.parse import urlparse
 from api import TikTok
+from signer import JSSigner
+from sessions import SessionStore
+from cache import ResponseCache
+from ledger import Ledger, file_digest, QUEUED, DONE, FAILED
+from content import ContentStore
+from metadata import MetadataStore
+from filters import Predicate
+from adaptive import AdaptiveLimiter
+from writer import FileWriter, READ_CHUNK_SIZE
+from metrics import export, QUEUE_DEPTH, CONCURRENCY, DOWNLOAD_SECONDS, DOWNLOAD_BYTES, DOWNLOADS
 from robots import getAllowedAgents
-from utils import download_chromedriver, has_chromedriver, Release
+from utils import download_chromedriver, has_chromedriver
 
 
 DOWNLOADS_BASE_DIR = './videos'
-MAX_CONCURRENT = 4
+LEDGER_PATH = f'{DOWNLOADS_BASE_DIR}/ledger.sqlite'
+METADATA_PATH = f'{DOWNLOADS_BASE_DIR}/metadata'
+CONTENT_PATH = f'{DOWNLOADS_BASE_DIR}/.content'
+MAX_CONCURRENT = 4      # initial number of concurrent downloads
+MAX_WORKERS = 64        # upper bound for adaptive concurrency
+MAX_PER_HOST = None     # optional cap of concurrent downloads per CDN host
 
 
 class Scrape(enum.Enum):
@@ -24,42 +42,183 @@ class Scrape(enum.Enum):
     NONE = -1
 
 
-async def download_worker(name, queue, session) -> None:
+async def download_worker(name, queue, session, ledger: Ledger=None, limiter: AdaptiveLimiter=None, content: ContentStore=None) -> None:
     ''' async function for handling worker queue'''
+    loop = asyncio.get_event_loop()
     while True:
         # get job from queue
         job = await queue.get()
 
         # unpack job
         username, video_id, video_url = job
+        QUEUE_DEPTH.set(queue.qsize())
 
         file_name = f'{DOWNLOADS_BASE_DIR}/{username}/{video_id}.mp4'
-        print(f'[ w-{name} | q-{queue.qsize():03d} ] Downloading -> {file_name}')
 
-        # download video
-        if not await download_video(session, file_name, *job):
+        # download video, within the limits of the adaptive controller
+        stats = {}
+        if limiter is None:
+            print(f'[ w-{name} | q-{queue.qsize():03d} ] Downloading -> {file_name}')
+            start = time.monotonic()
+            ok = await download_video(session, file_name, *job, stats=stats)
+            elapsed = time.monotonic() - start
+        else:
+            async with limiter.slot(urlparse(video_url).hostname):
+                print(f'[ w-{name} | q-{queue.qsize():03d} | c-{limiter.level:02d} ] Downloading -> {file_name}')
+                start = time.monotonic()
+                ok = await download_video(session, file_name, *job, stats=stats)
+                elapsed = time.monotonic() - start
+                await limiter.record(stats.get('bytes', 0), elapsed, ok, stats.get('status'))
+            CONCURRENCY.set(limiter.level)
+
+        # bytes/s per worker is the rate of its byte counter
+        DOWNLOAD_SECONDS.observe(elapsed)
+        DOWNLOAD_BYTES.inc(stats.get('bytes', 0), worker=name)
+        DOWNLOADS.inc(status='ok' if ok else 'failed')
+
+        if ok:
+            # move into the content store, leaving a link behind
+            if content is not None:
+                digest = await loop.run_in_executor(None, content.ingest, video_id, file_name)
+            elif ledger is not None:
+                digest = await loop.run_in_executor(None, file_digest, file_name)
+            if ledger is not None:
+                ledger.record(video_id, username, DONE, size=os.path.getsize(file_name), hash=digest)
+        else:
             print(f'[ w-{name} | q-{queue.qsize():03d} ] Download FAILED for {file_name}')
-        
+            if ledger is not None:
+                ledger.record(video_id, username, FAILED)
+
         # mark job as completed
         queue.task_done()
 
 
-async def download_video(session, file_name, username, video_id, video_url) -> bool:
-    ''' download video from url and write to file '''
+def content_total(response, offset: int=0):
+    ''' total size of resource from Content-Range or Content-Length, None if unknown '''
+    content_range = response.headers.get('Content-Range')
+    if content_range and '/' in content_range:
+        total = content_range.rsplit('/', 1)[1]
+        return int(total) if total.isdigit() else None
+
+    content_length = response.headers.get('Content-Length')
+    return offset + int(content_length) if content_length else None
+
+
+async def is_complete(session, file_name, video_url) -> bool:
+    ''' validate existing file against remote size and saved ETag, False if the server can't confirm it '''
+    # expired CDN urls and hosts rejecting HEAD fall back to the Range request, which answers 416 for a whole file
+    try:
+        async with session.head(video_url, allow_redirects=True) as response:
+            if response.status != 200:
+                return False
+            total = content_total(response)
+            etag = response.headers.get('ETag')
+    except Exception:
+        return False
+
+    etag_name = f'{file_name}.etag'
+    if etag and os.path.exists(etag_name):
+        with open(etag_name, 'r') as file:
+            if file.read().strip() != etag:
+                return False
+
+    return total is not None and total == os.path.getsize(file_name)
+
+
+async def download_video(session, file_name, username, video_id, video_url, stats: dict=None) -> bool:
+    ''' download video from url into a .part file, resuming with Range, and rename on completion '''
+    # status code and bytes received are reported through stats
+    if stats is None:
+        stats = {}
+    stats['bytes'] = 0
+
+    part_name = f'{file_name}.part'
+    etag_name = f'{part_name}.etag'
+    alloc_name = f'{part_name}.alloc'
+
     try:
-        # get bytes from url
-        response = await session.request(method='GET', url=video_url)
-
-        # check for status code
-        status_code = response.status
-        if status_code != 200:
-            raise Exception(f'Error {status_code}')
-
-        # save bytes to file
-        async with aiofiles.open(file_name, 'wb') as file:
-            async for data_chunk in response.content.iter_chunked(1024):
-                if data_chunk:
-                    await file.write(data_chunk)
+        # skip files completed by a previous run
+        if os.path.exists(file_name):
+            if await is_complete(session, file_name, video_url):
+                print(f'Skipping complete file {file_name}')
+                return True
+            # truncated or unconfirmed file, resume it and let the server tell what is missing
+            if os.path.islink(file_name) or os.stat(file_name).st_nlink > 1:
+                # a link into the content store, writing it would alter the stored object and every
+                # folder linked to it; resume a private copy, which the worker ingests again
+                shutil.copyfile(file_name, part_name)
+                os.remove(file_name)
+            else:
+                os.replace(file_name, part_name)
+            if os.path.exists(f'{file_name}.etag'):
+                os.replace(f'{file_name}.etag', etag_name)
+
+        # size of a preallocated part says nothing about progress, start it over
+        if os.path.exists(alloc_name):
+            if os.path.exists(part_name):
+                os.remove(part_name)
+            os.remove(alloc_name)
+
+        # resume from existing partial download
+        offset = os.path.getsize(part_name) if os.path.exists(part_name) else 0
+        headers = {}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            if os.path.exists(etag_name):
+                with open(etag_name, 'r') as file:
+                    # only honour Range if the resource did not change
+                    headers['If-Range'] = file.read().strip()
+
+        async with session.get(video_url, headers=headers) as response:
+            status_code = response.status
+            stats['status'] = status_code
+
+            # partial file already holds the whole resource
+            if status_code == 416 and offset:
+                total = content_total(response)
+                if total is not None and total != offset:
+                    raise Exception(f'Error {status_code}')
+
+            # check for status code
+            elif status_code in (200, 206):
+                if status_code == 200:
+                    # server ignored Range or resource changed, start over
+                    offset = 0
+                total = content_total(response, offset)
+
+                etag = response.headers.get('ETag')
+                if etag:
+                    with open(etag_name, 'w') as file:
+                        file.write(etag)
+
+                # save bytes to file in large coalesced writes
+                try:
+                    async with FileWriter(part_name, append=bool(offset)) as file:
+                        # preallocate fresh downloads, marked so a hard crash restarts them
+                        if not offset and total:
+                            open(alloc_name, 'w').close()
+                            file.preallocate(total)
+
+                        async for data_chunk in response.content.iter_chunked(READ_CHUNK_SIZE):
+                            if data_chunk:
+                                await file.write(data_chunk)
+                                stats['bytes'] += len(data_chunk)
+                finally:
+                    # closing truncated the part file to the bytes written, offset is meaningful again
+                    if os.path.exists(alloc_name):
+                        os.remove(alloc_name)
+
+                size = os.path.getsize(part_name)
+                if total is not None and size != total:
+                    raise Exception(f'Incomplete download {size}/{total} bytes')
+
+            else:
+                raise Exception(f'Error {status_code}')
+
+        # atomically publish completed file, its ETag kept to notice a changed resource later
+        os.replace(part_name, file_name)
+        if os.path.exists(etag_name):
+            os.replace(etag_name, f'{file_name}.etag')
         status = True
 
     except Exception as e:
@@ -69,27 +228,115 @@ async def download_video(session, file_name, username, video_id, video_url) -> b
     return status
 
 
-async def scrape(mode, username: str=None, count: int=0, likes: int=0, views: int=0, shares: int=0, comments: int=0):
-    ''' general scrape method '''
-    tt = TikTok(proxify=False)
+async def enqueue_pages(pages, queue, username: str, ledger: Ledger=None, mode: str=None, on_page=None,
+                        content: ContentStore=None, scheduled: set=None) -> int:
+    ''' fetch pages in a worker thread and enqueue items as each page arrives '''
+    # scheduled holds (username, video_id) of everything this run queued, shared by all its targets
+    loop = asyncio.get_event_loop()
+    done = object()
+
+    def next_page():
+        # TikTok calls are blocking, keep them off the event loop
+        return next(pages, done)
+
+    added = 0
+    while True:
+        page = await loop.run_in_executor(None, next_page)
+        if page is done:
+            break
+
+        # pages are already filtered by the predicate inside the paginator
+        items = page
+
+        # skip videos the ledger already has, one query per page
+        if ledger is not None:
+            completed = ledger.completed([str(item['id']) for item in items], username)
+            items = [item for item in items if str(item['id']) not in completed]
+
+        # videos downloaded for another folder are linked instead of downloaded again
+        if content is not None and items:
+            stored = content.lookup(item['id'] for item in items)
+            linked = set()
+            for video_id, digest in stored.items():
+                file_name = f'{DOWNLOADS_BASE_DIR}/{username}/{video_id}.mp4'
+                if content.link(video_id, file_name, digest):
+                    print('Linking from store:', video_id)
+                    linked.add(video_id)
+                    if ledger is not None:
+                        ledger.record(video_id, username, DONE, mode=mode, size=os.path.getsize(file_name), hash=digest)
+            items = [item for item in items if str(item['id']) not in linked]
+
+        for item in items:
+            video_id = item['id']
+            download_url = item['video']['downloadAddr']
+
+            # another target of the same folder, e.g. a second hashtag, already queued it
+            if scheduled is not None:
+                if (username, str(video_id)) in scheduled:
+                    continue
+                scheduled.add((username, str(video_id)))
+            print('Adding to queue:', video_id)
+            if ledger is not None:
+                ledger.record(video_id, username, QUEUED, mode=mode, url=download_url)
+            await queue.put((username, video_id, download_url))
+            added += 1
+
+        # page fully handed over, ledger entries must be durable before progress is
+        if on_page is not None:
+            if ledger is not None:
+                ledger.flush()
+            on_page(page)
+
+    return added
+
+
+def advance_marks(ledger: Ledger, marks: list, since: float) -> None:
+    ''' store (username, mark, max_cursor) high-water marks once their downloads are over '''
+    # a failed download keeps the old mark, so the next sync pages down to it and queues the video again
+    for username, mark, max_cursor in marks:
+        failed = ledger.unfinished(username, since)
+        if failed:
+            print(f'Keeping high-water mark of {username}, {failed} downloads not finished')
+            continue
+        ledger.set_cursor(username, mark['newest_id'], mark['newest_create_time'], max_cursor)
+
+
+def track_newest(items: list, mark: dict) -> None:
+    ''' remember id and createTime of the newest item seen '''
+    for item in items:
+        create_time = item.get('createTime', 0)
+        if create_time > mark.get('newest_create_time', -1):
+            mark['newest_id'] = item['id']
+            mark['newest_create_time'] = create_time
+
+
+async def open_pages(tt, mode, username: str=None, count: int=0, predicate: Predicate=None, ledger: Ledger=None,
+                     incremental: bool=False, cursor: int=0, store: MetadataStore=None, max_pages: int=None):
+    ''' resolve scrape target, returns (username, pages, mark) with mark tracking the newest item when incremental '''
+    # max_pages bounds the API pages of each target, see TikTok.iter_tiktoks
+    loop = asyncio.get_event_loop()
+    mark = {} if incremental and mode == Scrape.USER else None
+    lock = threading.Lock()
+
+    def on_page(items):
+        # every fetched item, also those the predicate rejects, so stored metadata can be
+        # filtered again later and a selective filter does not hold the mark back;
+        # called from paginator threads, several of them for multiple targets
+        with lock:
+            if store is not None:
+                store.append(items)
+            if mark is not None:
+                track_newest(items, mark)
 
     if mode == Scrape.TRENDING:
         # change videos to number of videos you want to return
         username = 'trending'
         if count < 0:
             count = 30
-        try:
-            results = tt.getTrending(count)
-        except Exception as e:
-            print('Exception:', e)
-            return None
+        pages = tt.iterTrending(count, predicate, cursor=cursor, on_page=on_page, max_pages=max_pages)
 
     elif mode == Scrape.USER:
-        try:
-            details = tt.getUserDetails(username)
-        except Exception as e:
-            print('Exception:', e)
-            return None
+        details = await loop.run_in_executor(None, tt.getUserDetails, username)
 
         userInfo = details['userInfo']
         _id = userInfo['user']['id']
@@ -100,33 +347,35 @@ async def scrape(mode, username: str=None, count: int=0, likes: int=0, views: in
         if count < 0:
             count = videos
 
-        results = tt.getUserTikToks(_id, count)
-
-    elif mode == Scrape.MUSIC:
-        pass
-
-    elif mode == Scrape.HASHTAG:
-        pass
-
-    #####################
-    # Results Filtering #
-    #####################
-    
-    # filter according to likes
-    if likes:
-        results = list(filter(lambda x: x['stats']['diggCount'] >= likes, results))
-
-    # filter according to views
-    if views:
-        results = list(filter(lambda x: x['stats']['playCount'] >= views, results))
+        if incremental:
+            # only fetch pages newer than the last completed sync; walk the whole feed
+            # down to known items so the stored high-water mark never leaves a gap
+            high_water = ledger.get_cursor(username)
+            since = high_water['newest_create_time'] if high_water else None
+            if since is not None:
+                print(f'Incremental sync of {username} since createTime {since}')
+            pages = tt.iterUserTikToks(_id, videos, since=since, predicate=predicate, cursor=cursor, on_page=on_page, max_pages=max_pages)
+        else:
+            pages = tt.iterUserTikToks(_id, count, predicate=predicate, cursor=cursor, on_page=on_page, max_pages=max_pages)
+
+    elif mode in (Scrape.MUSIC, Scrape.HASHTAG):
+        # one or more sounds/challenges, comma separated or as a list, sharing one folder per mode
+        targets = username.split(',') if isinstance(username, str) else list(username)
+        targets = [target.strip().lstrip('#') for target in targets if target.strip()]
+        if count < 0:
+            count = sys.maxsize
 
-    # filter according to shares
-    if shares:
-        results = list(filter(lambda x: x['stats']['shareCount'] >= shares, results))
+        # a single target keeps tt.nextCursor meaningful for resumable jobs
+        target = targets[0] if len(targets) == 1 else targets
+        if mode == Scrape.MUSIC:
+            username = 'music'
+            pages = tt.iterMusicTikToks(target, count, predicate, cursor=cursor, on_page=on_page, max_pages=max_pages)
+        else:
+            username = 'hashtag'
+            pages = tt.iterHashtagTikToks(target, count, predicate, cursor=cursor, on_page=on_page, max_pages=max_pages)
 
-    # filter according to comments
-    if comments:
-        results = list(filter(lambda x: x['stats']['commentCount'] >= comments, results))
+    else:
+        raise Exception(f'{mode} is not supported yet')
 
     # creates username folder if not present
     path = f'{DOWNLOADS_BASE_DIR}/{username}'
@@ -134,50 +383,105 @@ async def scrape(mode, username: str=None, count: int=0, likes: int=0, views: in
         print(f'Creating directory {path}')
         os.makedirs(path)
 
-    # explicitly delete TikTok object as we don't need to make any more API calls
-    del tt
+    return username, pages, mark
+
+
+def new_tiktok() -> TikTok:
+    ''' TikTok object of a scrape, signing without Chrome when TIKTOK_SIGNER=js '''
+    # otherwise a lean Chrome, attached to TIKTOK_CHROME_DEBUGGER (host:port) if set
+    # cookies and verifyFp of the last run are reused until TikTok rejects them
+    signer = JSSigner() if os.environ.get('TIKTOK_SIGNER') == 'js' else None
+    return TikTok(proxify=False, http_fetch=True, cache=ResponseCache(), signer=signer, lean=True,
+                  debugger_address=os.environ.get('TIKTOK_CHROME_DEBUGGER'), session_store=SessionStore())
+
+
+def download_headers() -> dict:
+    ''' HTTP headers of the video download session '''
+    return {
+        'User-Agent': random.choice(getAllowedAgents()),
+        'method': 'GET',
+        'accept-encoding': 'gzip, deflate, br',
+        'referrer': 'https://www.tiktok.com/trending',
+        'upgrade-insecure-requests': '1',
+    }
+
+
+def start_workers(queue, session, ledger: Ledger=None, content: ContentStore=None) -> list:
+    ''' spawn download workers, the limiter decides how many of them download at once '''
+    limiter = AdaptiveLimiter(initial=MAX_CONCURRENT, max_level=MAX_WORKERS, per_host=MAX_PER_HOST)
+    return [asyncio.create_task(download_worker(worker, queue, session, ledger, limiter, content)) for worker in range(MAX_WORKERS)]
+
+
+async def stop_workers(tasks: list) -> None:
+    ''' dismiss workers once queue is finished '''
+    print('\nFinishing tasks...\n')
+    for task in tasks:
+        task.cancel()
+
+    # wait until all workers are dismissed
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def scrape(mode, username: str=None, count: int=0, likes: int=0, views: int=0, shares: int=0, comments: int=0, incremental: bool=False,
+                 date_from=None, date_to=None, min_duration: int=None, max_duration: int=None, max_pages: int=None):
+    ''' general scrape method, downloads start while pagination is still running '''
+    # single-pass filter evaluated per page, count means matching videos
+    predicate = Predicate(likes=likes, views=views, shares=shares, comments=comments,
+                          date_from=date_from, date_to=date_to, min_duration=min_duration, max_duration=max_duration)
+
+    tt = new_tiktok()
+    ledger = Ledger(LEDGER_PATH)
+    store = MetadataStore(METADATA_PATH)
+    content = ContentStore(CONTENT_PATH)
+    started = time.time()
+    marks = []
+
+    try:
+        username, pages, mark = await open_pages(tt, mode, username, count, predicate, ledger, incremental, store=store,
+                                                 max_pages=max_pages)
+    except Exception as e:
+        print('Exception:', e)
+        ledger.close()
+        content.close()
+        return None
 
     # process results in a producer-consumer async loop
     try:
         queue = asyncio.Queue(maxsize=1000)
 
-        # enqueue items
-        for item in results:
-            video_id = item['id']
-            download_url = item['video']['downloadAddr']
-            print('Adding to queue:', video_id)
-            await queue.put((username, video_id, download_url))
+        # create http session
+        async with aiohttp.ClientSession(headers=download_headers()) as session:
+            # spawn worker tasks before the first page is fetched
+            tasks = start_workers(queue, session, ledger, content)
 
-        headers = {
-            'User-Agent': random.choice(getAllowedAgents()),
-            'method': 'GET',
-            'accept-encoding': 'gzip, deflate, br',
-            'referrer': 'https://www.tiktok.com/trending',
-            'upgrade-insecure-requests': '1',
-        }
+            # feed workers page by page
+            try:
+                added = await enqueue_pages(pages, queue, username, ledger=ledger, mode=mode.name, content=content, scheduled=set())
+                print(f'\nAll pages fetched, {added} videos queued\n')
 
-        # create http session
-        async with aiohttp.ClientSession(headers=headers) as session:
-            tasks = []
-            # spawn worker tasks
-            for worker in range(MAX_CONCURRENT):
-                task = asyncio.create_task(download_worker(worker, queue, session))
-                tasks.append(task)
+                # high-water mark of a completed pagination, stored once its downloads succeeded
+                if mark:
+                    marks.append((username, mark, tt.maxCursor))
+            except Exception as e:
+                print('Exception:', e)
 
             # wait until the queue is consumed
             print(f'\nWaiting for tasks in queue[{queue.qsize()}] to be processed...\n')
             await queue.join()
+            advance_marks(ledger, marks, started)
 
-        # dismiss workers once queue is finished
-        print('\nFinishing tasks...\n')
-        for task in tasks:
-            task.cancel()
-
-        # wait until all workers are dismissed
-        await asyncio.gather(*tasks, return_exceptions=True)
+        await stop_workers(tasks)
 
     except Exception as e:
-        print('Exception', e)  
+        print('Exception', e)
+
+    finally:
+        ledger.close()
+        store.flush()
+        content.close()
+
+        # explicitly delete TikTok object as we don't need to make any more API calls
+        del tt
 
 
 if __name__ == '__main__':
@@ -185,9 +489,7 @@ if __name__ == '__main__':
 
     # check if chromedriver is present and download if needed
     if not has_chromedriver():
-        # change to Release.BETA to use beta releases
-        # change to Release.STABLE to use stable releases
-        download_chromedriver(Release.AUTO_DETECT)
+        download_chromedriver()
 
     # default arguments
     mode = Scrape.TRENDING
@@ -201,16 +503,28 @@ if __name__ == '__main__':
     print('-=[ TikTok Public Video Scraper ]=-\n\n' +
             '0 - Scrape by Trending Videos\n' +
             '1 - Scrape by Username\n' +
-            '2 - Scrape by Music [WIP]\n' +
-            '3 - Scrape by Hashtag [WIP]\n')
+            '2 - Scrape by Music\n' +
+            '3 - Scrape by Hashtag\n')
 
     mode = Scrape(int(input('Enter choice [0-3]: ')))
 
     if mode == Scrape.USER:
         username = input('Enter username to scrape: ')
+    elif mode == Scrape.MUSIC:
+        username = input('Enter music ids to scrape, comma separated: ')
+    elif mode == Scrape.HASHTAG:
+        username = input('Enter hashtags to scrape, comma separated: ')
 
     count = int(input('\nHow many vidoes would you like to scrape [-1 for all possible]: '))
 
+    # optional Prometheus endpoint, e.g. TIKTOK_METRICS_PORT=9100
+    stop_metrics = export(int(os.environ['TIKTOK_METRICS_PORT']) if os.environ.get('TIKTOK_METRICS_PORT') else None)
+
+    # optional cap on API pages per target, e.g. TIKTOK_MAX_PAGES=20
+    max_pages = int(os.environ['TIKTOK_MAX_PAGES']) if os.environ.get('TIKTOK_MAX_PAGES') else None
+
     # run scrape routine
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(scrape(mode, username=username, count=count, likes=likes, views=views, shares=shares, comments=comments))
\ No newline at end of file
+    loop.run_until_complete(scrape(mode, username=username, count=count, likes=likes, views=views, shares=shares, comments=comments,
+                                   max_pages=max_pages))
+    stop_metrics()
\ No newline at end of file
@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+
+''' Cookies, verifyFp and User-Agent of a TikTok session persisted across runs '''
+
+import os
+import json
+import time
+from utils import CACHE_DIR
+
+
+SESSION_FILE = os.path.join(CACHE_DIR, 'session.json')
+SESSION_TTL = 24 * 60 * 60 # seconds
+
+
+class SessionStore:
+    ''' JSON file holding one session, expired by ttl or by its s_v_web_id cookie, whichever is first '''
+
+    def __init__(self, path: str=SESSION_FILE, ttl: float=SESSION_TTL, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+
+
+    def load(self) -> dict:
+        '''saved session, None if missing, unreadable or expired'''
+        try:
+            with open(self.path, 'r') as file:
+                session = json.load(file)
+            if self.clock() >= session['expires_at'] or not session['user_agent']:
+                return None
+            return session
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+
+    def save(self, user_agent: str, verify_fp: str, cookies: list) -> None:
+        '''atomically write session, cookies as returned by driver.get_cookies()'''
+        now = self.clock()
+        expires_at = now + self.ttl
+        for cookie in cookies:
+            if cookie.get('name') == 's_v_web_id' and cookie.get('expiry'):
+                expires_at = min(expires_at, cookie['expiry'])
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_file = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as file:
+            json.dump({'user_agent': user_agent, 'verifyFp': verify_fp, 'cookies': cookies,
+                       'saved_at': now, 'expires_at': expires_at}, file)
+        os.replace(tmp_file, self.path)
+
+
+    def clear(self) -> None:
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
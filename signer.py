@@ -0,0 +1,248 @@
+#!/usr/bin/python3
+
+''' Chrome-less signer running byted_acrawler.sign in an embedded JS runtime '''
+
+import os
+import json
+import time
+import random
+import string
+import shutil
+import threading
+import subprocess
+import requests
+from utils import CACHE_DIR
+
+
+# signing script normally loaded by the trending page
+SCRIPT_URL = 'https://sf16-muse-va.ibytedtos.com/obj/rc-web-sdk-gcs/acrawler.js'
+SCRIPT_FILE = os.path.join(CACHE_DIR, 'acrawler.js')
+SCRIPT_TTL = 24 * 60 * 60 # seconds
+
+PAGE_URL = 'https://www.tiktok.com/trending'
+
+# seconds a node process gets to exit before it is killed
+NODE_CLOSE_TIMEOUT = 5
+
+# minimal browser globals the signing script reads, %s are filled with JSON values
+SHIM = '''
+var window = globalThis, self = globalThis, top = globalThis, parent = globalThis;
+var navigator = {userAgent: %s, appVersion: %s, platform: 'Win32', language: 'en-US', languages: ['en-US', 'en'],
+                 cookieEnabled: true, webdriver: false, plugins: [], mimeTypes: [], hardwareConcurrency: 8};
+var location = {href: %s, protocol: 'https:', host: 'www.tiktok.com', hostname: 'www.tiktok.com',
+                origin: 'https://www.tiktok.com', pathname: '/trending', search: '', hash: ''};
+var screen = {width: 1920, height: 1080, availWidth: 1920, availHeight: 1040, colorDepth: 24, pixelDepth: 24};
+var history = {length: 1};
+var noop = function () {};
+var document = {cookie: %s, referrer: '', location: location, hidden: false, visibilityState: 'visible',
+                createElement: function () { return {style: {}, getContext: function () { return null; }, setAttribute: noop, appendChild: noop}; },
+                getElementsByTagName: function () { return []; }, querySelector: function () { return null; },
+                addEventListener: noop, removeEventListener: noop, documentElement: {style: {}}};
+window.addEventListener = window.removeEventListener = noop;
+var setTimeout = function () { return 0; }, clearTimeout = noop, setInterval = function () { return 0; }, clearInterval = noop;
+'''
+
+SIGN_EXPRESSION = 'urls.map(function (url) { return window.byted_acrawler.sign({ url: url }); })'
+
+# line protocol of the node runtime: {"source"} once, then {"urls"} -> {"signatures"}
+NODE_BOOTSTRAP = '''
+const vm = require('vm');
+const readline = require('readline');
+let context = null;
+readline.createInterface({ input: process.stdin }).on('line', (line) => {
+    let reply;
+    try {
+        const message = JSON.parse(line);
+        if (message.source !== undefined) {
+            context = vm.createContext({});
+            vm.runInContext(message.source, context);
+            reply = { ready: typeof context.window.byted_acrawler !== 'undefined' };
+        } else {
+            context.urls = message.urls;
+            reply = { signatures: vm.runInContext(%s, context) };
+        }
+    } catch (e) {
+        reply = { error: String(e) };
+    }
+    process.stdout.write(JSON.stringify(reply) + '\\n');
+});
+''' % json.dumps(SIGN_EXPRESSION)
+
+
+def make_verify_fp() -> str:
+    '''s_v_web_id style fingerprint the browser would get as a cookie'''
+    chars = string.ascii_letters + string.digits
+    stamp = ''
+    millis = int(time.time() * 1000)
+    while millis:
+        millis, digit = divmod(millis, 36)
+        stamp = (string.digits + string.ascii_lowercase)[digit] + stamp
+    parts = [''.join(random.choice(chars) for _ in range(length)) for length in (8, 4, 4, 4, 12)]
+    return f'verify_{stamp}_' + '_'.join(parts)
+
+
+def load_script(ttl: float=SCRIPT_TTL, cache_file: str=SCRIPT_FILE, url: str=SCRIPT_URL) -> str:
+    '''signing script, cached on disk for ttl seconds with stale fallback'''
+    try:
+        if time.time() - os.path.getmtime(cache_file) < ttl:
+            with open(cache_file, 'r') as file:
+                return file.read()
+    except OSError:
+        pass
+
+    try:
+        reply = requests.get(url, timeout=30)
+        assert reply.status_code == 200
+        script = reply.text
+
+    except Exception:
+        # fall back to stale copy rather than failing
+        if not os.path.exists(cache_file):
+            raise
+        with open(cache_file, 'r') as file:
+            return file.read()
+
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as file:
+            file.write(script)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+    return script
+
+
+class MiniRacerRuntime:
+    ''' V8 embedded in this process through py_mini_racer '''
+
+    def __init__(self, source: str):
+        from py_mini_racer import MiniRacer
+        self.context = MiniRacer()
+        self.context.eval(source)
+
+
+    def sign(self, urls: list) -> list:
+        try:
+            return list(self.context.eval(f'var urls = {json.dumps(urls)}; {SIGN_EXPRESSION}'))
+        except Exception:
+            # context may be unusable after e.g. running out of memory, the signer starts a fresh one
+            self.context = None
+            raise
+
+
+    def alive(self) -> bool:
+        return self.context is not None
+
+
+    def close(self) -> None:
+        self.context = None
+
+
+class NodeRuntime:
+    ''' Long-lived node process signing over a JSON line protocol, one round trip per batch '''
+
+    def __init__(self, source: str, executable: str=None):
+        executable = executable or shutil.which('node') or shutil.which('nodejs')
+        if executable is None:
+            raise Exception('No JS runtime found, install py_mini_racer or node')
+        self.process = subprocess.Popen([executable, '-e', NODE_BOOTSTRAP], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        text=True, bufsize=1)
+        reply = self._request({'source': source})
+        if not reply.get('ready'):
+            self.close()
+            raise Exception(f'Signer script did not define byted_acrawler ({reply.get("error")})')
+
+
+    def _request(self, message: dict) -> dict:
+        self.process.stdin.write(json.dumps(message) + '\n')
+        self.process.stdin.flush()
+        line = self.process.stdout.readline()
+        if not line:
+            raise Exception('JS runtime exited')
+        return json.loads(line)
+
+
+    def sign(self, urls: list) -> list:
+        reply = self._request({'urls': urls})
+        if 'error' in reply:
+            raise Exception(f'Signing failed: {reply["error"]}')
+        return reply['signatures']
+
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+
+    def close(self) -> None:
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=NODE_CLOSE_TIMEOUT)
+            except (OSError, subprocess.TimeoutExpired):
+                # hung or its pipe broke, never leave it running
+                self.process.kill()
+                self.process.wait()
+
+
+def default_runtime(source: str):
+    '''in-process V8 when available, node otherwise'''
+    try:
+        return MiniRacerRuntime(source)
+    except ImportError:
+        return NodeRuntime(source)
+
+
+class JSSigner:
+    ''' Signer for TikTok(signer=...) with the warm/sign_many/cookies interface of the Chrome signer tab '''
+
+    def __init__(self, script: str=None, runtime=default_runtime):
+        # script is the signing source, loaded from the cached acrawler.js if None
+        self.script = script
+        self.runtime_factory = runtime
+        self.runtime = None
+        self.user_agent = None
+        self.verifyFp = None
+        self._lock = threading.Lock()
+
+
+    def start(self, user_agent: str) -> None:
+        '''shim browser globals for user_agent and load the signing script'''
+        self.user_agent = user_agent
+        self.verifyFp = self.verifyFp or make_verify_fp()
+        script = self.script if self.script is not None else load_script()
+        app_version = user_agent.split('/', 1)[1] if '/' in user_agent else user_agent
+        shim = SHIM % (json.dumps(user_agent), json.dumps(app_version), json.dumps(PAGE_URL), json.dumps(f's_v_web_id={self.verifyFp}'))
+        self.runtime = self.runtime_factory(shim + script)
+
+
+    def warm(self) -> None:
+        '''restart the runtime if node died or the V8 context broke, like the Chrome signer reloads its page'''
+        if self.runtime is None:
+            raise Exception('Signer not started')
+        with self._lock:
+            if not self.runtime.alive():
+                print('JS runtime stopped, restarting it')
+                self.runtime.close()
+                self.start(self.user_agent)
+
+
+    def sign_many(self, urls: list) -> list:
+        self.warm()
+        with self._lock:
+            return self.runtime.sign(list(urls))
+
+
+    def healthy(self) -> bool:
+        return self.runtime is not None and self.runtime.alive()
+
+
+    def cookies(self) -> list:
+        '''cookies the browser would carry, in get_cookies() format'''
+        return [{'name': 's_v_web_id', 'value': self.verifyFp, 'domain': '.tiktok.com', 'path': '/'}]
+
+
+    def close(self) -> None:
+        if self.runtime is not None:
+            self.runtime.close()
+            self.runtime = None
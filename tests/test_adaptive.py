@@ -0,0 +1,55 @@
+import os, sys, asyncio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from adaptive import AdaptiveLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_aimd():
+    async def scenario():
+        clock = Clock()
+        limiter = AdaptiveLimiter(initial=4, max_level=8, interval=1, clock=clock)
+
+        # throughput keeps growing -> additive increase
+        for window in range(1, 4):
+            clock.now += 1
+            await limiter.record(window * 1000, 0.1, True)
+        assert limiter.level == 7
+
+        # capped at max_level
+        for window in range(4, 8):
+            clock.now += 1
+            await limiter.record(window * 1000, 0.1, True)
+        assert limiter.level == 8
+
+        # throttling -> multiplicative decrease
+        clock.now += 1
+        await limiter.record(0, 0.1, False, 429)
+        assert limiter.level == 4
+
+    asyncio.run(scenario())
+
+
+def test_slot_respects_level_and_host_cap():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=3, per_host=2)
+        peak = {'a': 0, 'all': 0}
+
+        async def download(host):
+            async with limiter.slot(host):
+                peak['all'] = max(peak['all'], limiter.active)
+                if host == 'a':
+                    peak['a'] = max(peak['a'], limiter._host_active['a'])
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*[download('a') for _ in range(5)], *[download('b') for _ in range(5)])
+        assert peak == {'a': 2, 'all': 3}
+        assert limiter.active == 0
+
+    asyncio.run(scenario())
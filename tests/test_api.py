@@ -1,6 +1,194 @@
 import os, sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from api import TikTok
+from governor import RateGovernor
+
+
+class FakeSignerDriver:
+    ''' minimal stand-in for webdriver.Chrome used by the signer '''
+    def __init__(self):
+        self.current_window_handle = 'signer'
+        self.window_handles = ['signer']
+        self.navigations = 0
+        self.scripts = 0
+        self.loaded = False
+
+    def get(self, url):
+        self.navigations += 1
+        self.loaded = True
+
+    def get_cookie(self, name):
+        return {'name': name, 'value': 'verify_fp'}
+
+    def execute_script(self, script, *args):
+        self.scripts += 1
+        if 'typeof window.byted_acrawler' in script:
+            return self.loaded
+        return [f'sig-{url}' for url in args[0]]
+
+    @property
+    def switch_to(self):
+        return self
+
+    def window(self, handle):
+        pass
+
+    def quit(self):
+        pass
+
+
+def fake_tiktok():
+    return TikTok(driver=FakeSignerDriver(), user_agent='Mozilla/5.0 test', governor=RateGovernor(rate=1000, sleep=lambda seconds: None))
+
+
+def test_sign_many_warms_once():
+    tt = fake_tiktok()
+    assert tt.sign_many(['a', 'b', 'c']) == ['sig-a', 'sig-b', 'sig-c']
+    assert tt._signURL('d') == 'sig-d'
+    assert tt.driver.navigations == 1, 'Signer page reloaded while still warm'
+    assert tt.verifyFp == 'verify_fp'
+    assert tt.sign_many([]) == []
+
+
+class FakeReply:
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url):
+        self.urls.append(url)
+        return FakeReply(b'{"statusCode": 0, "items": [], "hasMore": false}')
+
+    def close(self):
+        pass
+
+
+def test_http_fetch_skips_browser():
+    tt = fake_tiktok()
+    tt.http_fetch = True
+    tt.session = FakeSession()
+    reply = tt._fetchJSON('https://m.tiktok.com/api/item_list/?count=1')
+    assert reply['hasMore'] is False
+    assert tt.session.urls == ['https://m.tiktok.com/api/item_list/?count=1']
+    assert tt.driver.navigations == 0, 'Browser used for HTTP fetch'
+
+
+def test_iter_tiktoks_yields_pages():
+    tt = fake_tiktok()
+    tt.secUid = 0
+    tt.language, tt.region, tt.maxCount = 'en', 'PH', 2
+    replies = iter([
+        {'statusCode': 0, 'items': [{'id': '1'}, {'id': '2'}], 'hasMore': True, 'maxCursor': 10},
+        {'statusCode': 0, 'items': [{'id': '3'}], 'hasMore': False},
+    ])
+    tt._fetchJSON = lambda url: next(replies)
+
+    pages = tt.iterUserTikToks('42', count=5)
+    assert next(pages) == [{'id': '1'}, {'id': '2'}]
+    assert tt.maxCursor == 0, 'Second page requested before first was consumed'
+    assert list(pages) == [[{'id': '3'}]]
+    assert tt.maxCursor == 10
+
+
+def test_iter_tiktoks_stops_at_known():
+    tt = fake_tiktok()
+    tt.secUid = 0
+    tt.language, tt.region, tt.maxCount = 'en', 'PH', 99
+    replies = iter([
+        {'statusCode': 0, 'items': [{'id': 'pinned', 'createTime': 50}, {'id': '4', 'createTime': 400}, {'id': '3', 'createTime': 300}], 'hasMore': True, 'maxCursor': 10},
+        {'statusCode': 0, 'items': [{'id': '2', 'createTime': 200}, {'id': '1', 'createTime': 100}], 'hasMore': True, 'maxCursor': 20},
+        {'statusCode': 0, 'items': [{'id': '0', 'createTime': 0}], 'hasMore': False},
+    ])
+    tt._fetchJSON = lambda url: next(replies)
+
+    pages = list(tt.iterUserTikToks('42', count=100, since=150))
+    assert pages == [[{'id': '4', 'createTime': 400}, {'id': '3', 'createTime': 300}], [{'id': '2', 'createTime': 200}]]
+    assert next(replies)['items'][0]['id'] == '0', 'Paginated past known items'
+
+
+def test_iter_tiktoks_pushdown():
+    from filters import Predicate
+    tt = fake_tiktok()
+    tt.secUid = 0
+    tt.language, tt.region, tt.maxCount = 'en', 'PH', 99
+    urls = []
+    replies = iter([
+        {'statusCode': 0, 'items': [{'id': '4', 'createTime': 400, 'stats': {'diggCount': 1}}, {'id': '3', 'createTime': 300, 'stats': {'diggCount': 50}}], 'hasMore': True, 'maxCursor': 10},
+        {'statusCode': 0, 'items': [{'id': '2', 'createTime': 200, 'stats': {'diggCount': 50}}, {'id': '1', 'createTime': 100, 'stats': {'diggCount': 50}}], 'hasMore': True, 'maxCursor': 20},
+        {'statusCode': 0, 'items': [{'id': '0', 'createTime': 0, 'stats': {'diggCount': 50}}], 'hasMore': False},
+    ])
+    tt._getSigned = lambda url, valid=None: urls.append(url) or next(replies)
+
+    predicate = Predicate(likes=10, date_from=150)
+    raw = []
+    pages = list(tt.iterUserTikToks('42', count=5, predicate=predicate, on_page=lambda items: raw.extend(item['id'] for item in items)))
+    assert [[item['id'] for item in page] for page in pages] == [['3'], ['2']]
+    assert raw == ['4', '3', '2', '1'], 'Rejected items hidden from on_page'
+    assert len(urls) == 2, 'Paginated past date window'
+    assert 'count=99' in urls[0]
+
+
+def test_iter_tiktoks_caps_pages():
+    import api
+    from filters import Predicate
+    tt = fake_tiktok()
+    tt.secUid = 0
+    tt.language, tt.region, tt.maxCount = 'en', 'PH', 30
+    urls = []
+    # trending always has more, none of it matches
+    tt._getSigned = lambda url, valid=None: urls.append(url) or {
+        'statusCode': 0, 'items': [{'id': str(len(urls)), 'stats': {'diggCount': 1}}], 'hasMore': True, 'maxCursor': len(urls)}
+
+    assert list(tt.iterTrending(30, Predicate(likes=10 ** 9), max_pages=5)) == [[]] * 5
+    assert len(urls) == 5 and tt.nextCursor is None
+
+    urls.clear()
+    assert sum(map(len, tt.iterTrending(30, Predicate(likes=10 ** 9)))) == 0
+    assert len(urls) == api.MAX_FILTER_PAGES, 'Filtering paginator not capped by default'
+
+def test_retry_keeps_cursor():
+    tt = fake_tiktok()
+    tt.secUid = 0
+    tt.language, tt.region, tt.maxCount = 'en', 'PH', 99
+    urls = []
+    replies = iter([
+        {'statusCode': 0, 'items': [{'id': '2'}], 'hasMore': True, 'maxCursor': 10},
+        {'statusCode': 10000},
+        {'statusCode': 0, 'items': [], 'hasMore': True, 'maxCursor': 10},
+        {'statusCode': 0, 'items': [{'id': '1'}], 'hasMore': False},
+    ])
+    def fetch(url):
+        urls.append(url)
+        return next(replies)
+    tt._fetchJSON = fetch
+
+    assert tt.getUserTikToks('42', count=10) == [{'id': '2'}, {'id': '1'}]
+    assert ['maxCursor=10' in url for url in urls] == [False, True, True, True]
+
+
+def test_cache_hit_skips_signing(tmp_path):
+    from cache import ResponseCache
+    tt = fake_tiktok()
+    tt.language = 'en'
+    tt.cache = ResponseCache(str(tmp_path / 'responses.sqlite'))
+    tt._fetchJSON = lambda url: {'statusCode': 0, 'userInfo': {'user': {'secUid': 'abc'}}}
+
+    assert tt.getUserDetails('someone')['userInfo']['user']['secUid'] == 'abc'
+    scripts = tt.driver.scripts
+
+    tt.secUid = None
+    tt._fetchJSON = None
+    assert tt.getUserDetails('someone')['userInfo']['user']['secUid'] == 'abc'
+    assert tt.secUid == 'abc'
+    assert tt.driver.scripts == scripts, 'Signer used on cache hit'
+
 
 def test_signURL():
     # for Windows
@@ -22,5 +210,112 @@ def test_signURL():
     else:
         print(f'{os.name} not supported')
 
+def test_breaker_pauses_only_failing_target():
+    from api import request_target
+    tt = fake_tiktok()
+    tt.governor = RateGovernor(rate=1000, retries=0, threshold=1, cooldown=60, clock=lambda: 0.0, sleep=lambda seconds: None)
+    dead = 'https://m.tiktok.com/api/item_list/?count=30&id=1&type=3&secUid=0&maxCursor=0'
+    alive = 'https://m.tiktok.com/api/item_list/?count=30&id=2&type=3&secUid=0&maxCursor=0'
+    tt._fetchJSON = lambda url: {'statusCode': 10000 if '&id=1&' in url else 0}
+
+    try:
+        tt._getSigned(dead)
+        assert False, 'Invalid reply accepted'
+    except Exception:
+        pass
+    assert tt.governor.breaker.remaining(request_target(dead)) == 60
+    assert tt.governor.breaker.remaining(request_target(alive)) == 0, 'Breaker paused every target of the endpoint'
+    assert tt._getSigned(alive) == {'statusCode': 0}
+    assert request_target('https://m.tiktok.com/api/user/detail/?uniqueId=someone&language=en') == '/api/user/detail/?uniqueId=someone'
+
+
+def test_hashtags_fetched_concurrently_without_duplicates():
+    tt = fake_tiktok()
+    tt.secUid = 'user'
+    tt.language, tt.region, tt.maxCount = 'en', 'PH', 99
+    feeds = {
+        '11': iter([{'statusCode': 0, 'items': [{'id': '1'}, {'id': '2'}], 'hasMore': True, 'maxCursor': 5},
+                    {'statusCode': 0, 'items': [{'id': '3'}], 'hasMore': False}]),
+        '22': iter([{'statusCode': 0, 'items': [{'id': '2'}, {'id': '4'}], 'hasMore': False}]),
+    }
+    urls = []
+
+    def fetch(url, valid=None):
+        urls.append(url)
+        if 'challenge/detail' in url:
+            name = url.split('challengeName=')[1].split('&')[0]
+            return {'statusCode': 0, 'challengeInfo': {'challenge': {'id': {'a': '11', 'b': '22'}[name]}}}
+        return next(feeds[url.split('&id=')[1].split('&')[0]])
+    tt._getSigned = fetch
+
+    items = tt.getHashtagTikToks(['a', 'b'], count=10)
+    assert sorted(item['id'] for item in items) == ['1', '2', '3', '4'], 'Video of two hashtags listed twice'
+    listing = [url for url in urls if 'item_list' in url]
+    assert all('type=3' in url and 'sourceType=8' in url and 'secUid=0' in url for url in listing)
+
+
+class FakeChrome:
+    ''' records what TikTok asks of a freshly started or attached browser '''
+
+    def __init__(self, path=None, options=None):
+        self.options = options
+        self.cdp = []
+        self.closed = []
+        self.quit_called = False
+        self.current_window_handle = 'existing'
+        self.window_handles = ['existing']
+        self.switch_to = self
+        self.current = 'existing'
+
+    def window(self, handle):
+        self.current = handle
+
+    def execute_script(self, script, *args):
+        if 'window.open' in script:
+            self.window_handles.append(f'tab-{len(self.window_handles)}')
+
+    def execute_cdp_cmd(self, command, params):
+        self.cdp.append((command, params))
+
+    def close(self):
+        self.closed.append(self.current)
+        self.window_handles.remove(self.current)
+
+    def quit(self):
+        self.quit_called = True
+
+
+def test_lean_driver_blocks_heavy_requests(monkeypatch):
+    import api
+    monkeypatch.setattr(api, 'getAllowedAgents', lambda: ['Mozilla/5.0 test'])
+    monkeypatch.setattr(api.webdriver, 'Chrome', FakeChrome)
+    monkeypatch.setattr(api, 'chromedriver_path', lambda: '/usr/bin/chromedriver')
+
+    tt = TikTok(lean=True)
+    assert '--blink-settings=imagesEnabled=false' in tt.driver.options.arguments
+    assert tt.driver.options.experimental_options['prefs'] == {'profile.managed_default_content_settings.images': 2}
+    blocked = dict(tt.driver.cdp)['Network.setBlockedURLs']['urls']
+    assert '*.mp4' in blocked and '*.css' in blocked
+    assert not any(pattern.endswith('.js') for pattern in blocked), 'Signer scripts blocked'
+    assert tt.signer_handle == 'existing'
+
+
+def test_attach_uses_own_tab(monkeypatch):
+    import api
+    monkeypatch.setattr(api, 'getAllowedAgents', lambda: ['Mozilla/5.0 test'])
+    monkeypatch.setattr(api.webdriver, 'Chrome', FakeChrome)
+    monkeypatch.setattr(api, 'chromedriver_path', lambda: '/usr/bin/chromedriver')
+
+    tt = TikTok(debugger_address='127.0.0.1:9222')
+    driver = tt.driver
+    assert driver.options.experimental_options['debuggerAddress'] == '127.0.0.1:9222'
+    assert '--incognito' not in driver.options.arguments
+    assert tt.signer_handle != 'existing', 'Signer took over a tab of the shared browser'
+    assert ('Network.setUserAgentOverride', {'userAgent': 'Mozilla/5.0 test'}) in driver.cdp
+
+    del tt
+    assert driver.closed == ['tab-1'] and driver.window_handles == ['existing']
+
+
 if __name__ == '__main__':
-    test_signURL()
\ No newline at end of file
+    test_signURL()
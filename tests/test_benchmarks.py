@@ -0,0 +1,19 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import bench_scrape
+
+
+def test_bench_scrape_offline():
+    results = bench_scrape.main(['--videos', '120', '--size', '16', '--latency', '0', '--sign-latency', '0'])
+    assert results['api']['pages'] == 2
+    assert results['scrape']['videos'] == 120, 'Mock videos not all downloaded'
+    assert results['scrape']['download_mb_per_s'] > 0
+
+
+def test_mock_tiktok_passes_kwargs():
+    from governor import RateGovernor
+    from mock_tiktok import MockServer, mock_tiktok
+    governor = RateGovernor(rate=1e6)
+    tt = mock_tiktok(MockServer(), governor=governor, proxify=False)
+    assert tt.governor is governor, 'TikTok argument of mock_tiktok dropped'
@@ -0,0 +1,33 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cache import ResponseCache, normalize_url
+
+
+def test_normalize_url():
+    a = 'https://m.tiktok.com/api/item_list/?count=30&id=1&verifyFp=abc&_signature=xyz'
+    b = 'https://m.tiktok.com/api/item_list/?id=1&count=30&verifyFp=def&_signature=uvw'
+    assert normalize_url(a) == normalize_url(b) == 'https://m.tiktok.com/api/item_list/?count=30&id=1'
+
+
+def test_ttl(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'), ttl=-1)
+    cache.set('https://m.tiktok.com/api/user/detail/?uniqueId=a', {'statusCode': 0})
+    assert cache.get('https://m.tiktok.com/api/user/detail/?uniqueId=a') is None, 'Expired entry returned'
+
+
+def test_lru_eviction(tmp_path):
+    path = str(tmp_path / 'responses.sqlite')
+    entry = {'items': ['x' * 100]}
+    cache = ResponseCache(path, max_bytes=250)
+    cache.set('https://h/?id=1', entry)
+    cache.set('https://h/?id=2', entry)
+    assert cache.get('https://h/?id=1&_signature=s') == entry
+    cache.set('https://h/?id=3', entry)
+
+    assert cache.get('https://h/?id=2') is None, 'Least recently used entry kept'
+    assert cache.get('https://h/?id=1') == entry
+    assert cache.get('https://h/?id=3') == entry
+    cache.close()
+
+    # persisted across instances
+    assert ResponseCache(path, max_bytes=250).get('https://h/?id=3') == entry
@@ -0,0 +1,56 @@
+import os, sys, asyncio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import run
+from content import ContentStore
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(data)
+    return str(path)
+
+
+def test_ingest_and_link_views(tmp_path):
+    with ContentStore(str(tmp_path / 'store')) as content:
+        trending = write(tmp_path / 'trending' / '1.mp4', b'video one')
+        digest = content.ingest(1, trending)
+        assert os.path.samefile(trending, content.object_path(digest))
+
+        author = str(tmp_path / 'author' / '1.mp4')
+        os.makedirs(os.path.dirname(author))
+        assert content.link(1, author)
+        assert os.path.samefile(trending, author), 'View is not a link to the stored video'
+        assert not content.link(2, str(tmp_path / 'author' / '2.mp4'))
+
+        # same bytes under a second id are stored once
+        other = write(tmp_path / 'author' / '3.mp4', b'video one')
+        assert content.ingest(3, other) == digest
+        assert os.path.samefile(other, trending)
+        assert content.lookup(['1', 2, 3]) == {'1': digest, '3': digest}
+
+
+def test_missing_object_is_forgotten(tmp_path):
+    with ContentStore(str(tmp_path / 'store'), symlinks=True) as content:
+        digest = content.ingest(1, write(tmp_path / 'a' / '1.mp4', b'video'))
+        os.remove(content.object_path(digest))
+        assert not content.link(1, str(tmp_path / 'a' / '1.mp4'))
+        assert content.lookup([1]) == {}
+
+
+def test_enqueue_links_stored_videos(tmp_path, monkeypatch):
+    monkeypatch.setattr(run, 'DOWNLOADS_BASE_DIR', str(tmp_path))
+    os.makedirs(tmp_path / 'author')
+    page = [{'id': 1, 'video': {'downloadAddr': 'http://cdn/1.mp4'}}, {'id': 2, 'video': {'downloadAddr': 'http://cdn/2.mp4'}}]
+
+    async def enqueue(content):
+        queue = asyncio.Queue()
+        added = await run.enqueue_pages(iter([page]), queue, 'author', content=content)
+        return added, [queue.get_nowait() for _ in range(queue.qsize())]
+
+    with ContentStore(str(tmp_path / '.content')) as content:
+        content.ingest(1, write(tmp_path / 'trending' / '1.mp4', b'video one'))
+        added, queued = asyncio.run(enqueue(content))
+
+    assert added == 1 and queued == [('author', 2, 'http://cdn/2.mp4')], 'Stored video queued for download again'
+    assert os.path.samefile(tmp_path / 'author' / '1.mp4', tmp_path / 'trending' / '1.mp4')
@@ -0,0 +1,27 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from datetime import datetime, timezone
+from filters import Predicate
+
+
+def item(likes=0, create_time=0, duration=15):
+    return {
+        'createTime': create_time,
+        'video': {'duration': duration},
+        'stats': {'diggCount': likes, 'playCount': 0, 'shareCount': 0, 'commentCount': 0},
+    }
+
+
+def test_predicate():
+    predicate = Predicate(likes=10, date_from=100, date_to=200, max_duration=30)
+    assert predicate(item(likes=10, create_time=150))
+    assert not predicate(item(likes=9, create_time=150))
+    assert not predicate(item(likes=10, create_time=201))
+    assert not predicate(item(likes=10, create_time=150, duration=31))
+    assert predicate.past_window(item(create_time=99))
+    assert not Predicate().active
+
+
+def test_datetime_bounds():
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    assert Predicate(date_from=start).date_from == 1577836800
@@ -0,0 +1,80 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from governor import TokenBucket, CircuitBreaker, RateGovernor
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket():
+    clock = Clock()
+    bucket = TokenBucket(rate=2, burst=2, clock=clock, sleep=clock.sleep)
+    for _ in range(4):
+        bucket.acquire()
+    assert clock.now == 1.0, 'Bucket did not throttle to rate'
+
+
+def test_breaker_pauses_target():
+    clock = Clock()
+    breaker = CircuitBreaker(threshold=2, cooldown=30, clock=clock, sleep=clock.sleep)
+    breaker.failure('item_list')
+    assert breaker.remaining('item_list') == 0
+    breaker.failure('item_list')
+    assert breaker.remaining('item_list') == 30
+    assert breaker.remaining('user/detail') == 0
+
+    breaker.wait('item_list')
+    assert clock.now == 30
+    breaker.success('item_list')
+    assert breaker.remaining('item_list') == 0
+
+
+def test_governor_retries_then_raises():
+    clock = Clock()
+    governor = RateGovernor(rate=1000, retries=2, threshold=10, clock=clock, sleep=clock.sleep)
+    replies = iter([{'statusCode': 1}, {'statusCode': 0}])
+    assert governor.call('t', lambda: next(replies), lambda reply: reply['statusCode'] == 0) == {'statusCode': 0}
+
+    calls = []
+    try:
+        governor.call('t', lambda: calls.append(1) or {'statusCode': 1}, lambda reply: reply['statusCode'] == 0)
+        assert False, 'No exception after exhausting retries'
+    except Exception:
+        pass
+    assert len(calls) == 3
+
+
+def test_shared_governor_is_one_per_process():
+    import time, threading
+
+    class SlowGovernor(RateGovernor):
+        _shared = None
+
+        def __init__(self):
+            # widen the window between the check and the assignment
+            time.sleep(0.01)
+            super().__init__()
+
+    barrier = threading.Barrier(8)
+    governors = []
+
+    def build():
+        barrier.wait()
+        governors.append(SlowGovernor.shared())
+
+    threads = [threading.Thread(target=build) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(governor) for governor in governors}) == 1, 'Shared governor split between threads'
@@ -0,0 +1,84 @@
+import os, sys, asyncio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import run
+from batch import run_job
+from jobs import JobQueue, parse_target, USER, HASHTAG, MUSIC, TRENDING, DONE
+
+
+def test_parse_target():
+    assert parse_target('@someone\n') == (USER, 'someone')
+    assert parse_target('#fyp') == (HASHTAG, 'fyp')
+    assert parse_target('sound:6800000000000000000') == (MUSIC, '6800000000000000000')
+    assert parse_target('trending') == (TRENDING, TRENDING)
+    assert parse_target('someone') == (USER, 'someone')
+    assert parse_target('# comment') is None
+    assert parse_target('   \n') is None
+
+
+def test_recover_keeps_cursor(tmp_path):
+    targets = tmp_path / 'targets.txt'
+    targets.write_text('@a\n@b\n@a\n')
+    path = str(tmp_path / 'jobs.sqlite')
+
+    with JobQueue(path) as jobs:
+        assert jobs.load_file(str(targets)) == 3
+        job = jobs.claim()
+        jobs.progress(job['id'], 1234, 30)
+        # crash while job is running
+
+    with JobQueue(path) as jobs:
+        assert jobs.recover() == 1
+        job = jobs.claim()
+        assert (job['target'], job['cursor'], job['items'], job['attempts']) == ('a', 1234, 30, 2)
+        assert jobs.claim()['target'] == 'b'
+        assert jobs.claim() is None
+
+
+class FakeTikTok:
+    ''' trending paginator with two pages '''
+    def __init__(self):
+        self.nextCursor = None
+        self.cursors = []
+
+    def iterTrending(self, count, predicate=None, cursor=0, on_page=None, max_pages=None):
+        self.cursors.append(cursor)
+        pages = {0: (10, [{'id': '1', 'video': {'downloadAddr': 'u1'}}]), 10: (None, [{'id': '2', 'video': {'downloadAddr': 'u2'}}])}
+        while cursor is not None:
+            self.nextCursor, page = pages[cursor]
+            yield page
+            cursor = self.nextCursor
+
+
+def test_run_job_records_progress(tmp_path, monkeypatch):
+    monkeypatch.setattr(run, 'DOWNLOADS_BASE_DIR', str(tmp_path))
+    progress = []
+
+    async def scenario():
+        with JobQueue(str(tmp_path / 'jobs.sqlite')) as jobs:
+            jobs.add(TRENDING, TRENDING, count=5)
+            job = jobs.claim()
+            monkeypatch.setattr(jobs, 'progress', lambda job_id, cursor, items: progress.append((cursor, items)))
+            queue = asyncio.Queue()
+            tt = FakeTikTok()
+            await run_job(tt, job, jobs, queue, None, None)
+            assert jobs.counts() == {DONE: 1}
+            return [queue.get_nowait() for _ in range(queue.qsize())]
+
+    assert asyncio.run(scenario()) == [('trending', '1', 'u1'), ('trending', '2', 'u2')]
+    assert progress == [(10, 1), (0, 1)]
+
+
+def test_shared_folder_queues_video_once(tmp_path):
+    from ledger import Ledger, QUEUED
+    page = [{'id': '1', 'video': {'downloadAddr': 'u1'}}]
+
+    async def scenario():
+        with Ledger(str(tmp_path / 'ledger.sqlite')) as ledger:
+            queue = asyncio.Queue()
+            scheduled = set()
+            # two hashtag jobs listing the same video, both writing into the hashtag folder
+            for _ in range(2):
+                await run.enqueue_pages(iter([page]), queue, 'hashtag', ledger=ledger, scheduled=scheduled)
+            return queue.qsize(), ledger.get('1', 'hashtag')['status']
+
+    assert asyncio.run(scenario()) == (1, QUEUED), 'Video queued twice for the same file'
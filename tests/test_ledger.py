@@ -0,0 +1,69 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ledger import Ledger, file_digest, QUEUED, DONE, FAILED
+
+
+def test_completed_bulk(tmp_path):
+    with Ledger(str(tmp_path / 'ledger.sqlite'), batch_size=1000) as ledger:
+        for video_id in range(1200):
+            ledger.record(video_id, 'user', QUEUED, mode='USER', url=f'https://v/{video_id}')
+        for video_id in range(0, 1200, 2):
+            ledger.record(video_id, 'user', DONE, size=10, hash='abc')
+        ledger.record(1, 'user', FAILED)
+        ledger.flush()
+
+        completed = ledger.completed([str(video_id) for video_id in range(1200)], 'user')
+        assert completed == {str(video_id) for video_id in range(0, 1200, 2)}
+        assert ledger.completed(['0'], 'trending') == set()
+
+        entry = ledger.get(0, 'user')
+        assert entry['url'] == 'https://v/0', 'Batched update overwrote earlier fields'
+        assert (entry['status'], entry['size'], entry['mode']) == (DONE, 10, 'USER')
+
+
+def test_persists(tmp_path):
+    path = str(tmp_path / 'ledger.sqlite')
+    with Ledger(path) as ledger:
+        ledger.record('7', 'user', DONE)
+    with Ledger(path) as ledger:
+        assert ledger.completed(['7']) == {'7'}
+
+
+def test_completed_flushes(tmp_path):
+    path = str(tmp_path / 'ledger.sqlite')
+    with Ledger(path) as ledger, Ledger(path) as other:
+        ledger.record('7', 'user', DONE)
+        assert ledger.completed(['7']) == {'7'}
+        # written through, so other processes sharing the file skip it too
+        assert other.completed(['7']) == {'7'}
+
+def test_cursor(tmp_path):
+    with Ledger(str(tmp_path / 'ledger.sqlite')) as ledger:
+        assert ledger.get_cursor('user') is None
+        ledger.set_cursor('user', 99, 1600000000, 1234)
+        ledger.set_cursor('user', 100, 1600000100, 5678)
+        cursor = ledger.get_cursor('user')
+        assert (cursor['newest_id'], cursor['newest_create_time'], cursor['max_cursor']) == ('100', 1600000100, 5678)
+
+
+def test_file_digest(tmp_path):
+    file_name = tmp_path / 'video.mp4'
+    file_name.write_bytes(b'abc')
+    assert file_digest(str(file_name)) == 'ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad'
+
+
+def test_mark_kept_while_downloads_failed(tmp_path):
+    from run import advance_marks
+    with Ledger(str(tmp_path / 'ledger.sqlite')) as ledger:
+        ledger.set_cursor('user', 1, 1600000000)
+        ledger.record(2, 'user', FAILED)
+        ledger.record(3, 'other', DONE)
+
+        marks = [('user', {'newest_id': 3, 'newest_create_time': 1600000200}, 0),
+                 ('other', {'newest_id': 3, 'newest_create_time': 1600000200}, 0)]
+        advance_marks(ledger, marks, since=0)
+        assert ledger.get_cursor('user')['newest_id'] == '1', 'Mark advanced past a failed download'
+        assert ledger.get_cursor('other')['newest_id'] == '3'
+
+        # failures of earlier runs do not hold the mark back forever
+        assert ledger.unfinished('user', since=ledger.get(2, 'user')['updated_at'] + 1) == 0
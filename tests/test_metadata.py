@@ -0,0 +1,99 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from metadata import MetadataStore, Table
+
+
+def item(video_id, likes, views=0, create_time=0, author='someone'):
+    return {
+        'id': str(video_id),
+        'author': {'uniqueId': author},
+        'createTime': create_time,
+        'video': {'duration': 15},
+        'stats': {'diggCount': likes, 'playCount': views, 'shareCount': 0, 'commentCount': 0},
+    }
+
+
+def test_where_and_top():
+    table = Table.from_items([item(i, likes=i * 10, views=1000 - i, create_time=i) for i in range(100)])
+    assert len(table.where(diggCount=500)) == 50
+    assert table.where(diggCount=(100, 200), createTime=(None, 15))['id'].tolist() == [10, 11, 12, 13, 14, 15]
+    assert table.top('playCount', 3)['id'].tolist() == [0, 1, 2]
+    assert table.top('diggCount', 1000)['id'].tolist()[:2] == [99, 98]
+    assert table.where(diggCount=10).records()[0]['author'] == 'someone'
+
+
+def test_store_dedupes_and_compacts(tmp_path):
+    store = MetadataStore(str(tmp_path), chunk_rows=2)
+    store.append([item(1, 5), item(2, 5)])
+    store.append([item(1, 50)])
+    table = store.load()
+    assert sorted(table['id'].tolist()) == [1, 2]
+    assert table.where(diggCount=50)['id'].tolist() == [1], 'Stale stats kept'
+
+    store.compact()
+    assert len(os.listdir(str(tmp_path))) == 1
+    assert len(MetadataStore(str(tmp_path)).load()) == 2
+
+
+def test_concurrent_writers_keep_every_chunk(tmp_path, monkeypatch):
+    import metadata
+    # two processes flushing within the same clock tick
+    monkeypatch.setattr(metadata.time, 'time_ns', lambda: 1000)
+    first, second = MetadataStore(str(tmp_path)), MetadataStore(str(tmp_path))
+    first.append([item(1, 5)])
+    second.append([item(2, 5)])
+    first.flush()
+    second.flush()
+    assert sorted(first.load()['id'].tolist()) == [1, 2], 'Chunk of another writer replaced'
+
+
+def test_compact_keeps_chunks_written_meanwhile(tmp_path):
+    store, other = MetadataStore(str(tmp_path)), MetadataStore(str(tmp_path))
+    store.append([item(1, 5)])
+    store.flush()
+    store.append([item(2, 5)])
+    store.flush()
+
+    # another process flushes while the listed chunks are being merged
+    read = store._read
+
+    def read_then_write(chunks):
+        table = read(chunks)
+        other.append([item(1, 50), item(3, 5)])
+        other.flush()
+        return table
+
+    store._read = read_then_write
+    store.compact()
+    del store._read
+    assert len(os.listdir(str(tmp_path))) == 2
+    table = store.load()
+    assert sorted(table['id'].tolist()) == [1, 2, 3], 'Chunk written during compaction deleted'
+    assert table.where(diggCount=50)['id'].tolist() == [1], 'Merged chunk overrode newer stats'
+
+def test_open_pages_stores_rejected_items(tmp_path, monkeypatch):
+    import asyncio
+    import run
+    from filters import Predicate
+    from ledger import Ledger
+    from tests.test_api import fake_tiktok
+    monkeypatch.setattr(run, 'DOWNLOADS_BASE_DIR', str(tmp_path))
+
+    tt = fake_tiktok()
+    tt.secUid, tt.language, tt.region, tt.maxCount = 0, 'en', 'PH', 99
+    tt.getUserDetails = lambda username: {'userInfo': {'user': {'id': '1', 'secUid': 'x'}, 'stats': {'videoCount': 3}}}
+    tt._getSigned = lambda url, valid=None: {'statusCode': 0, 'hasMore': False,
+                                             'items': [item(3, 0, create_time=300), item(2, 50, create_time=200), item(1, 0, create_time=100)]}
+    store = MetadataStore(str(tmp_path / 'metadata'))
+
+    async def scenario():
+        with Ledger(str(tmp_path / 'ledger.sqlite')) as ledger:
+            _, pages, mark = await run.open_pages(tt, run.Scrape.USER, 'someone', -1, Predicate(likes=10), ledger,
+                                                  incremental=True, store=store)
+            return list(pages), mark
+
+    pages, mark = asyncio.run(scenario())
+    assert [[entry['id'] for entry in page] for page in pages] == [['2']]
+    store.flush()
+    assert sorted(store.load()['id'].tolist()) == [1, 2, 3], 'Rejected items not stored for re-filtering'
+    assert (mark['newest_id'], mark['newest_create_time']) == ('3', 300), 'Mark held back by the predicate'
@@ -0,0 +1,43 @@
+import os, sys, json, urllib.request
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from metrics import Registry, SnapshotWriter, serve
+
+
+def test_histogram_buckets_and_prometheus_text():
+    registry = Registry()
+    latency = registry.histogram('sign_seconds', 'Sign latency', buckets=(0.01, 0.1))
+    for value in (0.005, 0.05, 0.05, 3):
+        latency.observe(value, endpoint='/api/item_list/')
+    registry.counter('retries_total', 'Retries').inc(2, target='/api/item_list/')
+    registry.gauge('queue_depth', 'Queue').set(7)
+
+    text = registry.prometheus()
+    assert 'sign_seconds_bucket{endpoint="/api/item_list/",le="0.01"} 1' in text
+    assert 'sign_seconds_bucket{endpoint="/api/item_list/",le="0.1"} 3' in text
+    assert 'sign_seconds_bucket{endpoint="/api/item_list/",le="+Inf"} 4' in text
+    assert 'sign_seconds_count{endpoint="/api/item_list/"} 4' in text
+    assert 'retries_total{target="/api/item_list/"} 2' in text
+    assert 'queue_depth 7' in text
+    assert '# TYPE sign_seconds histogram' in text
+
+
+def test_http_endpoint_and_snapshot_file(tmp_path):
+    registry = Registry()
+    registry.counter('pages_total').inc()
+    with registry.histogram('download_seconds').time():
+        pass
+
+    server = serve(0, registry=registry)
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+        assert 'pages_total 1' in urllib.request.urlopen(f'{url}/metrics').read().decode()
+        snapshot = json.loads(urllib.request.urlopen(f'{url}/metrics.json').read())
+        assert snapshot['download_seconds']['value']['count'] == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    writer = SnapshotWriter(str(tmp_path / 'metrics.json'), interval=60, registry=registry)
+    writer.start()
+    writer.stop()
+    assert json.load(open(tmp_path / 'metrics.json'))['pages_total'] == {'value': 1}
@@ -0,0 +1,48 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pool
+from pool import SignerPool
+
+
+class FakeDriver:
+    def __init__(self):
+        self.crashed = False
+        self.quit_called = False
+
+    def execute_script(self, script, *args):
+        if self.crashed:
+            raise Exception('chrome not reachable')
+        return 1
+
+    def quit(self):
+        self.quit_called = True
+
+
+class FakeTikTok:
+    def __init__(self, path=None, proxify=False, http_fetch=False, proxy_pool=None):
+        self.driver = FakeDriver()
+
+
+def test_lease_respawns_crashed(monkeypatch):
+    monkeypatch.setattr(pool, 'TikTok', FakeTikTok)
+    signers = SignerPool(size=2)
+
+    with signers.leased() as tt:
+        tt.driver.crashed = True
+        crashed = tt
+
+    leased = [signers.lease(), signers.lease()]
+    assert crashed not in leased
+    assert crashed.driver.quit_called
+    assert all(SignerPool.healthy(tt) for tt in leased)
+
+    for tt in leased:
+        signers.release(tt)
+    signers.close()
+
+
+def test_map(monkeypatch):
+    monkeypatch.setattr(pool, 'TikTok', FakeTikTok)
+    with SignerPool(size=3) as signers:
+        results = signers.map(lambda tt, x: x * 2, range(10))
+    assert results == [x * 2 for x in range(10)]
@@ -0,0 +1,41 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from proxies import ProxyPool
+
+
+def test_rank_and_evict():
+    pool = ProxyPool(source=lambda: [], max_failures=2)
+    pool.report('1.1.1.1:80', True, 2.0)
+    pool.report('2.2.2.2:80', True, 0.1)
+    pool.report('3.3.3.3:80', False)
+    assert pool.ranked() == ['2.2.2.2:80', '1.1.1.1:80'], 'Dead candidate added or bad ranking'
+
+    pool.report('2.2.2.2:80', False)
+    pool.report('2.2.2.2:80', False)
+    assert pool.best() == '1.1.1.1:80', 'Dead proxy not evicted'
+
+
+def test_rotate():
+    pool = ProxyPool(source=lambda: [])
+    pool.report('1.1.1.1:80', True, 0.1)
+    pool.report('2.2.2.2:80', True, 0.2)
+    assert [pool.rotate() for _ in range(3)] == ['1.1.1.1:80', '2.2.2.2:80', '1.1.1.1:80']
+
+
+def test_refresh_validates(monkeypatch):
+    source = lambda: [{'ip': '1.1.1.1', 'port': '80'}, {'ip': '2.2.2.2', 'port': '8080'}]
+    pool = ProxyPool(source=source)
+    monkeypatch.setattr(pool, 'validate', lambda candidates: {'2.2.2.2:8080': 0.5})
+    assert pool.refresh() == 1
+    assert pool.best() == '2.2.2.2:8080'
+
+
+def test_validate_inside_event_loop():
+    import asyncio
+    pool = ProxyPool(source=lambda: [{'ip': '127.0.0.1', 'port': '9'}], test_url='http://127.0.0.1:9/', timeout=2)
+
+    async def scrape():
+        # as in run.scrape, where TikTok(proxify=True) rotates from within the loop
+        return pool.validate(['127.0.0.1:9'])
+
+    assert asyncio.run(scrape()) == {}
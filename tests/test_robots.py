@@ -1,11 +1,33 @@
-import os, sys
+import os, sys, time
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from robots import getAllowedAgents
+import robots
+from robots import getAllowedAgents, parseAllowedAgents
+
+ROBOTS_TXT = '''User-agent: Googlebot
+User-agent: Applebot
+Allow: /
+
+User-agent: *
+Disallow: /
+'''
+
+def test_parse():
+    assert parseAllowedAgents(ROBOTS_TXT) == ['Googlebot', 'Applebot']
+
+def test_disk_cache(tmp_path, monkeypatch):
+    cache_file = str(tmp_path / 'robots.json')
+    robots._writeCache(cache_file, ['Twitterbot'], time.time())
+    monkeypatch.setattr(robots, '_agents', None)
+
+    # fresh disk cache must not touch the network
+    monkeypatch.setattr(robots.requests, 'get', None)
+    assert getAllowedAgents(cache_file=cache_file) == ['Twitterbot']
+    assert getAllowedAgents(cache_file=str(tmp_path / 'missing.json')) == ['Twitterbot'], 'Result not memoized'
 
 def test_uas():
     # valid as of 2020/05/25
-    uas = getAllowedAgents()
+    uas = getAllowedAgents(refresh=True)
     assert set(uas) == {'Googlebot', 'Applebot', 'Bingbot', 'DuckDuckBot', 'Naverbot', 'Twitterbot', 'Yandex'}
 
 if __name__ == '__main__':
-    test_uas()
\ No newline at end of file
+    test_uas()
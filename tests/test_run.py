@@ -0,0 +1,135 @@
+import os, sys, asyncio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import aiohttp
+from aiohttp import web
+from run import download_video
+
+BODY = bytes(range(256)) * 64
+
+
+RANGES = []
+SERVER = {'head': 200}
+
+
+async def serve_video(request):
+    ''' minimal video host supporting Range and If-Range requests '''
+    RANGES.append(request.headers.get('Range'))
+    if request.method == 'HEAD' and SERVER['head'] != 200:
+        return web.Response(status=SERVER['head'])
+    headers = {'ETag': '"v1"'}
+    if 'Range' in request.headers and request.headers.get('If-Range', '"v1"') == '"v1"':
+        start = int(request.headers['Range'][len('bytes='):].rstrip('-'))
+        if start >= len(BODY):
+            return web.Response(status=416, headers={'Content-Range': f'bytes */{len(BODY)}'})
+        headers['Content-Range'] = f'bytes {start}-{len(BODY) - 1}/{len(BODY)}'
+        return web.Response(status=206, body=BODY[start:], headers=headers)
+    return web.Response(body=BODY, headers=headers)
+
+
+async def run_download(file_name):
+    RANGES.clear()
+    app = web.Application()
+    app.router.add_route('*', '/video.mp4', serve_video)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        async with aiohttp.ClientSession() as session:
+            ok = await download_video(session, file_name, 'user', '1', f'http://127.0.0.1:{port}/video.mp4')
+    finally:
+        await runner.cleanup()
+    return ok, list(RANGES)
+
+
+def test_download_resumes_part(tmp_path):
+    file_name = str(tmp_path / '1.mp4')
+    with open(f'{file_name}.part', 'wb') as file:
+        file.write(BODY[:1000])
+
+    ok, ranges = asyncio.run(run_download(file_name))
+    assert ok
+    assert ranges == ['bytes=1000-'], 'Partial download not resumed'
+    assert open(file_name, 'rb').read() == BODY
+    assert not os.path.exists(f'{file_name}.part')
+
+
+def test_download_skips_complete(tmp_path):
+    file_name = str(tmp_path / '1.mp4')
+    with open(file_name, 'wb') as file:
+        file.write(BODY)
+
+    ok, ranges = asyncio.run(run_download(file_name))
+    assert ok
+    assert ranges == [None], 'Complete file downloaded again'
+
+
+def test_download_resumes_truncated(tmp_path):
+    file_name = str(tmp_path / '1.mp4')
+    with open(file_name, 'wb') as file:
+        file.write(BODY[:10])
+
+    ok, ranges = asyncio.run(run_download(file_name))
+    assert ok
+    assert ranges[-1] == 'bytes=10-'
+    assert open(file_name, 'rb').read() == BODY
+
+
+def test_download_unconfirmed_file_checked_with_range(tmp_path, monkeypatch):
+    # CDN rejecting HEAD, a truncated file is still completed
+    monkeypatch.setitem(SERVER, 'head', 403)
+    file_name = str(tmp_path / '1.mp4')
+    with open(file_name, 'wb') as file:
+        file.write(BODY[:10])
+
+    ok, ranges = asyncio.run(run_download(file_name))
+    assert ok
+    assert ranges == [None, 'bytes=10-'], 'Unconfirmed file trusted'
+    assert open(file_name, 'rb').read() == BODY
+    assert open(f'{file_name}.etag').read() == '"v1"'
+
+    # a whole file costs one 416 instead of a download
+    ok, ranges = asyncio.run(run_download(file_name))
+    assert ok
+    assert ranges == [None, f'bytes={len(BODY)}-']
+    assert open(file_name, 'rb').read() == BODY
+
+
+def test_download_changed_etag_starts_over(tmp_path):
+    file_name = str(tmp_path / '1.mp4')
+    with open(file_name, 'wb') as file:
+        file.write(bytes(len(BODY)))
+    with open(f'{file_name}.etag', 'w') as file:
+        file.write('"v0"')
+
+    ok, ranges = asyncio.run(run_download(file_name))
+    assert ok
+    assert ranges == [None, f'bytes={len(BODY)}-'], 'File of an old ETag trusted'
+    assert open(file_name, 'rb').read() == BODY
+    assert open(f'{file_name}.etag').read() == '"v1"'
+
+
+def test_download_never_writes_into_store(tmp_path):
+    from content import ContentStore
+    from ledger import file_digest
+    # a truncated download was stored and linked into a second folder
+    folders = [tmp_path / 'a', tmp_path / 'b']
+    for folder in folders:
+        folder.mkdir()
+    file_name, other = str(folders[0] / '1.mp4'), str(folders[1] / '1.mp4')
+    with open(file_name, 'wb') as file:
+        file.write(BODY[:10])
+    with ContentStore(str(tmp_path / 'store')) as content:
+        digest = content.ingest('1', file_name)
+        assert content.link('1', other)
+
+        ok, ranges = asyncio.run(run_download(file_name))
+        assert ok and ranges[-1] == 'bytes=10-'
+        assert open(file_name, 'rb').read() == BODY
+        assert open(other, 'rb').read() == BODY[:10], 'Download wrote into a linked folder'
+        assert file_digest(content.object_path(digest)) == digest, 'Stored object altered'
+
+        # the completed file replaces the link once ingested again
+        assert content.ingest('1', file_name) == file_digest(file_name)
+        assert os.stat(file_name).st_nlink == 2
@@ -0,0 +1,148 @@
+import os, sys, json
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import api
+from api import TikTok
+from sessions import SessionStore
+from tests.test_api import FakeSignerDriver, FakeChrome, fake_tiktok
+
+
+COOKIES = [{'name': 's_v_web_id', 'value': 'verify_saved', 'domain': '.tiktok.com', 'path': '/', 'expiry': 5000},
+           {'name': 'tt_csrf_token', 'value': 'csrf', 'domain': '.tiktok.com', 'path': '/'}]
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_session_expires(tmp_path):
+    clock = Clock()
+    store = SessionStore(str(tmp_path / 'session.json'), ttl=60, clock=clock)
+    assert store.load() is None
+
+    store.save('Mozilla/5.0 saved', 'verify_saved', COOKIES[1:])
+    session = store.load()
+    assert session['user_agent'] == 'Mozilla/5.0 saved' and session['verifyFp'] == 'verify_saved'
+    clock.now += 60
+    assert store.load() is None, 'Session outlived its ttl'
+
+    # s_v_web_id expiring first bounds the session
+    store = SessionStore(str(tmp_path / 'session.json'), ttl=10 ** 6, clock=clock)
+    store.save('Mozilla/5.0 saved', 'verify_saved', COOKIES)
+    assert store.load()['expires_at'] == 5000
+    clock.now = 5000
+    assert store.load() is None
+
+    (tmp_path / 'session.json').write_text('{broken')
+    assert store.load() is None
+    store.clear()
+    assert not (tmp_path / 'session.json').exists()
+
+
+def test_restore_before_first_request(tmp_path, monkeypatch):
+    store = SessionStore(str(tmp_path / 'session.json'), clock=Clock())
+    store.save('Mozilla/5.0 saved', 'verify_saved', COOKIES)
+
+    def no_robots():
+        raise AssertionError('robots.txt fetched despite saved session')
+
+    monkeypatch.setattr(api, 'getAllowedAgents', no_robots)
+    monkeypatch.setattr(api.webdriver, 'Chrome', FakeChrome)
+    monkeypatch.setattr(api, 'chromedriver_path', lambda: '/usr/bin/chromedriver')
+    tt = TikTok(session_store=store)
+    assert tt.UserAgent == 'Mozilla/5.0 saved' and tt.verifyFp == 'verify_saved'
+    restored = dict(tt.driver.cdp)['Network.setCookies']['cookies']
+    assert restored[0] == {'name': 's_v_web_id', 'value': 'verify_saved', 'domain': '.tiktok.com', 'path': '/', 'expires': 5000}
+    assert restored[1]['name'] == 'tt_csrf_token' and 'expires' not in restored[1]
+
+
+class RefreshingDriver(FakeSignerDriver):
+    ''' issues a new s_v_web_id once the restored cookies are deleted '''
+    def __init__(self):
+        super().__init__()
+        self.loaded = True
+        self.cookie = 'verify_saved'
+
+    def get(self, url):
+        super().get(url)
+        self.loaded = url != 'about:blank'
+
+    def get_cookie(self, name):
+        return {'name': name, 'value': self.cookie}
+
+    def get_cookies(self):
+        return [{'name': 's_v_web_id', 'value': self.cookie, 'domain': '.tiktok.com', 'path': '/'}]
+
+    def delete_all_cookies(self):
+        self.cookie = 'verify_fresh'
+
+
+def restored_tiktok(store, replies):
+    tt = fake_tiktok()
+    tt.driver = RefreshingDriver()
+    tt.session_store = store
+    tt._restored = tt._sessionSaved = True
+    tt.verifyFp = 'verify_saved'
+    tt.UserAgent = 'Mozilla/5.0 saved'
+    urls = []
+    tt._fetchJSON = lambda url: urls.append(url) or replies.pop(0)
+    return tt, urls
+
+
+def test_session_kept_while_accepted(tmp_path):
+    store = SessionStore(str(tmp_path / 'session.json'))
+    store.save('Mozilla/5.0 saved', 'verify_saved', COOKIES[1:])
+    tt, urls = restored_tiktok(store, [{'statusCode': 0}, {'statusCode': 0}])
+
+    tt._getSigned('https://m.tiktok.com/api/item_list/?count=1')
+    tt._getSigned('https://m.tiktok.com/api/item_list/?count=2')
+    assert all('verifyFp=verify_saved' in url for url in urls)
+    assert tt.driver.navigations == 0, 'Signer page reloaded for an accepted session'
+    assert store.load()['saved_at'] is not None and tt._restored
+
+
+def test_session_refreshed_when_rejected(tmp_path):
+    store = SessionStore(str(tmp_path / 'session.json'))
+    store.save('Mozilla/5.0 saved', 'verify_saved', COOKIES[1:])
+    tt, urls = restored_tiktok(store, [{'statusCode': 10000}, {'statusCode': 0}])
+
+    assert tt._getSigned('https://m.tiktok.com/api/item_list/?count=1') == {'statusCode': 0}
+    assert 'verifyFp=verify_saved' in urls[0] and 'verifyFp=verify_fresh' in urls[1]
+    assert tt.driver.navigations == 2, 'Signer page not reloaded after rejection'
+    assert not tt._restored
+
+    # the fresh session replaces the rejected one on disk
+    with open(store.path) as file:
+        session = json.load(file)
+    assert session['verifyFp'] == 'verify_fresh'
+    assert session['cookies'] == [{'name': 's_v_web_id', 'value': 'verify_fresh', 'domain': '.tiktok.com', 'path': '/'}]
+
+
+def test_session_kept_on_transient_errors(tmp_path):
+    import requests
+    store = SessionStore(str(tmp_path / 'session.json'))
+    store.save('Mozilla/5.0 saved', 'verify_saved', COOKIES[1:])
+    tt, urls = restored_tiktok(store, [])
+
+    def http_error(status):
+        response = requests.Response()
+        response.status_code = status
+        return requests.HTTPError(f'{status}', response=response)
+
+    errors = [requests.ConnectionError('reset'), requests.Timeout('timeout'), http_error(503), http_error(429)]
+    replies = errors + [http_error(403), {'statusCode': 0}]
+
+    def fetch(url):
+        urls.append(url)
+        reply = replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    tt._fetchJSON = fetch
+    assert tt._getSigned('https://m.tiktok.com/api/item_list/?count=1') == {'statusCode': 0}
+    assert all('verifyFp=verify_saved' in url for url in urls[:5]), 'Session dropped on a transient error'
+    assert 'verifyFp=verify_fresh' in urls[5], 'Session kept after a 403'
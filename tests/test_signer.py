@@ -0,0 +1,91 @@
+import os, sys, shutil, time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+import api
+from api import TikTok
+from signer import JSSigner, NodeRuntime, load_script, make_verify_fp
+
+# stand-in for acrawler.js, reading the shimmed browser globals like the real script does
+STAND_IN = '''
+window.byted_acrawler = {
+    sign: function (options) {
+        return 'sig_' + navigator.userAgent.length + '_' + document.cookie.split('=')[1].length + '_' + options.url.length;
+    }
+};
+'''
+
+needs_node = pytest.mark.skipif(shutil.which('node') is None and shutil.which('nodejs') is None, reason='node not installed')
+
+
+@needs_node
+def test_node_signer_batches():
+    signer = JSSigner(script=STAND_IN, runtime=NodeRuntime)
+    signer.start('Mozilla/5.0 test')
+    try:
+        assert signer.verifyFp.startswith('verify_')
+        fp = len(signer.verifyFp)
+        assert signer.sign_many(['a', 'bb']) == [f'sig_16_{fp}_1', f'sig_16_{fp}_2']
+        assert signer.healthy()
+        assert signer.cookies()[0]['value'] == signer.verifyFp
+    finally:
+        signer.close()
+    assert not signer.healthy()
+
+
+@needs_node
+def test_dead_runtime_restarted():
+    signer = JSSigner(script=STAND_IN, runtime=NodeRuntime)
+    signer.start('Mozilla/5.0 test')
+    try:
+        fp = len(signer.verifyFp)
+        signer.runtime.process.kill()
+        signer.runtime.process.wait()
+        assert not signer.healthy()
+        assert signer.sign_many(['a']) == [f'sig_16_{fp}_1'], 'Signer not restarted after node died'
+        assert signer.healthy()
+    finally:
+        signer.close()
+
+
+@needs_node
+def test_hung_node_killed_on_close(monkeypatch):
+    import signer as signer_module
+    import subprocess
+    monkeypatch.setattr(signer_module, 'NODE_CLOSE_TIMEOUT', 0.1)
+    runtime = NodeRuntime('var window = globalThis;' + STAND_IN)
+    runtime.close()
+    # a process that ignores EOF on stdin
+    runtime.process = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'], stdin=subprocess.PIPE, text=True)
+    runtime.close()
+    assert runtime.process.poll() is not None, 'Hung node left running'
+
+@needs_node
+def test_broken_script_fails_fast():
+    with pytest.raises(Exception, match='byted_acrawler'):
+        JSSigner(script='var nothing = 1;', runtime=NodeRuntime).start('Mozilla/5.0 test')
+
+
+@needs_node
+def test_tiktok_without_chrome(monkeypatch):
+    monkeypatch.setattr(api, 'getAllowedAgents', lambda: ['Mozilla/5.0 test'])
+    tt = TikTok(signer=JSSigner(script=STAND_IN, runtime=NodeRuntime))
+    try:
+        assert tt.driver is None and tt.http_fetch, 'Chrome started for embedded signer'
+        urls = []
+        tt._fetchJSON = lambda url: urls.append(url) or {'statusCode': 0, 'userInfo': {'user': {'secUid': 'abc'}}}
+        tt.getUserDetails('someone')
+        assert f'&verifyFp={tt.signer.verifyFp}&_signature=sig_' in urls[0]
+    finally:
+        tt.signer.close()
+
+
+def test_load_script_uses_fresh_cache(tmp_path):
+    cache_file = tmp_path / 'acrawler.js'
+    cache_file.write_text(STAND_IN)
+    assert load_script(cache_file=str(cache_file), url='http://127.0.0.1:9/unreachable') == STAND_IN
+
+    # stale copy is still better than no signer
+    old = time.time() - 48 * 3600
+    os.utime(cache_file, (old, old))
+    assert load_script(cache_file=str(cache_file), url='http://127.0.0.1:9/unreachable') == STAND_IN
+    assert make_verify_fp() != make_verify_fp()
@@ -0,0 +1,155 @@
+import os, sys, io, json, base64, hashlib, zipfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+import utils
+
+pytestmark = pytest.mark.skipif(os.name == 'nt', reason='fake Chrome is a shell script')
+
+DRIVER = b'\x7fELF fake chromedriver' * 1000
+ZIP_URL = 'https://storage.googleapis.com/chrome-for-testing-public/120.0.6099.109/linux64/chromedriver-linux64.zip'
+
+
+def make_zip() -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('chromedriver-linux64/LICENSE.chromedriver', 'license')
+        archive.writestr('chromedriver-linux64/chromedriver', DRIVER)
+    return buffer.getvalue()
+
+
+class FakeReply:
+    def __init__(self, body, headers=None):
+        self.body = body
+        self.headers = headers or {}
+        self.status_code = 200
+
+    def json(self):
+        return json.loads(self.body)
+
+    def iter_content(self, size):
+        for start in range(0, len(self.body), size):
+            yield self.body[start:start + size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def fake_get(archive, md5=None):
+    milestones = {'milestones': {'120': {'version': '120.0.6099.109', 'downloads': {'chromedriver': [
+        {'platform': 'linux64', 'url': ZIP_URL}, {'platform': 'win64', 'url': 'https://example.invalid/win64.zip'}]}}}}
+    md5 = md5 or hashlib.md5(archive).digest()
+    urls = []
+
+    def get(url, **kwargs):
+        urls.append(url)
+        if url == utils.CFT_URL:
+            return FakeReply(json.dumps(milestones))
+        assert kwargs.get('stream'), 'Driver zip buffered in memory'
+        return FakeReply(archive, {'Content-Length': str(len(archive)), 'x-goog-hash': f'crc32c=AAAAAA==,md5={base64.b64encode(md5).decode()}'})
+
+    return get, urls
+
+
+@pytest.fixture
+def chrome(tmp_path, monkeypatch):
+    path = tmp_path / 'chrome' / 'google-chrome'
+    path.parent.mkdir()
+    path.write_text('#!/bin/sh\necho "Google Chrome 120.0.6099.109"\n')
+    path.chmod(0o755)
+    monkeypatch.setattr(utils, 'find_chrome', lambda: str(path))
+    monkeypatch.setattr(utils.platform, 'system', lambda: 'Linux')
+    return path
+
+
+def test_provision_then_resolve_offline(tmp_path, chrome, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    get, urls = fake_get(make_zip())
+    monkeypatch.setattr(utils.requests, 'get', get)
+
+    path = utils.download_chromedriver(cache_dir)
+    assert path == os.path.join(cache_dir, '120.0.6099.109', 'chromedriver')
+    with open(path, 'rb') as file:
+        assert file.read() == DRIVER
+    assert os.access(path, os.X_OK)
+    assert urls == [utils.CFT_URL, ZIP_URL]
+    assert sorted(os.listdir(os.path.dirname(path))) == ['chromedriver'], 'Temporary files left behind'
+
+    manifest = utils.load_manifest(cache_dir)
+    assert manifest['chrome']['version'] == '120.0.6099.109'
+    assert manifest['drivers']['120']['sha256'] == hashlib.sha256(DRIVER).hexdigest()
+
+    # an up-to-date setup resolves without subprocess or network
+    def offline(*args, **kwargs):
+        raise AssertionError('Provisioning left the fast path')
+
+    monkeypatch.setattr(utils.requests, 'get', offline)
+    monkeypatch.setattr(utils.subprocess, 'check_output', offline)
+    assert utils.chromedriver_path(cache_dir) == path
+    assert utils.download_chromedriver(cache_dir) == path
+
+
+def test_chrome_update_within_major_reuses_driver(tmp_path, chrome, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    get, urls = fake_get(make_zip())
+    monkeypatch.setattr(utils.requests, 'get', get)
+    path = utils.download_chromedriver(cache_dir)
+
+    chrome.write_text('#!/bin/sh\necho "Google Chrome 120.0.6099.200"\n')
+    assert utils.chromedriver_path(cache_dir) is None, 'Stale fingerprint accepted'
+    assert utils.download_chromedriver(cache_dir) == path
+    assert len(urls) == 2, 'Driver of the same major downloaded again'
+    assert utils.load_manifest(cache_dir)['chrome']['version'] == '120.0.6099.200'
+
+
+def test_checksum_mismatch_leaves_nothing(tmp_path, chrome, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    get, urls = fake_get(make_zip(), md5=b'\0' * 16)
+    monkeypatch.setattr(utils.requests, 'get', get)
+
+    with pytest.raises(Exception, match='Checksum mismatch'):
+        utils.download_chromedriver(cache_dir)
+    assert os.listdir(os.path.join(cache_dir, '120.0.6099.109')) == []
+    assert utils.load_manifest(cache_dir) == {'drivers': {}}
+
+
+def test_altered_driver_is_provisioned_again(tmp_path, chrome, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    get, urls = fake_get(make_zip())
+    monkeypatch.setattr(utils.requests, 'get', get)
+    path = utils.download_chromedriver(cache_dir)
+
+    # same size, different bytes, checked by the first lookup of a new process
+    with open(path, 'r+b') as file:
+        file.write(b'\0')
+    utils._verified.clear()
+    assert utils.chromedriver_path(cache_dir) is None, 'Altered driver accepted'
+    assert utils.download_chromedriver(cache_dir) == path
+    assert len(urls) == 4
+    with open(path, 'rb') as file:
+        assert file.read() == DRIVER
+
+
+def test_local_driver_does_not_block_updates(tmp_path, chrome, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    get, urls = fake_get(make_zip())
+    monkeypatch.setattr(utils.requests, 'get', get)
+    # chromedriver left next to the scripts by the old layout
+    monkeypatch.setattr(utils, '__file__', str(tmp_path / 'utils.py'))
+    local = tmp_path / 'chromedriver'
+    local.write_bytes(b'old driver')
+    assert utils.chromedriver_path(cache_dir) == str(local)
+
+    # provisioning does not settle for a driver of unknown version
+    path = utils.download_chromedriver(cache_dir)
+    assert path != str(local) and len(urls) == 2
+    assert utils.chromedriver_path(cache_dir) == path
+
+    # Chrome was updated, the stale local driver must not win over provisioning
+    chrome.write_text('#!/bin/sh\necho "Google Chrome 121.0.6167.85"\n')
+    assert utils.chromedriver_path(cache_dir) is None, 'Stale local driver used after a Chrome update'
+
+    monkeypatch.setattr(utils, 'find_chrome', lambda: None)
+    assert utils.chromedriver_path(cache_dir) == str(local)
@@ -0,0 +1,248 @@
+import os, sys, asyncio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aiohttp import web
+import run
+from workers import SQLiteJobStore, HTTPJobStore, Worker, LeaseLost, job_server, scrape_payload, SCRAPE, DOWNLOAD
+from jobs import USER
+
+BODY = b'video' * 1000
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lease_is_exclusive_until_expiry(tmp_path):
+    clock = Clock()
+    with SQLiteJobStore(str(tmp_path / 'queue.sqlite'), clock=clock) as store:
+        store.put(DOWNLOAD, {'video_id': '1'}, key='u/1')
+        store.put(DOWNLOAD, {'video_id': '1'}, key='u/1')
+
+        job = store.lease([DOWNLOAD], 'a', ttl=60)
+        assert job['payload'] == {'video_id': '1'}
+        assert store.lease([DOWNLOAD], 'b', ttl=60) is None, 'Leased job handed out twice'
+
+        # heartbeat keeps it, a dead worker loses it once the lease expires
+        clock.now += 50
+        assert store.heartbeat(job['id'], 'a', ttl=60)
+        clock.now += 50
+        assert store.lease([DOWNLOAD], 'b', ttl=60) is None
+        clock.now += 20
+        taken = store.lease([DOWNLOAD], 'b', ttl=60)
+        assert taken['id'] == job['id'] and taken['attempts'] == 2
+
+        assert not store.heartbeat(job['id'], 'a', ttl=60)
+        assert not store.complete(job['id'], 'a'), 'Worker completed a lease it lost'
+        assert store.complete(job['id'], 'b')
+        assert store.active() == 0
+
+
+def test_fail_retries_then_gives_up(tmp_path):
+    with SQLiteJobStore(str(tmp_path / 'queue.sqlite'), max_attempts=2) as store:
+        store.put(SCRAPE, scrape_payload(USER, 'someone'), key='user:someone')
+        for _ in range(2):
+            job = store.lease([SCRAPE], 'a', ttl=60)
+            store.fail(job['id'], 'a', 'boom')
+        assert store.lease([SCRAPE], 'a', ttl=60) is None
+        assert store.counts() == {'scrape:failed': 1}
+
+
+def test_lost_lease_cancels_work(tmp_path):
+    clock = Clock()
+    with SQLiteJobStore(str(tmp_path / 'queue.sqlite'), clock=clock) as store:
+        store.put(DOWNLOAD, {'video_id': '1'}, key='u/1')
+        worker = Worker(store, worker_id='a', lease_ttl=0.03)
+
+        async def scenario():
+            heartbeat = asyncio.create_task(worker.heartbeat_loop())
+            try:
+                job = await worker._lease([DOWNLOAD])
+                # lease expires and another worker takes the job over
+                clock.now += 60
+                assert store.lease([DOWNLOAD], 'b', ttl=60) is not None
+                try:
+                    await asyncio.wait_for(worker._hold(job, asyncio.sleep(10)), 5)
+                except LeaseLost:
+                    return True
+                return False
+            finally:
+                heartbeat.cancel()
+
+        try:
+            assert asyncio.run(scenario()), 'Worker kept working on a job it lost'
+            assert not worker.held
+        finally:
+            worker._executor.shutdown()
+
+
+async def serve_video(request):
+    return web.Response(body=BODY)
+
+
+class FakeTikTok:
+    nextCursor = None
+
+
+async def fake_open_pages(tt, mode, username, count, predicate, cursor=0):
+    ''' two pages of one video each, pointing at local server '''
+    def pages():
+        for video_id in (1, 2):
+            tt.nextCursor = video_id if video_id < 2 else None
+            yield [{'id': video_id, 'video': {'downloadAddr': f'{URL}/{video_id}.mp4'}}]
+    return username, pages(), None
+
+
+URL = None
+
+
+async def run_workers(store_path):
+    global URL
+    app = web.Application()
+    app.router.add_get('/{name}', serve_video)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    URL = f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}'
+
+    stores = [SQLiteJobStore(store_path) for _ in range(2)]
+    try:
+        workers = [Worker(store, worker_id=f'w{i}', downloads=2, poll_interval=0.01, tiktok_factory=FakeTikTok)
+                   for i, store in enumerate(stores)]
+        await asyncio.wait_for(asyncio.gather(*[worker.run() for worker in workers]), 30)
+    finally:
+        for store in stores:
+            store.close()
+        await runner.cleanup()
+
+
+def test_workers_drain_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(run, 'DOWNLOADS_BASE_DIR', str(tmp_path / 'videos'))
+    monkeypatch.setattr(run, 'open_pages', fake_open_pages)
+    monkeypatch.setattr(run, 'download_headers', lambda: {})
+    store_path = str(tmp_path / 'queue.sqlite')
+    with SQLiteJobStore(store_path) as store:
+        store.put(SCRAPE, scrape_payload(USER, 'someone'), key='user:someone')
+
+    asyncio.run(run_workers(store_path))
+
+    assert sorted(os.listdir(tmp_path / 'videos' / 'someone')) == ['1.mp4', '2.mp4']
+    with SQLiteJobStore(store_path) as store:
+        assert store.counts() == {'download:done': 2, 'scrape:done': 1}
+
+
+class FullDisk:
+    ''' content store failing every ingest '''
+    def ingest(self, video_id, file_name):
+        raise OSError(28, 'No space left on device')
+
+    def close(self):
+        pass
+
+
+def test_failed_ingest_releases_job(tmp_path, monkeypatch):
+    monkeypatch.setattr(run, 'DOWNLOADS_BASE_DIR', str(tmp_path / 'videos'))
+    monkeypatch.setattr(run, 'download_headers', lambda: {})
+
+    async def scenario(store):
+        app = web.Application()
+        app.router.add_get('/{name}', serve_video)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        url = f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}'
+        try:
+            store.put_many(DOWNLOAD, [({'username': 'someone', 'video_id': str(video_id), 'url': f'{url}/{video_id}.mp4'}, f'someone/{video_id}')
+                                      for video_id in (1, 2)])
+            worker = Worker(store, worker_id='w', downloads=1, poll_interval=0.01)
+            worker.content = FullDisk()
+            await asyncio.wait_for(worker.run(), 30)
+        finally:
+            await runner.cleanup()
+
+    with SQLiteJobStore(str(tmp_path / 'queue.sqlite'), max_attempts=1) as store:
+        # the worker survives and moves on to the next job
+        asyncio.run(scenario(store))
+        assert store.counts() == {'download:failed': 2}, 'Failed ingest left the job leased'
+
+
+async def serve_store(store, token=None):
+    runner = web.AppRunner(job_server(store, token))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return runner, f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}'
+
+
+def test_http_store_shares_leases(tmp_path):
+    clock = Clock()
+
+    async def scenario(store):
+        loop = asyncio.get_event_loop()
+        runner, url = await serve_store(store, token='secret')
+        try:
+            def remote():
+                # two hosts talking to the same server
+                with HTTPJobStore(url, 'secret') as a, HTTPJobStore(url, 'secret') as b:
+                    a.put(DOWNLOAD, {'video_id': '1'}, key='u/1')
+                    b.put(DOWNLOAD, {'video_id': '1'}, key='u/1')
+                    job = a.lease([DOWNLOAD], 'a', 60)
+                    assert job['payload'] == {'video_id': '1'} and job['attempts'] == 1
+                    assert b.lease([DOWNLOAD], 'b', 60) is None, 'Leased job handed out twice'
+                    assert a.heartbeat(job['id'], 'a', 60) and not b.heartbeat(job['id'], 'b', 60)
+                    assert a.complete(job['id'], 'a')
+                    assert b.counts() == {'download:done': 1} and b.active() == 0
+
+                with HTTPJobStore(url, 'wrong') as intruder:
+                    try:
+                        intruder.active()
+                        return False
+                    except Exception:
+                        return True
+
+            return await loop.run_in_executor(None, remote)
+        finally:
+            await runner.cleanup()
+
+    with SQLiteJobStore(str(tmp_path / 'queue.sqlite'), clock=clock) as store:
+        assert asyncio.run(scenario(store)), 'Job server answered without the token'
+
+
+def test_workers_drain_http_store(tmp_path, monkeypatch):
+    global URL
+    monkeypatch.setattr(run, 'DOWNLOADS_BASE_DIR', str(tmp_path / 'videos'))
+    monkeypatch.setattr(run, 'open_pages', fake_open_pages)
+    monkeypatch.setattr(run, 'download_headers', lambda: {})
+
+    async def scenario(store):
+        global URL
+        app = web.Application()
+        app.router.add_get('/{name}', serve_video)
+        videos = web.AppRunner(app)
+        await videos.setup()
+        site = web.TCPSite(videos, '127.0.0.1', 0)
+        await site.start()
+        URL = f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}'
+        runner, url = await serve_store(store)
+
+        clients = [HTTPJobStore(url) for _ in range(2)]
+        try:
+            workers = [Worker(client, worker_id=f'w{i}', downloads=2, poll_interval=0.01, tiktok_factory=FakeTikTok)
+                       for i, client in enumerate(clients)]
+            await asyncio.wait_for(asyncio.gather(*[worker.run() for worker in workers]), 30)
+        finally:
+            for client in clients:
+                client.close()
+            await runner.cleanup()
+            await videos.cleanup()
+
+    with SQLiteJobStore(str(tmp_path / 'queue.sqlite')) as store:
+        store.put(SCRAPE, scrape_payload(USER, 'someone'), key='user:someone')
+        asyncio.run(scenario(store))
+        assert store.counts() == {'download:done': 2, 'scrape:done': 1}
+    assert sorted(os.listdir(tmp_path / 'videos' / 'someone')) == ['1.mp4', '2.mp4']
@@ -0,0 +1,33 @@
+import os, sys, asyncio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from writer import FileWriter
+
+
+def test_coalesced_preallocated_write(tmp_path):
+    file_name = str(tmp_path / 'video.mp4.part')
+    data = os.urandom(10000)
+
+    async def write():
+        async with FileWriter(file_name, buffer_size=4096) as file:
+            file.preallocate(20000)
+            for start in range(0, len(data), 1000):
+                await file.write(data[start:start + 1000])
+        return file
+
+    file = asyncio.run(write())
+    assert file.written == len(data)
+    assert open(file_name, 'rb').read() == data, 'Preallocated space not truncated'
+
+
+def test_append(tmp_path):
+    file_name = str(tmp_path / 'video.mp4.part')
+    with open(file_name, 'wb') as file:
+        file.write(b'abc')
+
+    async def write():
+        async with FileWriter(file_name, append=True) as file:
+            file.preallocate(10)
+            await file.write(b'def')
+
+    asyncio.run(write())
+    assert open(file_name, 'rb').read() == b'abcdef'
@@ -1,109 +1,301 @@
 #!/usr/bin/env python3
 import os
 import re
-import time
+import json
 import stat
+import base64
+import shutil
+import hashlib
 import subprocess
 import platform
 import requests
 from lxml import html
-from zipfile import ZipFile 
+from zipfile import ZipFile
 from urllib.parse import urlparse, urlunparse
 
 
+# shared on-disk cache, override with TIKTOK_CACHE_DIR
+CACHE_DIR = os.environ.get('TIKTOK_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+
+# chromedriver releases, one directory per release plus manifest.json
+DRIVER_DIR = os.path.join(CACHE_DIR, 'chromedriver')
+MANIFEST_FILE = 'manifest.json'
+
+# Chrome 115+ drivers are published as Chrome for Testing
+CFT_MILESTONE = 115
+CFT_URL = 'https://googlechromelabs.github.io/chrome-for-testing/latest-versions-per-milestone-with-downloads.json'
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+CHROME_PATHS = {
+    'Windows': [r'C:\Program Files (x86)\Google\Chrome\Application\chrome.exe', r'C:\Program Files\Google\Chrome\Application\chrome.exe'],
+    'Darwin': ['/Applications/Google Chrome.app/Contents/MacOS/Google Chrome', '/Applications/Chromium.app/Contents/MacOS/Chromium'],
+}
+CHROME_COMMANDS = ['google-chrome', 'google-chrome-stable', 'chromium-browser', 'chromium']
+
+
+def chromedriver_executable() -> str:
+    return 'chromedriver.exe' if platform.system() == 'Windows' else 'chromedriver'
+
+
+def find_chrome() -> str:
+    '''path of the installed Chrome or Chromium, None if not found'''
+    for path in CHROME_PATHS.get(platform.system(), []):
+        if os.path.exists(path):
+            return path
+    for command in CHROME_COMMANDS:
+        path = shutil.which(command)
+        if path:
+            return path
+    return None
+
+
+def chrome_fingerprint(chrome: str) -> list:
+    '''stat of the Chrome binary and its directory, both change when Chrome is updated'''
+    binary = os.path.realpath(chrome)
+    fingerprint = [binary]
+    for path in (binary, os.path.dirname(binary)):
+        info = os.stat(path)
+        fingerprint += [info.st_size, info.st_mtime_ns]
+    return fingerprint
+
+
+def load_manifest(cache_dir: str=DRIVER_DIR) -> dict:
+    '''{"chrome": {...}, "drivers": {major: {"release", "path", "size", "sha256"}}}, paths relative to cache_dir'''
+    try:
+        with open(os.path.join(cache_dir, MANIFEST_FILE), 'r') as file:
+            manifest = json.load(file)
+        manifest.setdefault('drivers', {})
+        return manifest
+    except (OSError, ValueError):
+        return {'drivers': {}}
+
+
+def save_manifest(manifest: dict, cache_dir: str=DRIVER_DIR) -> None:
+    '''merge into the manifest on disk, so workers provisioning other versions keep their entries'''
+    merged = load_manifest(cache_dir)
+    merged['drivers'].update(manifest['drivers'])
+    if 'chrome' in manifest:
+        merged['chrome'] = manifest['chrome']
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_file = os.path.join(cache_dir, f'{MANIFEST_FILE}.{os.getpid()}.tmp')
+    with open(tmp_file, 'w') as file:
+        json.dump(merged, file, indent=2)
+    os.replace(tmp_file, os.path.join(cache_dir, MANIFEST_FILE))
+
+
+# drivers whose sha256 matched the manifest in this process
+_verified = set()
+
+
+def _file_sha256(file_name: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as file:
+        for chunk in iter(lambda: file.read(DOWNLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cached_driver(entry: dict, cache_dir: str) -> str:
+    '''absolute path of a manifest entry, None if the binary is missing, truncated or altered'''
+    if not entry:
+        return None
+    path = os.path.join(cache_dir, entry['path'])
+    try:
+        if os.path.getsize(path) != entry['size']:
+            return None
+        # full checksum once per process, later lookups only compare the size
+        if path not in _verified:
+            if _file_sha256(path) != entry['sha256']:
+                print(f'Checksum mismatch for {path}, provisioning it again')
+                return None
+            _verified.add(path)
+        return path
+    except OSError:
+        return None
+
+
+def _provisioned_driver(manifest: dict, chrome: str, cache_dir: str) -> str:
+    '''driver the manifest holds for chrome, None if Chrome changed since it was provisioned'''
+    known = manifest.get('chrome')
+    if chrome is None or known is None or known['fingerprint'] != chrome_fingerprint(chrome):
+        return None
+    return _cached_driver(manifest['drivers'].get(known['version'].split('.')[0]), cache_dir)
+
+
+def chromedriver_path(cache_dir: str=DRIVER_DIR) -> str:
+    '''driver matching the installed Chrome, resolved from the manifest without subprocess or network'''
+    manifest = load_manifest(cache_dir)
+    chrome = find_chrome()
+    path = _provisioned_driver(manifest, chrome, cache_dir)
+    if path is not None:
+        return path
+
+    # driver placed next to the scripts by hand or by older versions, only used while nothing was provisioned
+    # or Chrome can't be found; after a Chrome update it would be stale and must not stop provisioning
+    if chrome is not None and (manifest.get('chrome') is not None or manifest['drivers']):
+        return None
+    local = os.path.join(os.path.dirname(os.path.abspath(__file__)), chromedriver_executable())
+    return local if os.path.exists(local) else None
+
+
 def has_chromedriver() -> bool:
-    '''check if chromedriver is present in current directory'''
-    executable = 'chromedriver.exe' if platform.system() == 'Windows' else 'chromedriver'
-    return os.path.exists(executable)
-    
+    '''check if a chromedriver for the installed Chrome is cached or present next to the scripts'''
+    return chromedriver_path() is not None
 
-def download_chromedriver() -> None:
-    '''Download released chromedriver'''
-    # check current chrome version
-    version = check_system_chrome_version()
-    print(f'Installed Chrome version: {version}\n')
-    # get available release of version
-    release = get_latest_release(version)
-    print(f'Available Chrome release: {release}\n')
 
-    # get system platform in order to determine filename to download
+def driver_platform(major: int) -> str:
+    '''platform name used in release file names'''
     sys_platform = platform.system()
-    
+    arm = platform.machine().lower() in ('arm64', 'aarch64')
     # Linux
     if sys_platform == 'Linux':
-        filename = 'chromedriver_linux64.zip'
+        return 'linux64'
     # Windows
-    elif sys_platform == 'Windows':
-        filename = 'chromedriver_win32.zip'
+    if sys_platform == 'Windows':
+        if major >= CFT_MILESTONE:
+            return 'win64' if platform.machine().endswith('64') else 'win32'
+        return 'win32'
     # Mac
-    else:
-        filename = 'chromedriver_mac64.zip'
+    if major >= CFT_MILESTONE:
+        return 'mac-arm64' if arm else 'mac-x64'
+    return 'mac_arm64' if arm and major >= 106 else 'mac64'
 
-    # build uri
-    uri = urlparse(f'https://chromedriver.storage.googleapis.com/{release}/')
-    uri = uri._replace(path=uri.path+filename)
+
+def get_driver_download(version: str) -> tuple:
+    '''(release, zip url) of the driver for a Chrome version'''
+    major = int(version.split('.')[0])
+    sys_platform = driver_platform(major)
+
+    if major >= CFT_MILESTONE:
+        reply = requests.get(CFT_URL, timeout=30)
+        assert reply.status_code == 200
+        milestone = reply.json()['milestones'].get(str(major))
+        if milestone is None:
+            raise Exception(f'No chromedriver released for Chrome {major}')
+        for download in milestone['downloads'].get('chromedriver', []):
+            if download['platform'] == sys_platform:
+                return milestone['version'], download['url']
+        raise Exception(f'No chromedriver {milestone["version"]} for {sys_platform}')
 
     # build url from uri
-    url = urlunparse(uri)
+    release = get_latest_release(version)
+    uri = urlparse(f'https://chromedriver.storage.googleapis.com/{release}/')
+    uri = uri._replace(path=uri.path+f'chromedriver_{sys_platform}.zip')
+    return release, urlunparse(uri)
 
-    # rename old files
-    executable = 'chromedriver.exe' if sys_platform == 'Windows' else 'chromedriver'
-    if has_chromedriver():
-        src = executable
-        dst = f'backup_{int(time.time())}_{executable}'
-        os.rename(src, dst)
 
-    # download zip file
-    print(f'Downloading: {url}\n')
-    reply = requests.get(url)
-    assert reply.status_code == 200
-    open(filename, 'wb').write(reply.content)
-    print('Download complete.\n')
+def stream_download(url: str, file_name: str) -> None:
+    '''stream url to file_name, verifying length and the md5 storage.googleapis.com sends in x-goog-hash'''
+    md5 = hashlib.md5()
+    size = 0
+    with requests.get(url, stream=True, timeout=60) as reply:
+        assert reply.status_code == 200
+        with open(file_name, 'wb') as file:
+            for chunk in reply.iter_content(DOWNLOAD_CHUNK_SIZE):
+                file.write(chunk)
+                md5.update(chunk)
+                size += len(chunk)
+
+        expected_size = reply.headers.get('Content-Length')
+        # requests decodes compressed bodies, so only identity encoded lengths compare
+        if expected_size is not None and not reply.headers.get('Content-Encoding') and int(expected_size) != size:
+            raise Exception(f'Truncated download of {url}: {size} of {expected_size} bytes')
+        hashes = dict(part.strip().split('=', 1) for part in reply.headers.get('x-goog-hash', '').split(',') if '=' in part)
+        if 'md5' in hashes and base64.b64decode(hashes['md5']) != md5.digest():
+            raise Exception(f'Checksum mismatch for {url}')
 
-    # unzip downloaded file
-    with ZipFile(filename, 'r') as zip:
-        print(f'Extracting: {filename}\n')
-        zip.printdir()
-        zip.extractall()
 
-    # set file permissions for Linux/Mac
-    if sys_platform != 'Windows':
-        # chmod 774 chromedriver
-        os.chmod(executable, stat.S_IRWXU | stat.S_IRWXG | stat.S_IROTH)
+def fetch_chromedriver(url: str, release: str, cache_dir: str=DRIVER_DIR) -> dict:
+    '''download and unpack a release into cache_dir/<release>, returns its manifest entry'''
+    executable = chromedriver_executable()
+    relative = os.path.join(release, executable)
+    path = os.path.join(cache_dir, relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
 
-    # delete zip file
-    os.remove(filename)
+    # download zip file next to its destination, unique per process
+    tmp_zip = f'{path}.{os.getpid()}.zip'
+    tmp_file = f'{path}.{os.getpid()}.tmp'
+    try:
+        print(f'Downloading: {url}\n')
+        stream_download(url, tmp_zip)
+        print('Download complete.\n')
 
+        # unzip only the driver, zip CRCs are checked while reading it
+        sha256 = hashlib.sha256()
+        with ZipFile(tmp_zip, 'r') as zip:
+            members = [name for name in zip.namelist() if os.path.basename(name) == executable]
+            if not members:
+                raise Exception(f'{executable} not found in {url}')
+            print(f'Extracting: {members[0]}\n')
+            with zip.open(members[0]) as source, open(tmp_file, 'wb') as target:
+                for chunk in iter(lambda: source.read(DOWNLOAD_CHUNK_SIZE), b''):
+                    target.write(chunk)
+                    sha256.update(chunk)
+
+        # set file permissions for Linux/Mac, chmod 774 chromedriver
+        if platform.system() != 'Windows':
+            os.chmod(tmp_file, stat.S_IRWXU | stat.S_IRWXG | stat.S_IROTH)
+
+        # workers provisioning at once both end up with a complete binary
+        os.replace(tmp_file, path)
+    finally:
+        for name in (tmp_zip, tmp_file):
+            if os.path.exists(name):
+                os.remove(name)
+
+    return {'release': release, 'path': relative, 'size': os.path.getsize(path), 'sha256': sha256.hexdigest()}
+
+
+def download_chromedriver(cache_dir: str=DRIVER_DIR) -> str:
+    '''Provision chromedriver for the installed Chrome into the shared cache, returns its path'''
+    # a driver next to the scripts doesn't count, its version is unknown
+    chrome = find_chrome()
+    path = _provisioned_driver(load_manifest(cache_dir), chrome, cache_dir)
+    if path is not None:
+        return path
+
+    if chrome is None:
+        raise Exception('Chrome not found, please install Google Chrome or Chromium.')
+
+    # check current chrome version
+    version = check_system_chrome_version(chrome)
+    print(f'Installed Chrome version: {version}\n')
+    major = version.split('.')[0]
+    manifest = load_manifest(cache_dir)
+    manifest['chrome'] = {'path': chrome, 'fingerprint': chrome_fingerprint(chrome), 'version': version}
+
+    # Chrome was updated within the same major version, driver still fits
+    entry = manifest['drivers'].get(major)
+    if _cached_driver(entry, cache_dir) is None:
+        # get available release of version
+        release, url = get_driver_download(version)
+        print(f'Available Chrome release: {release}\n')
+        entry = manifest['drivers'][major] = fetch_chromedriver(url, release, cache_dir)
+
+    save_manifest(manifest, cache_dir)
     print('\nDone!\n')
+    return os.path.join(cache_dir, entry['path'])
 
 
-def check_system_chrome_version() -> str:
+def check_system_chrome_version(chrome: str=None) -> str:
     sys_platform = platform.system()
+    chrome = chrome or find_chrome()
 
     # Windows
     if sys_platform == 'Windows':
-        # Try searching for 32-bit installation
-        try:
-            cmd = 'dir /B/AD "C:\Program Files (x86)\Google\Chrome\Application\"|findstr /R /C:"^[0-9].*\..*[0-9]$"'
-            version = subprocess.check_output(cmd, shell=True).decode().strip()
-        # Try searching for 64-bit installation
-        except:
-            cmd = 'dir /B/AD "C:\Program Files\Google\Chrome\Application\"|findstr /R /C:"^[0-9].*\..*[0-9]$"'
-            version = subprocess.check_output(cmd, shell=True).decode().strip()
+        # version directories next to chrome.exe, no shell needed
+        application = os.path.dirname(chrome) if chrome else r'C:\Program Files (x86)\Google\Chrome\Application'
+        versions = [name for name in os.listdir(application) if re.match(r'^\d+(\.\d+)+$', name)]
 
         # get the latest version from results
-        version = version.split()[-1]
+        version = max(versions, key=lambda name: [int(part) for part in name.split('.')])
 
     # Linux/Mac
     else:
-        cmd = 'google-chrome --version'
-        result = os.popen(cmd).read()
-
-        # if no results, try chromium browser
-        if not result:
-            cmd = 'chromium-browser --version'
-            result = os.popen(cmd).read()
-
+        if chrome is None:
+            raise Exception('Chrome not found, please install Google Chrome or Chromium.')
+        result = subprocess.check_output([chrome, '--version']).decode()
         version = result.strip().split()[-1]
 
     # return version string to caller
@@ -116,7 +308,7 @@ def get_latest_release(version:str) -> str:
     reply = requests.get(url)
     assert reply.status_code == 200
     latest_relase = reply.text
-    return latest_relase 
+    return latest_relase
 
 
 if __name__ == '__main__':
@@ -0,0 +1,600 @@
+#!/usr/bin/python3
+
+''' Multi-process worker mode pulling leased jobs from a shared store, local or served to other hosts '''
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import asyncio
+import argparse
+import threading
+import multiprocessing
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+import requests
+from aiohttp import web
+from jobs import parse_target, USER, HASHTAG, MUSIC, TRENDING
+from ledger import Ledger, DONE as LEDGER_DONE, FAILED as LEDGER_FAILED
+from filters import Predicate
+from content import ContentStore
+from metrics import export
+
+
+# job kinds
+SCRAPE = 'scrape'
+DOWNLOAD = 'download'
+
+# job statuses
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class LeaseLost(Exception):
+    ''' Raised in place of the result of a job whose lease went to another worker '''
+
+
+class JobStore(ABC):
+    ''' Interface of a shared job store, implementations must make lease() atomic across workers '''
+
+    def put(self, kind: str, payload: dict, key: str=None) -> None:
+        '''add job, jobs with an existing key are ignored'''
+        self.put_many(kind, [(payload, key)])
+
+    @abstractmethod
+    def put_many(self, kind: str, jobs: list) -> None:
+        '''add list of (payload, key) in one go'''
+
+    @abstractmethod
+    def lease(self, kinds: list, worker: str, ttl: float) -> dict:
+        '''take oldest pending or expired job of kinds for ttl seconds, None if there is none'''
+
+    @abstractmethod
+    def heartbeat(self, job_id: int, worker: str, ttl: float) -> bool:
+        '''extend lease, False if the lease was lost to another worker'''
+
+    @abstractmethod
+    def update(self, job_id: int, worker: str, payload: dict) -> bool:
+        '''store progress of a leased job'''
+
+    @abstractmethod
+    def complete(self, job_id: int, worker: str) -> bool:
+        '''mark leased job done, False if the lease was lost'''
+
+    @abstractmethod
+    def fail(self, job_id: int, worker: str, error: str) -> None:
+        '''release job for a retry, or fail it for good after max_attempts'''
+
+    @abstractmethod
+    def active(self) -> int:
+        '''number of pending or leased jobs'''
+
+    @abstractmethod
+    def counts(self) -> dict:
+        '''number of jobs per kind:status'''
+
+
+class SQLiteJobStore(JobStore):
+    ''' JobStore in a SQLite file, shared by the worker processes of one host, other hosts go through job_server() '''
+
+    # WAL needs shared memory between the processes, it is not supported on network filesystems
+    # where BEGIN IMMEDIATE would stop making leases exclusive, so the file must stay on a local disk
+
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        key TEXT UNIQUE,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL,
+        worker TEXT,
+        lease_until REAL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS tasks_lease ON tasks (kind, status, id);
+    '''
+
+    def __init__(self, path: str, max_attempts: int=5, clock=time.time):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self._lock = threading.Lock()
+
+        # autocommit mode, transactions are started explicitly
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(self.SCHEMA)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def _execute(self, query: str, params=()) -> sqlite3.Cursor:
+        with self._lock:
+            return self.conn.execute(query, params)
+
+
+    def put_many(self, kind: str, jobs: list) -> None:
+        now = self.clock()
+        rows = [(kind, key, json.dumps(payload), PENDING, now) for payload, key in jobs]
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.executemany('INSERT OR IGNORE INTO tasks (kind, key, payload, status, updated_at) VALUES (?, ?, ?, ?, ?)', rows)
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+
+
+    def lease(self, kinds: list, worker: str, ttl: float) -> dict:
+        now = self.clock()
+        placeholders = ','.join('?' * len(kinds))
+        with self._lock:
+            # write lock up front so two workers can't pick the same row
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute(f'''
+                    SELECT id, kind, payload, attempts FROM tasks
+                    WHERE kind IN ({placeholders}) AND (status = ? OR (status = ? AND lease_until < ?))
+                    ORDER BY id LIMIT 1
+                ''', (*kinds, PENDING, LEASED, now)).fetchone()
+                if row is not None:
+                    self.conn.execute('UPDATE tasks SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?',
+                                      (LEASED, worker, now + ttl, now, row[0]))
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+
+        if row is None:
+            return None
+        job_id, kind, payload, attempts = row
+        return {'id': job_id, 'kind': kind, 'payload': json.loads(payload), 'attempts': attempts + 1}
+
+
+    def heartbeat(self, job_id: int, worker: str, ttl: float) -> bool:
+        now = self.clock()
+        cursor = self._execute('UPDATE tasks SET lease_until = ?, updated_at = ? WHERE id = ? AND worker = ? AND status = ?',
+                               (now + ttl, now, job_id, worker, LEASED))
+        return cursor.rowcount == 1
+
+
+    def update(self, job_id: int, worker: str, payload: dict) -> bool:
+        cursor = self._execute('UPDATE tasks SET payload = ?, updated_at = ? WHERE id = ? AND worker = ? AND status = ?',
+                               (json.dumps(payload), self.clock(), job_id, worker, LEASED))
+        return cursor.rowcount == 1
+
+
+    def complete(self, job_id: int, worker: str) -> bool:
+        cursor = self._execute('UPDATE tasks SET status = ?, lease_until = NULL, updated_at = ? WHERE id = ? AND worker = ? AND status = ?',
+                               (DONE, self.clock(), job_id, worker, LEASED))
+        return cursor.rowcount == 1
+
+
+    def fail(self, job_id: int, worker: str, error: str) -> None:
+        self._execute('''
+            UPDATE tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ?, lease_until = NULL, updated_at = ?
+            WHERE id = ? AND worker = ? AND status = ?
+        ''', (self.max_attempts, FAILED, PENDING, error, self.clock(), job_id, worker, LEASED))
+
+
+    def active(self) -> int:
+        return self._execute('SELECT COUNT(*) FROM tasks WHERE status IN (?, ?)', (PENDING, LEASED)).fetchone()[0]
+
+
+    def counts(self) -> dict:
+        return dict(self._execute('SELECT kind || ":" || status, COUNT(*) FROM tasks GROUP BY kind, status').fetchall())
+
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+
+# JobStore methods a job server answers, POST /<method> with {"args": [...]}
+STORE_METHODS = ('put_many', 'lease', 'heartbeat', 'update', 'complete', 'fail', 'active', 'counts')
+
+
+def job_server(store: JobStore, token: str=None) -> web.Application:
+    '''HTTP front of a store, so workers on other hosts share its leases'''
+    # leases are taken under the store's clock and lock, the hosts' clocks don't matter
+    async def call(request):
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            raise web.HTTPUnauthorized()
+        method = request.match_info['method']
+        if method not in STORE_METHODS:
+            raise web.HTTPNotFound()
+        args = (await request.json())['args']
+        result = await asyncio.get_event_loop().run_in_executor(None, getattr(store, method), *args)
+        return web.json_response({'result': result})
+
+    app = web.Application()
+    app.router.add_post('/{method}', call)
+    return app
+
+
+class HTTPJobStore(JobStore):
+    ''' JobStore served by job_server(), usable from any host that reaches it '''
+
+    def __init__(self, url: str, token: str=None, timeout: float=30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        if token:
+            self.session.headers['Authorization'] = f'Bearer {token}'
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def _post(self, method: str, *args):
+        reply = self.session.post(f'{self.url}/{method}', json={'args': args}, timeout=self.timeout)
+        reply.raise_for_status()
+        return reply.json()['result']
+
+
+    def put_many(self, kind: str, jobs: list) -> None:
+        self._post('put_many', kind, [list(job) for job in jobs])
+
+
+    def lease(self, kinds: list, worker: str, ttl: float) -> dict:
+        return self._post('lease', list(kinds), worker, ttl)
+
+
+    def heartbeat(self, job_id: int, worker: str, ttl: float) -> bool:
+        return self._post('heartbeat', job_id, worker, ttl)
+
+
+    def update(self, job_id: int, worker: str, payload: dict) -> bool:
+        return self._post('update', job_id, worker, payload)
+
+
+    def complete(self, job_id: int, worker: str) -> bool:
+        return self._post('complete', job_id, worker)
+
+
+    def fail(self, job_id: int, worker: str, error: str) -> None:
+        self._post('fail', job_id, worker, error)
+
+
+    def active(self) -> int:
+        return self._post('active')
+
+
+    def counts(self) -> dict:
+        return self._post('counts')
+
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def open_store(spec: str, token: str=None) -> JobStore:
+    '''HTTPJobStore of an http(s) url, SQLiteJobStore of a local path'''
+    if spec.startswith(('http://', 'https://')):
+        return HTTPJobStore(spec, token)
+    return SQLiteJobStore(spec)
+
+
+def scrape_payload(kind: str, target: str, count: int=-1) -> dict:
+    return {'kind': kind, 'target': target, 'count': count, 'cursor': 0, 'items': 0}
+
+
+class Worker:
+    ''' One scrape loop and several download loops, each worker owning its TikTok and aiohttp session '''
+
+    def __init__(self, store: JobStore, worker_id: str=None, downloads: int=4, lease_ttl: float=120,
+                 poll_interval: float=1.0, predicate: Predicate=None, tiktok_factory=None, ledger_path: str=None,
+                 content_path: str=None):
+        self.store = store
+        self.worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+        self.downloads = downloads
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.predicate = predicate
+        self.tiktok_factory = tiktok_factory
+        self.ledger_path = ledger_path
+        self.content_path = content_path
+        self.content = None
+
+        self.tt = None
+        # leased job id -> task doing its work, None until the work started
+        self.held = {}
+        self.lost = set()
+
+        # store calls block on SQLite locks, keep them off the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='store')
+
+
+    async def _call(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._executor, func, *args)
+
+
+    async def _lease(self, kinds: list) -> dict:
+        try:
+            job = await self._call(self.store.lease, kinds, self.worker_id, self.lease_ttl)
+        except Exception as e:
+            # job server restarting or database locked, poll again later
+            print(f'[ {self.worker_id} ] lease failed: {e}')
+            return None
+        if job is not None:
+            self.held[job['id']] = None
+        return job
+
+
+    async def _hold(self, job: dict, coro):
+        '''run the work of a leased job as its own task, so losing the lease can cancel it'''
+        task = asyncio.ensure_future(coro)
+        self.held[job['id']] = task
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if job['id'] in self.lost:
+                self.lost.discard(job['id'])
+                raise LeaseLost(f"lost lease of job {job['id']}")
+            raise
+        finally:
+            # a lost job is no longer held, never complete or fail it
+            self.held.pop(job['id'], None)
+
+
+    async def _release(self, job: dict, error: str=None) -> None:
+        self.held.pop(job['id'], None)
+        try:
+            if error is None:
+                await self._call(self.store.complete, job['id'], self.worker_id)
+            else:
+                await self._call(self.store.fail, job['id'], self.worker_id, error)
+        except Exception as e:
+            # the lease expires and the job is done again by whoever takes it next
+            print(f"[ {self.worker_id} ] release of job {job['id']} failed: {e}")
+
+
+    async def _idle(self) -> bool:
+        '''wait a poll interval, True once the store has nothing left to do'''
+        try:
+            if not self.held and not await self._call(self.store.active):
+                return True
+        except Exception as e:
+            print(f'[ {self.worker_id} ] store unreachable: {e}')
+        await asyncio.sleep(self.poll_interval)
+        return False
+
+
+    async def heartbeat_loop(self) -> None:
+        '''renew leases of held jobs well before they expire, stopping the work of lost ones'''
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            for job_id in list(self.held):
+                try:
+                    renewed = await self._call(self.store.heartbeat, job_id, self.worker_id, self.lease_ttl)
+                except Exception as e:
+                    # unknown outcome, try again next round while the lease still runs
+                    print(f'[ {self.worker_id} ] heartbeat of job {job_id} failed: {e}')
+                    continue
+                if not renewed:
+                    print(f'[ {self.worker_id} ] lost lease of job {job_id}')
+                    # another worker owns the job now, e.g. writing the same .part file
+                    task = self.held.pop(job_id, None)
+                    if task is not None and not task.done():
+                        self.lost.add(job_id)
+                        task.cancel()
+
+
+    def _tiktok(self):
+        '''start Chrome only once this worker actually gets a scrape job'''
+        if self.tt is None:
+            if self.tiktok_factory is not None:
+                self.tt = self.tiktok_factory()
+            else:
+                from run import new_tiktok
+                self.tt = new_tiktok()
+        return self.tt
+
+
+    def _link_stored(self, username: str, page: list) -> list:
+        '''link videos the content store already has, returns the items left to download'''
+        from run import DOWNLOADS_BASE_DIR
+        if self.content is None:
+            return page
+        stored = self.content.lookup(item['id'] for item in page)
+        linked = {video_id for video_id, digest in stored.items()
+                  if self.content.link(video_id, f'{DOWNLOADS_BASE_DIR}/{username}/{video_id}.mp4', digest)}
+        return [item for item in page if str(item['id']) not in linked]
+
+
+    async def run_scrape(self, job: dict) -> None:
+        '''paginate target from its stored cursor, turning every page into download jobs'''
+        from run import Scrape, open_pages
+        modes = {USER: Scrape.USER, HASHTAG: Scrape.HASHTAG, MUSIC: Scrape.MUSIC, TRENDING: Scrape.TRENDING}
+
+        payload = job['payload']
+        count = payload['count'] - payload['items'] if payload['count'] >= 0 else -1
+        if payload['count'] >= 0 and count <= 0:
+            return
+
+        tt = self._tiktok()
+        loop = asyncio.get_event_loop()
+        username, pages, _ = await open_pages(tt, modes[payload['kind']], payload['target'], count, self.predicate, cursor=payload['cursor'])
+
+        done = object()
+        while True:
+            page = await loop.run_in_executor(None, next, pages, done)
+            if page is done:
+                break
+
+            # videos already in the content store are linked, not queued
+            items = await loop.run_in_executor(None, self._link_stored, username, page)
+            downloads = [({'username': username, 'video_id': str(item['id']), 'url': item['video']['downloadAddr']}, f"{username}/{item['id']}")
+                         for item in items]
+            await self._call(self.store.put_many, DOWNLOAD, downloads)
+
+            # downloads are stored before progress, a re-leased job never skips a page
+            payload['cursor'] = tt.nextCursor or 0
+            payload['items'] += len(page)
+            await self._call(self.store.update, job['id'], self.worker_id, payload)
+
+
+    async def scrape_loop(self) -> None:
+        while True:
+            job = await self._lease([SCRAPE])
+            if job is None:
+                if await self._idle():
+                    return
+                continue
+
+            print(f"[ {self.worker_id} ] scrape {job['payload']['kind']} {job['payload']['target']}")
+            try:
+                await self._hold(job, self.run_scrape(job))
+                await self._release(job)
+            except LeaseLost as e:
+                print(f"[ {self.worker_id} ] scrape stopped, {e}")
+            except Exception as e:
+                print(f"[ {self.worker_id} ] scrape FAILED: {e}")
+                await self._release(job, str(e))
+
+
+    async def download_loop(self, session, ledger: Ledger=None) -> None:
+        from run import DOWNLOADS_BASE_DIR, download_video
+        while True:
+            job = await self._lease([DOWNLOAD])
+            if job is None:
+                if await self._idle():
+                    return
+                continue
+
+            payload = job['payload']
+            username, video_id, url = payload['username'], payload['video_id'], payload['url']
+            os.makedirs(f'{DOWNLOADS_BASE_DIR}/{username}', exist_ok=True)
+            file_name = f'{DOWNLOADS_BASE_DIR}/{username}/{video_id}.mp4'
+
+            try:
+                ok = await self._hold(job, download_video(session, file_name, username, video_id, url))
+            except LeaseLost as e:
+                print(f"[ {self.worker_id} ] download stopped, {e}")
+                continue
+
+            # e.g. ENOSPC while ingesting or a ledger locked by other processes, the job is retried
+            # and this loop goes on with the next one
+            try:
+                if ok:
+                    digest = None
+                    if self.content is not None:
+                        digest = await asyncio.get_event_loop().run_in_executor(None, self.content.ingest, video_id, file_name)
+                    if ledger is not None:
+                        ledger.record(video_id, username, LEDGER_DONE, url=url, size=os.path.getsize(file_name), hash=digest)
+                elif ledger is not None:
+                    ledger.record(video_id, username, LEDGER_FAILED, url=url)
+            except Exception as e:
+                print(f"[ {self.worker_id} ] download FAILED: {e}")
+                await self._release(job, str(e))
+                continue
+
+            await self._release(job, None if ok else f'download failed: {url}')
+
+
+    async def run(self) -> None:
+        '''work until the store has no pending or leased jobs left'''
+        from run import download_headers
+        ledger = Ledger(self.ledger_path) if self.ledger_path else None
+        if self.content_path:
+            self.content = ContentStore(self.content_path)
+        heartbeat = asyncio.create_task(self.heartbeat_loop())
+        try:
+            async with aiohttp.ClientSession(headers=download_headers()) as session:
+                await asyncio.gather(self.scrape_loop(), *[self.download_loop(session, ledger) for _ in range(self.downloads)])
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+            if ledger is not None:
+                ledger.close()
+            if self.content is not None:
+                self.content.close()
+                self.content = None
+            self._executor.shutdown()
+            self.tt = None
+
+
+def run_worker(store_path: str, downloads: int, ledger_path: str=None, content_path: str=None,
+               metrics_port: int=None, metrics_file: str=None, token: str=None) -> None:
+    '''entry point of one worker process, store_path is a SQLite file or a job server url'''
+    store = open_store(store_path, token)
+    stop_metrics = export(metrics_port, metrics_file)
+    try:
+        asyncio.run(Worker(store, downloads=downloads, ledger_path=ledger_path, content_path=content_path).run())
+    finally:
+        stop_metrics()
+        store.close()
+
+
+def main(argv=None):
+    from run import DOWNLOADS_BASE_DIR, LEDGER_PATH, CONTENT_PATH
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--store', default=f'{DOWNLOADS_BASE_DIR}/queue.sqlite', help='shared job store, a SQLite file or http://host:port of a job server')
+    parser.add_argument('--serve', metavar='HOST:PORT', help='serve the SQLite store to workers on other hosts')
+    parser.add_argument('--token', default=os.environ.get('TIKTOK_JOBS_TOKEN'), help='shared secret of the job server, defaults to TIKTOK_JOBS_TOKEN')
+    parser.add_argument('--add', metavar='TARGETS', help='queue targets from file (@user, #hashtag, music:id, trending)')
+    parser.add_argument('--count', type=int, default=-1, help='videos per target, -1 for all possible')
+    parser.add_argument('--processes', type=int, default=1, help='worker processes to start on this host, 0 to only queue')
+    parser.add_argument('--downloads', type=int, default=4, help='concurrent downloads per worker')
+    parser.add_argument('--metrics-port', type=int, help='first port serving /metrics, one port per process')
+    parser.add_argument('--metrics-file', help='JSON metrics snapshot, suffixed with the process number')
+    args = parser.parse_args(argv)
+
+    if args.serve and args.store.startswith(('http://', 'https://')):
+        raise Exception('--serve needs a local SQLite --store')
+
+    if args.add:
+        store = open_store(args.store, args.token)
+        with open(args.add, 'r') as file:
+            targets = [target for target in map(parse_target, file) if target]
+        store.put_many(SCRAPE, [(scrape_payload(kind, target, args.count), f'{kind}:{target}') for kind, target in targets])
+        print(f'Queued {len(targets)} targets, {store.counts()}')
+        store.close()
+
+    # metrics are per process, each gets its own port and snapshot file
+    processes = [multiprocessing.Process(target=run_worker, args=(
+                     args.store, args.downloads, LEDGER_PATH, CONTENT_PATH,
+                     args.metrics_port + index if args.metrics_port is not None else None,
+                     f'{args.metrics_file}.{index}' if args.metrics_file else None, args.token))
+                 for index in range(args.processes)]
+    for process in processes:
+        process.start()
+
+    # serve until interrupted, local processes keep using the file directly
+    if args.serve:
+        host, port = args.serve.rsplit(':', 1)
+        with SQLiteJobStore(args.store) as store:
+            print(f'Serving {args.store} on http://{args.serve}')
+            web.run_app(job_server(store, args.token), host=host, port=int(port), print=None)
+
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    assert sys.version_info >= (3, 7), 'Python 3.7+ required.'
+    main()
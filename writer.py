@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+''' Buffered file writer for downloads, coalescing chunks into few large writes '''
+
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+READ_CHUNK_SIZE = 1 << 20       # bytes requested per network read
+WRITE_BUFFER_SIZE = 4 << 20     # bytes coalesced before each disk write
+WRITER_THREADS = 1              # dedicated threads doing the os.write calls
+
+_executor = None
+
+
+def writer_executor() -> ThreadPoolExecutor:
+    '''dedicated writer thread pool, separate from the default executor used for API calls'''
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=WRITER_THREADS, thread_name_prefix='writer')
+    return _executor
+
+
+def _write_all(fd: int, data) -> None:
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+class FileWriter:
+    ''' Async file writer doing one thread hop per buffer_size bytes instead of per chunk '''
+
+    def __init__(self, file_name: str, append: bool=False, buffer_size: int=WRITE_BUFFER_SIZE, executor=None):
+        self.file_name = file_name
+        self.append = append
+        self.buffer_size = buffer_size
+        self.executor = executor if executor is not None else writer_executor()
+        self.written = 0
+        self.preallocated = False
+        self._buffer = bytearray()
+        self._fd = None
+
+
+    async def __aenter__(self):
+        # no O_APPEND, it would make writes ignore the preallocated region
+        flags = os.O_WRONLY | os.O_CREAT | (0 if self.append else os.O_TRUNC)
+        self._fd = os.open(self.file_name, flags | getattr(os, 'O_BINARY', 0), 0o644)
+        self._start = os.lseek(self._fd, 0, os.SEEK_END) if self.append else 0
+        return self
+
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+    def preallocate(self, size: int) -> bool:
+        '''reserve size bytes on disk to avoid fragmentation, False if unsupported'''
+        if not hasattr(os, 'posix_fallocate') or size <= 0:
+            return False
+        try:
+            os.posix_fallocate(self._fd, self._start, size)
+        except OSError:
+            return False
+        self.preallocated = True
+        return True
+
+
+    async def write(self, data) -> None:
+        self._buffer += data
+        if len(self._buffer) >= self.buffer_size:
+            await self.flush()
+
+
+    async def flush(self) -> None:
+        if not self._buffer:
+            return
+        data, self._buffer = self._buffer, bytearray()
+        # writes of one file are serialized, so the file offset simply advances
+        await asyncio.get_event_loop().run_in_executor(self.executor, _write_all, self._fd, data)
+        self.written += len(data)
+
+
+    async def close(self) -> None:
+        if self._fd is None:
+            return
+        try:
+            await self.flush()
+            # drop unused preallocated space so the file size matches what was written
+            if self.preallocated:
+                os.ftruncate(self._fd, self._start + self.written)
+        finally:
+            os.close(self._fd)
+            self._fd = None